@@ -2,10 +2,34 @@ import json
 
 import frappe
 import frappe.utils
+from frappe import _
+
+from frappe_gmail_thread.utils.cold_storage import load_email_body
+
+# most recent emails of the linked threads shown in the timeline of a document, older ones are
+# left to the thread forms
+TIMELINE_EMAILS_LIMIT = 100
+TIMELINE_EMAIL_FIELDS = [
+    "name",
+    "parent",
+    "creation",
+    "sender",
+    "sender_full_name",
+    "recipients",
+    "cc",
+    "bcc",
+    "subject",
+    "content",
+    "sent_or_received",
+    "read_by_recipient",
+    "attachments_data",
+    "body_archived",
+    "body_archive_path",
+]
 
 
 def get_attachments_data(email):
-    attachments_data = json.loads(email.attachments_data)
+    attachments_data = json.loads(email.attachments_data or "[]")
     # instead of using file_url from attachments_data, we have to use frappe.get_value to get the latest file_url
     for attachment in attachments_data:
         file_doc_name = attachment.get("file_doc_name")
@@ -17,71 +41,134 @@ def get_attachments_data(email):
 
 @frappe.whitelist()
 def get_linked_gmail_threads(doctype, docname):
-    gmail_threads = frappe.get_all(
-        "Gmail Thread",
+    gmail_threads = {
+        thread: frappe.get_doc("Gmail Thread", thread)
+        for thread in frappe.get_all(
+            "Gmail Thread",
+            filters={
+                "reference_doctype": doctype,
+                "reference_name": docname,
+            },
+            pluck="name",
+        )
+    }
+    if not gmail_threads:
+        return []
+    emails = frappe.get_all(
+        "Single Email CT",
         filters={
-            "reference_doctype": doctype,
-            "reference_name": docname,
+            "parent": ["in", list(gmail_threads)],
+            "parenttype": "Gmail Thread",
+            "removed_from_gmail": 0,
         },
+        fields=TIMELINE_EMAIL_FIELDS,
+        order_by="date_and_time desc, idx desc",
+        page_length=TIMELINE_EMAILS_LIMIT,
     )
     data = []
-    for thread in gmail_threads:
-        thread = frappe.get_doc("Gmail Thread", thread.name)
-        for email in thread.emails:
-            t_data = {
-                "icon": "mail",
-                "icon_size": "sm",
-                "creation": email.creation,
-                "is_card": True,
-                "doctype": "Gmail Thread",
-                "id": f"gmail-thread-{thread.name}",
-                "template": "timeline_message_box",
-                "owner": email.sender,
-                "template_data": {
-                    "doc": {
-                        "name": thread.name,
-                        "communication_type": "Gmail Thread",
-                        "communication_medium": "Email",
-                        "comment_type": "",
-                        "communication_date": email.creation,
-                        "content": email.content,
-                        "sender": email.sender,
-                        "sender_full_name": email.sender_full_name,
-                        "cc": email.cc,
-                        "bcc": email.bcc,
-                        "creation": email.creation,
-                        "subject": email.subject,
-                        "delivery_status": (
-                            "Sent" if email.sent_or_received == "Sent" else "Received"
-                        ),
-                        "_liked_by": thread._liked_by,
-                        "reference_doctype": thread.reference_doctype,
-                        "reference_name": thread.reference_name,
-                        "read_by_recipient": email.read_by_recipient,
-                        "rating": 0,  # TODO: add rating
-                        "recipients": email.recipients,
-                        "attachments": get_attachments_data(email),
-                        "_url": thread.get_url(),
-                        "_doc_status": (
-                            "Sent" if email.sent_or_received == "Sent" else "Received"
-                        ),
-                        "_doc_status_indicator": (
-                            "green" if email.sent_or_received == "Sent" else "blue"
-                        ),
-                        "owner": email.sender,
-                        "user_full_name": email.sender_full_name,
-                    }
-                },
-                "name": thread.name,
-                "delivery_status": (
-                    "Sent" if email.sent_or_received == "Sent" else "Received"
-                ),
-            }
-            data.append(t_data)
+    for email in reversed(emails):
+        thread = gmail_threads[email.parent]
+        load_email_body(email)
+        t_data = {
+            "icon": "mail",
+            "icon_size": "sm",
+            "creation": email.creation,
+            "is_card": True,
+            "doctype": "Gmail Thread",
+            "id": f"gmail-thread-{thread.name}",
+            "template": "timeline_message_box",
+            "owner": email.sender,
+            "template_data": {
+                "doc": {
+                    "name": thread.name,
+                    "communication_type": "Gmail Thread",
+                    "communication_medium": "Email",
+                    "comment_type": "",
+                    "communication_date": email.creation,
+                    "content": email.content,
+                    "sender": email.sender,
+                    "sender_full_name": email.sender_full_name,
+                    "cc": email.cc,
+                    "bcc": email.bcc,
+                    "creation": email.creation,
+                    "subject": email.subject,
+                    "delivery_status": (
+                        "Sent" if email.sent_or_received == "Sent" else "Received"
+                    ),
+                    "_liked_by": thread._liked_by,
+                    "reference_doctype": thread.reference_doctype,
+                    "reference_name": thread.reference_name,
+                    "read_by_recipient": email.read_by_recipient,
+                    "rating": 0,  # TODO: add rating
+                    "recipients": email.recipients,
+                    "attachments": get_attachments_data(email),
+                    "_url": thread.get_url(),
+                    "_doc_status": (
+                        "Sent" if email.sent_or_received == "Sent" else "Received"
+                    ),
+                    "_doc_status_indicator": (
+                        "green" if email.sent_or_received == "Sent" else "blue"
+                    ),
+                    "owner": email.sender,
+                    "user_full_name": email.sender_full_name,
+                }
+            },
+            "name": thread.name,
+            "delivery_status": (
+                "Sent" if email.sent_or_received == "Sent" else "Received"
+            ),
+        }
+        data.append(t_data)
 
+    if len(emails) == TIMELINE_EMAILS_LIMIT:
+        hidden = get_hidden_emails_entry(gmail_threads, emails)
+        if hidden:
+            data.insert(0, hidden)
     return data
 
 
+def get_hidden_emails_entry(gmail_threads, emails):
+    """
+    Timeline entry, placed before the oldest email shown, linking to the threads with emails
+    left out of the timeline.
+    """
+    shown = {}
+    for email in emails:
+        shown[email.parent] = shown.get(email.parent, 0) + 1
+    hidden = {}
+    for thread in frappe.get_all(
+        "Single Email CT",
+        filters={
+            "parent": ["in", list(gmail_threads)],
+            "parenttype": "Gmail Thread",
+            "removed_from_gmail": 0,
+        },
+        fields=["parent", "count(name) as emails"],
+        group_by="parent",
+    ):
+        if thread.emails > shown.get(thread.parent, 0):
+            hidden[thread.parent] = thread.emails - shown.get(thread.parent, 0)
+    if not hidden:
+        return None
+    links = ", ".join(
+        '<a href="{}">{}</a>'.format(
+            gmail_threads[thread].get_url(),
+            frappe.utils.escape_html(
+                gmail_threads[thread].subject_of_first_mail or thread
+            ),
+        )
+        for thread in hidden
+    )
+    return {
+        "icon": "mail",
+        "icon_size": "sm",
+        "creation": frappe.utils.add_to_date(emails[-1].creation, seconds=-1),
+        "content": _(
+            "{0} older emails are only shown in their Gmail Thread: {1}"
+        ).format(sum(hidden.values()), links),
+    }
+
+
 @frappe.whitelist()
 def relink_gmail_thread(name, doctype, docname):
     thread = frappe.get_doc("Gmail Thread", name)
@@ -0,0 +1,108 @@
+import hmac
+import time
+from collections import defaultdict
+
+import frappe
+from frappe.utils.background_jobs import get_queues
+from rq.registry import StartedJobRegistry
+from werkzeug.wrappers import Response
+
+from frappe_gmail_thread.utils.metrics import COUNTERS_KEY, GAUGES_KEY, get_series
+
+SYNC_JOB_PREFIXES = ("gmail_thread_sync_", "gmail_thread_backfill_")
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+HELP = {
+    "gmail_thread_messages_ingested_total": "Messages stored by sync.",
+    "gmail_thread_duplicates_skipped_total": "Messages skipped because they were already stored.",
+    "gmail_thread_api_calls_total": "Gmail API calls made by sync.",
+    "gmail_thread_api_errors_total": "Gmail API and OAuth errors by reason.",
+    "gmail_thread_pubsub_notifications_total": "Pub/Sub notifications received.",
+    "gmail_thread_pubsub_deduped_total": "Pub/Sub notifications coalesced into an already queued sync.",
+    "gmail_thread_pubsub_invalid_total": "Malformed Pub/Sub notifications dropped.",
+    "gmail_thread_pubsub_unauthorized_total": "Pub/Sub pushes rejected for a missing or wrong verification token.",
+    "gmail_thread_pubsub_unverified_total": "Pub/Sub pushes accepted while no verification token is set.",
+    "gmail_thread_pubsub_account_notifications_total": "Pub/Sub notifications of each account.",
+    "gmail_thread_pubsub_unknown_total": "Pub/Sub notifications for an address without a system user.",
+    "gmail_thread_watch_lapsed_total": "Gmail watches found expired before they were renewed.",
+    "gmail_thread_history_expired_total": "Label history cursors found expired and caught up by date.",
+    "gmail_thread_backfill_restarted_total": "Backfills restarted by date after Gmail rejected their page token.",
+    "gmail_thread_last_ingested_timestamp_seconds": "Date of the last ingested message.",
+    "gmail_thread_last_sync_timestamp_seconds": "End of the last sync run.",
+    "gmail_thread_sync_lag_seconds": "Now minus the date of the last ingested message.",
+    "gmail_thread_poll_interval_seconds": "Current polling interval of the account.",
+    "gmail_thread_sync_jobs": "Sync jobs in the background queues.",
+}
+
+
+@frappe.whitelist(allow_guest=True, methods=["GET"])
+def get_metrics():
+    """
+    Sync health and throughput in the Prometheus text format.
+
+    Scrapers authenticate with `Authorization: Bearer <gmail_thread_metrics_token>` from site config,
+    otherwise a System Manager session is required.
+    """
+    check_metrics_access()
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def check_metrics_access():
+    token = frappe.conf.get("gmail_thread_metrics_token")
+    authorization = frappe.get_request_header("Authorization") or ""
+    if token and hmac.compare_digest(authorization, f"Bearer {token}"):
+        return
+    frappe.only_for("System Manager")
+
+
+def render_metrics():
+    series = defaultdict(dict)
+    for name, value in get_series(COUNTERS_KEY).items():
+        series[name.split("{")[0]][name] = value
+    gauges = get_series(GAUGES_KEY)
+    for name, value in gauges.items():
+        series[name.split("{")[0]][name] = value
+    now = time.time()
+    for name, value in gauges.items():
+        if name.startswith("gmail_thread_last_ingested_timestamp_seconds"):
+            lag = name.replace(
+                "gmail_thread_last_ingested_timestamp_seconds",
+                "gmail_thread_sync_lag_seconds",
+            )
+            series["gmail_thread_sync_lag_seconds"][lag] = max(now - value, 0)
+    for state, count in get_sync_queue_depth().items():
+        series["gmail_thread_sync_jobs"][
+            f'gmail_thread_sync_jobs{{state="{state}"}}'
+        ] = count
+
+    lines = []
+    for metric in sorted(series):
+        lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+        lines.append(
+            f"# TYPE {metric} {'counter' if metric.endswith('_total') else 'gauge'}"
+        )
+        for name, value in sorted(series[metric].items()):
+            lines.append(f"{name} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    # counters and epoch timestamps need every digit, Prometheus parses either form
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def get_sync_queue_depth():
+    prefix = tuple(f"{frappe.local.site}::{x}" for x in SYNC_JOB_PREFIXES)
+    depth = {"queued": 0, "started": 0}
+    for queue in get_queues():
+        depth["queued"] += sum(
+            1 for job_id in queue.get_job_ids() if job_id.startswith(prefix)
+        )
+        depth["started"] += sum(
+            1
+            for job_id in StartedJobRegistry(queue=queue).get_job_ids()
+            if job_id.startswith(prefix)
+        )
+    return depth
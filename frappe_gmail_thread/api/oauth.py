@@ -1,3 +1,5 @@
+from datetime import datetime, timezone
+from functools import partial
 from urllib.parse import quote
 
 import frappe
@@ -6,11 +8,37 @@ import google.oauth2.credentials
 import requests
 from frappe import _
 from frappe.integrations.google_oauth import GoogleOAuth
+from frappe.utils.data import convert_utc_to_system_timezone
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 
+from frappe_gmail_thread.utils.gmail_request import GmailRequest
+from frappe_gmail_thread.utils.metrics import record_api_error
+from frappe_gmail_thread.utils.rate_limiter import RateLimiter
+from frappe_gmail_thread.utils.transport import get_http, post
+
 SCOPES = "https://www.googleapis.com/auth/gmail.readonly"
 
 
+def get_oauth_url():
+    # overridable from site config, e.g. to point at `frappe_gmail_thread.benchmark.fake_gmail`
+    return frappe.conf.get("gmail_thread_oauth_url") or GoogleOAuth.OAUTH_URL
+
+
+def build_gmail(credentials, stats=None, limiter=None):
+    client_options = None
+    if frappe.conf.get("gmail_thread_api_endpoint"):
+        client_options = {"api_endpoint": frappe.conf.get("gmail_thread_api_endpoint")}
+    return build(
+        serviceName="gmail",
+        version="v1",
+        # keep-alive connections of the thread, shared by every client it builds
+        http=AuthorizedHttp(credentials, http=get_http()),
+        client_options=client_options,
+        requestBuilder=partial(GmailRequest, stats=stats, limiter=limiter),
+    )
+
+
 def get_authentication_url(client_id=None, redirect_uri=None):
     return {
         "url": "https://accounts.google.com/o/oauth2/v2/auth?access_type=offline&response_type=code&prompt=consent&client_id={}&include_granted_scopes=true&scope={}&redirect_uri={}".format(
@@ -77,13 +105,13 @@ def authorize_access(user, code=None, reauthorize=None):
                 "redirect_uri": redirect_uri,
                 "grant_type": "authorization_code",
             }
-            r = requests.post(GoogleOAuth.OAUTH_URL, data=data).json()
+            r = post(get_oauth_url(), data=data).json()
 
             if "refresh_token" in r:
                 credentials_dict = {
                     "token": r["access_token"],
                     "refresh_token": r["refresh_token"],
-                    "token_uri": GoogleOAuth.OAUTH_URL,
+                    "token_uri": get_oauth_url(),
                     "client_id": google_settings.client_id,
                     "client_secret": google_settings.get_password(
                         fieldname="client_secret", raise_exception=False
@@ -92,9 +120,7 @@ def authorize_access(user, code=None, reauthorize=None):
                 }
 
                 credentials = google.oauth2.credentials.Credentials(**credentials_dict)
-                gmail = build(
-                    serviceName="gmail", version="v1", credentials=credentials
-                )
+                gmail = build_gmail(credentials)
 
                 check_gmail_object(gmail_account, gmail)
 
@@ -140,7 +166,10 @@ def callback(code):
     authorize_access(user, code)
 
 
-def enable_pubsub(gmail_account):
+def enable_pubsub(gmail_account, gmail=None):
+    """
+    Start (or renew) the Gmail watch of the account and store when it expires.
+    """
     google_settings = frappe.get_single("Google Settings")
     if (
         not gmail_account.gmail_enabled
@@ -153,7 +182,8 @@ def enable_pubsub(gmail_account):
         )
     if not google_settings.custom_gmail_pubsub_topic:
         frappe.throw(_("Please configure PubSub in Google Settings."))
-    gmail = get_gmail_object(gmail_account)
+    if not gmail:
+        gmail = get_gmail_object(gmail_account)
     topic = google_settings.custom_gmail_pubsub_topic
     label_ids = [x.label_id for x in gmail_account.labels if x.enabled]
     if not label_ids:
@@ -165,7 +195,14 @@ def enable_pubsub(gmail_account):
         "topicName": topic,
         "labelFilterBehavior": "include",
     }
-    gmail.users().watch(userId="me", body=body).execute()
+    response = gmail.users().watch(userId="me", body=body).execute()
+    set_watch_expiration(
+        gmail_account,
+        convert_utc_to_system_timezone(
+            datetime.fromtimestamp(int(response["expiration"]) / 1000, timezone.utc)
+        ).replace(tzinfo=None),
+    )
+    return gmail_account.watch_expiration
 
 
 def disable_pubsub(gmail_account):
@@ -180,6 +217,19 @@ def disable_pubsub(gmail_account):
         frappe.throw(_("Please configure PubSub in Email Account."))
     gmail = get_gmail_object(gmail_account)
     gmail.users().stop(userId="me").execute()
+    set_watch_expiration(gmail_account, None)
+
+
+def set_watch_expiration(gmail_account, expiration):
+    # also called while the account is being saved, keep the document in step
+    gmail_account.watch_expiration = expiration
+    frappe.db.set_value(
+        "Gmail Account",
+        gmail_account.name,
+        "watch_expiration",
+        expiration,
+        update_modified=False,
+    )
 
 
 def get_access_token(gmail_account):
@@ -208,8 +258,8 @@ def get_access_token(gmail_account):
     }
 
     try:
-        r = requests.post(GoogleOAuth.OAUTH_URL, data=data).json()
-    except requests.exceptions.HTTPError:
+        r = post(get_oauth_url(), data=data).json()
+    except requests.exceptions.RequestException:
         button_label = frappe.bold(_("Authorize Gmail"))
         frappe.throw(
             _(
@@ -220,9 +270,12 @@ def get_access_token(gmail_account):
     return r.get("access_token")
 
 
-def get_gmail_object(gmail_account):
+def get_gmail_object(gmail_account, stats=None, check=True):
     """
     Returns an object of Google Mail along with Google Mail doc.
+    API calls made through it are recorded in `stats` (a `SyncStats`), if given, and are
+    throttled to the Gmail quota of the account. `check=False` skips verifying the mailbox
+    belongs to the linked user, which costs a getProfile call.
     """
     google_settings = frappe.get_doc("Google Settings")
     if isinstance(gmail_account, str):
@@ -235,7 +288,7 @@ def get_gmail_object(gmail_account):
         "refresh_token": account.get_password(
             fieldname="refresh_token", raise_exception=False
         ),
-        "token_uri": GoogleOAuth.OAUTH_URL,
+        "token_uri": get_oauth_url(),
         "client_id": google_settings.client_id,
         "client_secret": google_settings.get_password(
             fieldname="client_secret", raise_exception=False
@@ -244,9 +297,11 @@ def get_gmail_object(gmail_account):
     }
 
     credentials = google.oauth2.credentials.Credentials(**credentials_dict)
-    gmail = build(serviceName="gmail", version="v1", credentials=credentials)
+    limiter = RateLimiter(account.name, google_settings.client_id)
+    gmail = build_gmail(credentials, stats=stats, limiter=limiter)
 
-    check_gmail_object(account, gmail)
+    if check:
+        check_gmail_object(account, gmail)
 
     return gmail
 
@@ -259,6 +314,7 @@ def check_gmail_object(account, gmail):
         # check if email address is same as the email account email
     except Exception as e:
         if "invalid_grant" in str(e):
+            record_api_error(account.name, "invalid_grant")
             button_label = frappe.bold(_("Authorize Gmail"))
             frappe.throw(
                 _(
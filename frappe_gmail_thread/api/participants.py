@@ -0,0 +1,65 @@
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread import (
+    get_permission_query_conditions,
+)
+from frappe_gmail_thread.utils.participants import (
+    PARTICIPANT_ROLES,
+    normalize_address,
+    normalize_domain,
+)
+
+THREADS_PAGE_LENGTH = 20
+MAX_PAGE_LENGTH = 500
+
+
+@frappe.whitelist()
+def get_threads(
+    address=None, domain=None, role=None, start=0, page_length=THREADS_PAGE_LENGTH
+):
+    """
+    Threads the current user can read with an email from, to, or copying `address`, or any
+    address of `domain`, most recent first. `role` (From, To, Cc or Bcc) narrows it down.
+    """
+    if address:
+        fieldname, value = "address", normalize_address(address)
+    elif domain:
+        fieldname, value = "domain", normalize_domain(domain)
+    else:
+        frappe.throw(_("Please set an address or a domain."))
+    participant_conditions = f"{fieldname} = %(value)s"
+    if role:
+        if role not in dict(PARTICIPANT_ROLES):
+            frappe.throw(_("Invalid role {0}").format(role))
+        participant_conditions += " and role = %(role)s"
+    conditions = get_permission_query_conditions(frappe.session.user)
+    if conditions:
+        conditions = f"and ({conditions})"
+    return frappe.db.sql(
+        f"""
+        select
+            `tabGmail Thread`.name, `tabGmail Thread`.subject_of_first_mail,
+            `tabGmail Thread`.last_email_at, `tabGmail Thread`.last_sender,
+            `tabGmail Thread`.snippet, `tabGmail Thread`.email_count,
+            `tabGmail Thread`.reference_doctype, `tabGmail Thread`.reference_name
+        from `tabGmail Thread`
+        where `tabGmail Thread`.name in (
+            select parent from `tabGmail Thread Participant`
+            where {participant_conditions}
+        )
+        {conditions}
+        order by `tabGmail Thread`.last_email_at desc
+        limit %(page_length)s offset %(start)s
+        """,
+        {
+            "value": value,
+            "role": role,
+            "start": cint(start),
+            "page_length": min(
+                cint(page_length) or THREADS_PAGE_LENGTH, MAX_PAGE_LENGTH
+            ),
+        },
+        as_dict=True,
+    )
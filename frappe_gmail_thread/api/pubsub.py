@@ -1,44 +1,193 @@
 import base64 as b64
+import binascii
+import hmac
 import json
+import time
+import uuid
 
 import frappe
+import redis
 from frappe.utils.background_jobs import is_job_enqueued
 
+from frappe_gmail_thread.utils.metrics import incr
+from frappe_gmail_thread.utils.polling import record_push
+from frappe_gmail_thread.utils.scheduler import (
+    enqueue_sync,
+    record_pending_history_id,
+)
+
+STREAM_KEY = "gmail_thread_pubsub_notifications"
+STREAM_MAX_LENGTH = 100000
+CONSUMER_GROUP = "drainers"
+DRAIN_SCHEDULED_KEY = "gmail_thread_pubsub_drain_scheduled"
+DRAIN_METHOD = "frappe_gmail_thread.api.pubsub.drain_notifications"
+DRAIN_BATCH_SIZE = 500
+# notifications read by a drainer that died are handed to the next one after this long
+DRAIN_CLAIM_IDLE_MS = 60000
+USER_BY_EMAIL_KEY = "gmail_thread_user_by_email"
+# seconds between two warnings about pushes accepted without a verification token
+UNVERIFIED_LOG_INTERVAL = 3600
+unverified_logged_at = None
+
 
 @frappe.whitelist(allow_guest=True)
-def callback():
-    data = frappe.request.get_data(as_text=True)
-    data = frappe.parse_json(data)
-    message = data.get("message", {}).get("data")
-    google_settings = frappe.get_single("Google Settings")
-    if not google_settings.enable:
-        return "OK"
-    if not google_settings.custom_gmail_sync_in_realtime:
+def callback(token=None):
+    """
+    Push endpoint of the Gmail Pub/Sub subscription, its URL carries the verification token
+    of Google Settings. Pushes are accepted with a warning while no token is set.
+
+    Only buffers the notification in a Redis stream, `drain_notifications` turns batches of them
+    into syncs, so bursts of pushes cost no DB queries here. Addresses are only trusted once
+    they resolve to a user there.
+    """
+    verification_token = frappe.get_cached_doc(
+        "Google Settings"
+    ).custom_gmail_pubsub_verification_token
+    if not verification_token:
+        # sites upgraded with realtime sync keep receiving pushes until a token is set
+        log_unverified_push()
+    elif not (
+        token and hmac.compare_digest(token.encode(), verification_token.encode())
+    ):
+        incr("gmail_thread_pubsub_unauthorized_total")
+        raise frappe.PermissionError
+    data = frappe.parse_json(frappe.request.get_data(as_text=True)) or {}
+    message = (data.get("message") or {}).get("data")
+    if not message:
         return "OK"
-    if not google_settings.custom_gmail_pubsub_topic:
+    try:
+        message = json.loads(b64.b64decode(message).decode("utf-8"))
+        email_address = message["emailAddress"]
+        history_id = int(message["historyId"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        # acknowledge it anyway, Google would only push the same payload again
+        incr("gmail_thread_pubsub_invalid_total")
         return "OK"
-    if message:
-        message = b64.b64decode(message).decode("utf-8")
-        try:
-            message = json.loads(message)
-        except json.JSONDecodeError:
-            frappe.log_error(f"Error while decoding message: {message}")
-            return "OK"
-        email_address = message.get("emailAddress")
-        user = frappe.get_doc(
-            "User", {"email": email_address, "user_type": "System User"}
+    incr("gmail_thread_pubsub_notifications_total")
+    frappe.cache.xadd(
+        frappe.cache.make_key(STREAM_KEY),
+        {"email": email_address, "history_id": history_id},
+        maxlen=STREAM_MAX_LENGTH,
+        approximate=True,
+    )
+    schedule_drain()
+    return "OK"
+
+
+def log_unverified_push():
+    global unverified_logged_at
+    incr("gmail_thread_pubsub_unverified_total")
+    now = time.monotonic()
+    if (
+        unverified_logged_at is not None
+        and now - unverified_logged_at < UNVERIFIED_LOG_INTERVAL
+    ):
+        return
+    unverified_logged_at = now
+    frappe.logger("frappe_gmail_thread").warning(
+        "Pub/Sub push accepted without verification, set PubSub Verification Token in "
+        "Google Settings and add it to the push endpoint of the subscription"
+    )
+
+
+def schedule_drain():
+    # one drainer per burst, it reads the stream until it is empty
+    if frappe.cache.set(
+        frappe.cache.make_key(DRAIN_SCHEDULED_KEY), 1, nx=True, ex=60
+    ) and not is_job_enqueued(DRAIN_METHOD):
+        frappe.enqueue(DRAIN_METHOD, queue="short", job_id=DRAIN_METHOD)
+
+
+def drain_notifications():
+    """
+    Turn buffered Pub/Sub notifications into coalesced syncs, a batch at a time.
+    Also runs every minute, in case a drainer was lost.
+    """
+    stream = frappe.cache.make_key(STREAM_KEY)
+    frappe.cache.delete(frappe.cache.make_key(DRAIN_SCHEDULED_KEY))
+    try:
+        frappe.cache.xgroup_create(stream, CONSUMER_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError:
+        # BUSYGROUP, the group already exists
+        pass
+    consumer = uuid.uuid4().hex
+    _, entries, *_ = frappe.cache.xautoclaim(
+        stream,
+        CONSUMER_GROUP,
+        consumer,
+        min_idle_time=DRAIN_CLAIM_IDLE_MS,
+        count=DRAIN_BATCH_SIZE,
+    )
+    while True:
+        if entries:
+            process_notifications(entries)
+            ids = [entry_id for entry_id, _ in entries]
+            frappe.cache.xack(stream, CONSUMER_GROUP, *ids)
+            frappe.cache.xdel(stream, *ids)
+        response = frappe.cache.xreadgroup(
+            CONSUMER_GROUP, consumer, {stream: ">"}, count=DRAIN_BATCH_SIZE
         )
+        if not response:
+            break
+        entries = response[0][1]
+
+
+def process_notifications(entries):
+    google_settings = frappe.get_cached_doc("Google Settings")
+    if not (
+        google_settings.enable
+        and google_settings.custom_gmail_sync_in_realtime
+        and google_settings.custom_gmail_pubsub_topic
+    ):
+        return
+    history_ids = {}
+    notifications = {}
+    for _, fields in entries:
+        email = frappe.safe_decode(fields[b"email"])
+        history_ids[email] = max(history_ids.get(email, 0), int(fields[b"history_id"]))
+        notifications[email] = notifications.get(email, 0) + 1
+    users = get_users_by_email(list(history_ids))
+    record_push(users.values())
+    for email, history_id in history_ids.items():
+        user = users.get(email)
         if not user:
-            return "OK"
-        history_id = message.get("historyId")
-        if email_address and history_id:
-            job_name = f"gmail_thread_sync_{user.name}"
-            if not is_job_enqueued(job_name):
-                frappe.enqueue(
-                    "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread.sync",
-                    user=user.name,
-                    queue="long",
-                    job_name=job_name,
-                    job_id=job_name,
-                )
-    return "OK"
+            incr("gmail_thread_pubsub_unknown_total", notifications[email])
+            continue
+        incr(
+            "gmail_thread_pubsub_account_notifications_total",
+            notifications[email],
+            account=user,
+        )
+        # a sync already queued or running picks the new history id up
+        record_pending_history_id(user, history_id)
+        deduped = notifications[email] - 1
+        if not enqueue_sync(user):
+            deduped += 1
+        incr("gmail_thread_pubsub_deduped_total", deduped, account=user)
+
+
+def get_users_by_email(emails):
+    """
+    System users of `emails`, from a cached map that misses are resolved into in one query.
+    """
+    users = {}
+    missing = []
+    for email in emails:
+        user = frappe.cache.hget(USER_BY_EMAIL_KEY, email)
+        if user:
+            users[email] = user
+        else:
+            missing.append(email)
+    if missing:
+        for user in frappe.get_all(
+            "User",
+            filters={"email": ["in", missing], "user_type": "System User"},
+            fields=["name", "email"],
+        ):
+            users[user.email] = user.name
+            frappe.cache.hset(USER_BY_EMAIL_KEY, user.email, user.name)
+    return users
+
+
+def clear_user_by_email_cache(doc, method=None):
+    frappe.cache.delete_value(USER_BY_EMAIL_KEY)
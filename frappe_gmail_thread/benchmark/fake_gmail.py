@@ -0,0 +1,494 @@
+"""
+A local stand-in for the parts of the Gmail REST API and the OAuth token endpoint used by sync.
+
+Point the app at it with the `gmail_thread_api_endpoint` and `gmail_thread_oauth_url` site config
+keys (see `frappe_gmail_thread.api.oauth`). Every request is counted, so a benchmark can report API
+calls, quota units and bytes per synced message.
+"""
+
+import base64
+import email.parser
+import email.policy
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Gmail API quota units per method, see https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "labels.list": 1,
+    "labels.get": 1,
+    "threads.list": 10,
+    "threads.get": 10,
+    "messages.list": 5,
+    "messages.get": 5,
+    "history.list": 2,
+    "watch": 100,
+    "stop": 50,
+}
+PAGE_SIZE = 100
+API_PREFIX = "/gmail/v1/users/me/"
+BATCH_PATH = "/batch/gmail/v1"
+
+
+class GmailError(Exception):
+    def __init__(self, code, reason, message=""):
+        super().__init__(message or reason)
+        self.code = code
+        self.reason = reason
+        self.message = message or reason
+
+    def to_json(self):
+        return {
+            "error": {
+                "code": self.code,
+                "message": self.message,
+                "errors": [
+                    {"domain": "global", "reason": self.reason, "message": self.message}
+                ],
+            }
+        }
+
+
+class FakeGmail:
+    """
+    Serve a set of synthetic mailboxes, keyed by the owner's email address.
+
+    The OAuth endpoint hands out the refresh token itself as the access token, so the
+    benchmark only has to use the mailbox owner's email as the refresh token.
+    """
+
+    def __init__(self, accounts, host="127.0.0.1", port=0, latency=0.0):
+        self.accounts = accounts
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset_stats()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def api_endpoint(self):
+        return self.url
+
+    @property
+    def oauth_url(self):
+        return self.url + "token"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = Counter()
+            self.errors = Counter()
+            self.quota_units = 0
+            self.bytes_sent = 0
+            self.http_requests = 0
+            self.connections = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "api_calls": sum(
+                    count for method, count in self.calls.items() if method != "token"
+                ),
+                "quota_units": self.quota_units,
+                "bytes_sent": self.bytes_sent,
+                "http_requests": self.http_requests,
+                "connections": self.connections,
+            }
+
+    def record(self, method, nbytes=0):
+        with self.lock:
+            self.calls[method] += 1
+            self.quota_units += QUOTA_UNITS.get(method, 0)
+            self.bytes_sent += nbytes
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                # one per TCP connection, the clients keep them alive between requests
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def handle_request(self, verb):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with fake.lock:
+                    fake.http_requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if self.path.startswith(BATCH_PATH):
+                    content_type, payload = fake.handle_batch(
+                        self.headers.get("Content-Type", ""), body
+                    )
+                    self.respond(200, payload, content_type)
+                    return
+                status, data = fake.dispatch(
+                    verb, self.path, self.headers.get("Authorization", ""), body
+                )
+                payload = json.dumps(data).encode("utf-8")
+                self.respond(status, payload, "application/json; charset=UTF-8")
+
+            def respond(self, status, payload, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                with fake.lock:
+                    fake.bytes_sent += len(payload)
+
+        return Handler
+
+    def dispatch(self, verb, path, authorization, body=b""):
+        parts = urlsplit(path)
+        query = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(parts.query).items()}
+        try:
+            if parts.path == "/token":
+                form = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+                self.record("token")
+                return 200, self.token(form)
+            account = self.get_account(authorization)
+            if not parts.path.startswith(API_PREFIX):
+                raise GmailError(404, "notFound", f"Unknown path {parts.path}")
+            route = parts.path[len(API_PREFIX) :].strip("/").split("/")
+            method, data = self.route(account, verb, route, query)
+            self.record(method)
+            return 200, data
+        except GmailError as e:
+            with self.lock:
+                self.errors[e.reason] += 1
+            return e.code, e.to_json()
+
+    def handle_batch(self, content_type, body):
+        # googleapiclient sends multipart/mixed with one application/http part per request
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        boundary = "batch_fake_gmail_boundary"
+        chunks = []
+        for part in message.iter_parts():
+            request = part.get_payload(decode=True).replace(b"\r\n", b"\n")
+            head, _, sub_body = request.partition(b"\n\n")
+            lines = head.decode("utf-8").split("\n")
+            verb, path, _ = lines[0].split(" ", 2)
+            headers = {
+                key.lower(): value
+                for key, value in (
+                    line.split(": ", 1) for line in lines[1:] if ": " in line
+                )
+            }
+            status, data = self.dispatch(
+                verb, path, headers.get("authorization", ""), sub_body
+            )
+            content_id = (part.get("Content-ID") or "").strip("<>")
+            response = json.dumps(data)
+            chunks.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(response.encode())}\r\n\r\n"
+                f"{response}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(chunks).encode("utf-8")
+
+    def token(self, form):
+        refresh_token = form.get("refresh_token") or form.get("code")
+        if refresh_token not in self.accounts:
+            raise GmailError(400, "invalid_grant", "invalid_grant")
+        return {
+            "access_token": refresh_token,
+            "refresh_token": refresh_token,
+            "expires_in": 3600,
+            "token_type": "Bearer",
+        }
+
+    def get_account(self, authorization):
+        token = authorization.replace("Bearer ", "").strip()
+        account = self.accounts.get(token)
+        if not account:
+            raise GmailError(401, "authError", "Invalid Credentials")
+        return account
+
+    def route(self, account, verb, route, query):
+        resource = route[0]
+        if resource == "profile":
+            return "getProfile", self.get_profile(account)
+        if resource == "watch" and verb == "POST":
+            return "watch", {
+                "historyId": str(account.history_id),
+                "expiration": str(int((time.time() + 7 * 86400) * 1000)),
+            }
+        if resource == "stop" and verb == "POST":
+            return "stop", {}
+        if resource == "labels":
+            if len(route) > 1:
+                return "labels.get", self.get_label(account, route[1])
+            return "labels.list", {"labels": account.labels}
+        if resource == "threads":
+            if len(route) > 1:
+                return "threads.get", self.get_thread(account, route[1], query)
+            return "threads.list", self.list_threads(account, query)
+        if resource == "messages":
+            if len(route) > 1:
+                return "messages.get", self.get_message(account, route[1], query)
+            return "messages.list", self.list_messages(account, query)
+        if resource == "history":
+            return "history.list", self.list_history(account, query)
+        raise GmailError(404, "notFound", f"Unknown resource {resource}")
+
+    def get_profile(self, account):
+        messages = account.live_messages()
+        return {
+            "emailAddress": account.email,
+            "messagesTotal": len(messages),
+            "threadsTotal": len({m.thread_id for m in messages}),
+            "historyId": str(account.history_id),
+        }
+
+    def get_label(self, account, label_id):
+        label = next((x for x in account.labels if x["id"] == label_id), None)
+        if not label:
+            raise GmailError(404, "notFound", "Requested entity was not found.")
+        messages = [m for m in account.live_messages() if label_id in m.label_ids]
+        return dict(
+            label,
+            messagesTotal=len(messages),
+            threadsTotal=len({m.thread_id for m in messages}),
+        )
+
+    def filter_messages(self, account, query):
+        label_ids = query.get("labelIds") or []
+        if isinstance(label_ids, str):
+            label_ids = [label_ids]
+        matches = parse_search_query(query.get("q", ""))
+        messages = [
+            m
+            for m in account.live_messages()
+            if all(x in m.label_ids for x in label_ids) and matches(m)
+        ]
+        # Gmail lists newest first
+        return sorted(messages, key=lambda m: m.internal_date, reverse=True)
+
+    def paginate(self, account, items, query):
+        start = 0
+        if query.get("pageToken"):
+            generation, _, start = query["pageToken"].partition(":")
+            if int(generation) != account.page_token_generation:
+                raise GmailError(400, "invalid", "Invalid pageToken")
+            start = int(start)
+        size = min(int(query.get("maxResults") or PAGE_SIZE), 500)
+        page = items[start : start + size]
+        next_token = (
+            f"{account.page_token_generation}:{start + size}"
+            if start + size < len(items)
+            else None
+        )
+        return page, next_token
+
+    def list_threads(self, account, query):
+        thread_ids = []
+        for message in self.filter_messages(account, query):
+            if message.thread_id not in thread_ids:
+                thread_ids.append(message.thread_id)
+        page, next_token = self.paginate(account, thread_ids, query)
+        result = {"resultSizeEstimate": len(thread_ids)}
+        if page:
+            result["threads"] = [
+                {
+                    "id": thread_id,
+                    "snippet": "",
+                    "historyId": str(
+                        max(
+                            account.messages[m].history_id
+                            for m in account.threads[thread_id]
+                        )
+                    ),
+                }
+                for thread_id in page
+            ]
+        if next_token:
+            result["nextPageToken"] = next_token
+        return result
+
+    def list_messages(self, account, query):
+        messages = self.filter_messages(account, query)
+        page, next_token = self.paginate(account, messages, query)
+        result = {"resultSizeEstimate": len(messages)}
+        if page:
+            result["messages"] = [{"id": m.id, "threadId": m.thread_id} for m in page]
+        if next_token:
+            result["nextPageToken"] = next_token
+        return result
+
+    def get_thread(self, account, thread_id, query):
+        if thread_id not in account.threads:
+            raise GmailError(404, "notFound", "Requested entity was not found.")
+        messages = [
+            account.messages[m]
+            for m in account.threads[thread_id]
+            if not account.messages[m].deleted
+        ]
+        if not messages:
+            raise GmailError(404, "notFound", "Requested entity was not found.")
+        fmt = query.get("format", "full")
+        return {
+            "id": thread_id,
+            "historyId": str(max(m.history_id for m in messages)),
+            "messages": [format_message(m, fmt) for m in messages],
+        }
+
+    def get_message(self, account, message_id, query):
+        message = account.messages.get(message_id)
+        if not message or message.deleted:
+            raise GmailError(404, "notFound", "Requested entity was not found.")
+        return format_message(message, query.get("format", "full"))
+
+    def list_history(self, account, query):
+        start = int(query.get("startHistoryId") or 0)
+        if start < account.history_floor:
+            raise GmailError(404, "notFound", "Requested entity was not found.")
+        label_id = query.get("labelId")
+        types = query.get("historyTypes") or []
+        if isinstance(types, str):
+            types = [types]
+        records = []
+        for record in account.history:
+            if int(record["id"]) <= start:
+                continue
+            record = {
+                key: value
+                for key, value in record.items()
+                if key in ("id", "messages") or not types or key_to_type(key) in types
+            }
+            if len(record) == 2:
+                continue
+            if label_id and not record_has_label(record, label_id):
+                continue
+            records.append(record)
+        page, next_token = self.paginate(account, records, query)
+        result = {"historyId": str(account.history_id)}
+        if page:
+            result["history"] = page
+        if next_token:
+            result["nextPageToken"] = next_token
+        return result
+
+
+def record_has_label(record, label_id):
+    for key, changes in record.items():
+        if key in ("id", "messages"):
+            continue
+        for change in changes:
+            if label_id in change["message"].get("labelIds", []):
+                return True
+            if label_id in change.get("labelIds", []):
+                return True
+    return False
+
+
+def key_to_type(key):
+    # "messagesAdded" -> "messageAdded", "labelsRemoved" -> "labelRemoved"
+    return key.replace("messages", "message").replace("labels", "label")
+
+
+def format_message(message, fmt):
+    data = {
+        "id": message.id,
+        "threadId": message.thread_id,
+        "labelIds": list(message.label_ids),
+        "historyId": str(message.history_id),
+        "internalDate": str(message.internal_date),
+        "sizeEstimate": message.size_estimate,
+    }
+    if fmt == "raw":
+        data["raw"] = message.raw_b64()
+    elif fmt in ("full", "metadata"):
+        body = message.raw.partition(b"\n\n")[2]
+        parsed = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+            message.raw, headersonly=True
+        )
+        data["snippet"] = body[:200].decode("utf-8", errors="replace")
+        data["payload"] = {
+            "mimeType": parsed.get_content_type(),
+            "headers": [{"name": k, "value": str(v)} for k, v in parsed.items()],
+        }
+        if fmt == "full":
+            # the real API returns every part decoded, which is at least as large as raw
+            data["payload"]["body"] = {
+                "size": len(body),
+                "data": base64.urlsafe_b64encode(body).decode("ascii"),
+            }
+    return data
+
+
+def parse_search_query(q):
+    """
+    Support the date operators of the Gmail search syntax used by sync:
+    after:, before: (epoch seconds or YYYY/MM/DD), newer_than: and older_than: (Nd, Nm, Ny).
+    """
+    conditions = []
+    for operator, value in re.findall(
+        r"(after|before|newer_than|older_than):(\S+)", q or ""
+    ):
+        if operator in ("after", "before"):
+            if value.isdigit():
+                timestamp = int(value)
+            else:
+                timestamp = int(
+                    datetime.strptime(value, "%Y/%m/%d")
+                    .replace(tzinfo=timezone.utc)
+                    .timestamp()
+                )
+        else:
+            amount, unit = int(value[:-1]), value[-1]
+            seconds = amount * {"d": 86400, "m": 30 * 86400, "y": 365 * 86400}[unit]
+            timestamp = int(time.time()) - seconds
+        if operator in ("after", "newer_than"):
+            conditions.append(lambda m, t=timestamp: m.internal_date / 1000 > t)
+        else:
+            conditions.append(lambda m, t=timestamp: m.internal_date / 1000 < t)
+    return lambda message: all(condition(message) for condition in conditions)
@@ -0,0 +1,330 @@
+"""
+Deterministic synthetic mailboxes for sync benchmarks.
+
+The generator does not depend on Frappe, so mailboxes can be built and inspected from a plain
+Python shell. The same `seed` always produces the same mailboxes, byte for byte.
+"""
+
+import base64
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+SYSTEM_LABELS = [
+    {"id": "INBOX", "name": "INBOX", "type": "system"},
+    {"id": "SENT", "name": "SENT", "type": "system"},
+    {"id": "IMPORTANT", "name": "IMPORTANT", "type": "system"},
+]
+USER_LABELS = [
+    {"id": "Label_1", "name": "Customers", "type": "user"},
+    {"id": "Label_2", "name": "Vendors", "type": "user"},
+    {"id": "Label_3", "name": "Hiring", "type": "user"},
+]
+WORDS = [
+    "invoice",
+    "order",
+    "shipment",
+    "quote",
+    "meeting",
+    "review",
+    "proposal",
+    "contract",
+    "update",
+    "report",
+    "delivery",
+    "payment",
+    "schedule",
+    "support",
+    "ticket",
+    "release",
+    "feedback",
+    "budget",
+    "renewal",
+    "plan",
+]
+
+
+@dataclass
+class SyntheticMessage:
+    id: str
+    thread_id: str
+    message_id: str
+    label_ids: list
+    internal_date: int  # milliseconds since epoch, like the Gmail API
+    raw: bytes
+    history_id: int = 0
+    deleted: bool = False
+
+    @property
+    def size_estimate(self):
+        return len(self.raw)
+
+    def raw_b64(self):
+        return base64.urlsafe_b64encode(self.raw).decode("ascii")
+
+
+@dataclass
+class SyntheticAccount:
+    email: str
+    labels: list = field(default_factory=lambda: SYSTEM_LABELS + USER_LABELS)
+    messages: dict = field(default_factory=dict)
+    threads: dict = field(default_factory=dict)
+    history: list = field(default_factory=list)
+    history_id: int = 1000
+    # history records below this id have been "expired" by Gmail
+    history_floor: int = 0
+    # page tokens of an older generation are rejected
+    page_token_generation: int = 0
+
+    def add_message(self, message: SyntheticMessage):
+        self.history_id += 1
+        message.history_id = self.history_id
+        self.messages[message.id] = message
+        self.threads.setdefault(message.thread_id, []).append(message.id)
+        self.history.append(
+            {
+                "id": str(self.history_id),
+                "messages": [{"id": message.id, "threadId": message.thread_id}],
+                "messagesAdded": [
+                    {
+                        "message": {
+                            "id": message.id,
+                            "threadId": message.thread_id,
+                            "labelIds": list(message.label_ids),
+                        }
+                    }
+                ],
+            }
+        )
+        return message
+
+    def delete_message(self, message_id):
+        message = self.messages[message_id]
+        message.deleted = True
+        self.history_id += 1
+        self.history.append(
+            {
+                "id": str(self.history_id),
+                "messages": [{"id": message.id, "threadId": message.thread_id}],
+                "messagesDeleted": [
+                    {
+                        "message": {
+                            "id": message.id,
+                            "threadId": message.thread_id,
+                            "labelIds": list(message.label_ids),
+                        }
+                    }
+                ],
+            }
+        )
+
+    def remove_label(self, message_id, label_id):
+        message = self.messages[message_id]
+        if label_id in message.label_ids:
+            message.label_ids.remove(label_id)
+        self.history_id += 1
+        self.history.append(
+            {
+                "id": str(self.history_id),
+                "messages": [{"id": message.id, "threadId": message.thread_id}],
+                "labelsRemoved": [
+                    {
+                        "message": {
+                            "id": message.id,
+                            "threadId": message.thread_id,
+                            "labelIds": list(message.label_ids),
+                        },
+                        "labelIds": [label_id],
+                    }
+                ],
+            }
+        )
+
+    def live_messages(self):
+        return [m for m in self.messages.values() if not m.deleted]
+
+    def expire_history(self):
+        """Make every stored history id invalid, as Gmail does after about a week."""
+        self.history_floor = self.history_id
+
+    def expire_page_tokens(self):
+        """Make every page token handed out so far invalid, as Gmail does after a while."""
+        self.page_token_generation += 1
+
+
+class MailboxGenerator:
+    """
+    Build synthetic mailboxes for a set of accounts.
+
+    :param accounts: email addresses of the mailbox owners.
+    :param threads_per_account: number of threads started in each mailbox.
+    :param min_thread_length: minimum number of messages in a thread.
+    :param max_thread_length: maximum number of messages in a thread.
+    :param attachment_size: size in bytes of generated attachments, 0 disables attachments.
+    :param attachment_probability: probability that a message carries an attachment.
+    :param html_complexity: number of nested blocks in the HTML body of each message.
+    :param label_overlap: probability that a thread also carries a user label.
+    :param cross_account_duplicates: probability that a thread is also delivered to another account.
+    :param seed: seed of the random generator.
+    """
+
+    def __init__(
+        self,
+        accounts,
+        threads_per_account=50,
+        min_thread_length=1,
+        max_thread_length=8,
+        attachment_size=0,
+        attachment_probability=0.2,
+        html_complexity=3,
+        label_overlap=0.3,
+        cross_account_duplicates=0.2,
+        seed=42,
+        start_date=None,
+    ):
+        self.account_emails = list(accounts)
+        self.threads_per_account = threads_per_account
+        self.min_thread_length = min_thread_length
+        self.max_thread_length = max(min_thread_length, max_thread_length)
+        self.attachment_size = attachment_size
+        self.attachment_probability = attachment_probability
+        self.html_complexity = html_complexity
+        self.label_overlap = label_overlap
+        self.cross_account_duplicates = cross_account_duplicates
+        self.rng = random.Random(seed)
+        self.clock = start_date or datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.accounts = {
+            email: SyntheticAccount(email=email) for email in self.account_emails
+        }
+        self.external_contacts = [
+            f"contact{i}@customer{i % 7}.example.org" for i in range(25)
+        ]
+
+    def generate(self):
+        pending = []
+        for email in self.account_emails:
+            for _ in range(self.threads_per_account):
+                pending.extend(self.generate_thread(email))
+        # history ids in a mailbox grow with time, so assign them in date order
+        for account_email, message in sorted(pending, key=lambda x: x[1].internal_date):
+            self.accounts[account_email].add_message(message)
+        return self.accounts
+
+    def new_messages(self, account_email, count):
+        """Deliver `count` new messages to a mailbox, e.g. to benchmark an incremental sync."""
+        added = []
+        while len(added) < count:
+            messages = self.generate_thread(
+                account_email, max_length=count - len(added)
+            )
+            for owner, message in sorted(messages, key=lambda x: x[1].internal_date):
+                self.accounts[owner].add_message(message)
+                if owner == account_email:
+                    added.append(message)
+        return added
+
+    def generate_thread(self, account_email, max_length=None):
+        rng = self.rng
+        length = rng.randint(self.min_thread_length, self.max_thread_length)
+        if max_length:
+            length = min(length, max_length)
+        subject = " ".join(rng.choice(WORDS) for _ in range(4)).capitalize()
+        participants = [account_email] + rng.sample(self.external_contacts, 2)
+        recipients = [account_email]
+        if (
+            len(self.account_emails) > 1
+            and rng.random() < self.cross_account_duplicates
+        ):
+            recipients.append(
+                rng.choice([e for e in self.account_emails if e != account_email])
+            )
+            participants.extend(recipients[1:])
+        user_label = (
+            rng.choice(USER_LABELS)["id"] if rng.random() < self.label_overlap else None
+        )
+        thread_ids = {email: self.new_id() for email in recipients}
+        references = []
+        generated = []
+        for position in range(length):
+            self.clock += timedelta(minutes=rng.randint(5, 60 * 24))
+            sender = participants[position % len(participants)]
+            to = [p for p in participants if p != sender]
+            message_id = f"<{self.new_id()}.{position}@synthetic.example.com>"
+            raw = self.build_raw(
+                sender=sender,
+                to=to,
+                subject=subject if position == 0 else f"Re: {subject}",
+                message_id=message_id,
+                references=references,
+            )
+            references = references + [message_id]
+            for owner in recipients:
+                label_ids = ["SENT"] if sender == owner else ["INBOX"]
+                if user_label:
+                    label_ids.append(user_label)
+                generated.append(
+                    (
+                        owner,
+                        SyntheticMessage(
+                            id=self.new_id(),
+                            thread_id=thread_ids[owner],
+                            message_id=message_id,
+                            label_ids=label_ids,
+                            internal_date=int(self.clock.timestamp() * 1000),
+                            raw=raw,
+                        ),
+                    )
+                )
+        return generated
+
+    def new_id(self):
+        return f"{self.rng.getrandbits(64):016x}"
+
+    def build_raw(self, sender, to, subject, message_id, references):
+        rng = self.rng
+        message = EmailMessage()
+        message["From"] = sender
+        message["To"] = ", ".join(to[:2])
+        if len(to) > 2:
+            message["Cc"] = ", ".join(to[2:])
+        message["Subject"] = subject
+        message["Date"] = format_datetime(self.clock)
+        message["Message-ID"] = message_id
+        if references:
+            message["In-Reply-To"] = references[-1]
+            message["References"] = " ".join(references)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+        message.set_content(text)
+        message.add_alternative(self.build_html(text, bool(references)), subtype="html")
+        if self.attachment_size and rng.random() < self.attachment_probability:
+            message.add_attachment(
+                rng.randbytes(self.attachment_size),
+                maintype="application",
+                subtype="octet-stream",
+                filename=f"attachment-{self.new_id()}.bin",
+            )
+        # fixed boundaries, so that the same seed always yields the same bytes
+        for part in message.walk():
+            if part.is_multipart():
+                part.set_boundary(f"=={self.new_id()}==")
+        return message.as_bytes()
+
+    def build_html(self, text, is_reply):
+        html = f"<p>{text}</p>"
+        for depth in range(self.html_complexity):
+            html = (
+                f'<div class="block-{depth}"><table><tr><td>{html}</td>'
+                f"<td><b>{self.rng.choice(WORDS)}</b></td></tr></table></div>"
+            )
+        if is_reply:
+            # quoted history, as Gmail renders it, which the parser strips
+            html += '<div class="gmail_quote"><blockquote>previous message</blockquote></div>'
+        return f"<html><body>{html}</body></html>"
+
+
+def generate_mailboxes(accounts, **kwargs):
+    generator = MailboxGenerator(accounts, **kwargs)
+    generator.generate()
+    return generator
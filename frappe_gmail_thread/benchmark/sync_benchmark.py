@@ -0,0 +1,279 @@
+"""
+Measure `sync()` throughput against synthetic mailboxes served by a local fake Gmail API.
+
+Run it on a throwaway site, it creates users, Gmail Accounts and threads:
+
+    bench --site bench.localhost execute frappe_gmail_thread.benchmark.sync_benchmark.run \
+        --kwargs "{'accounts': 2, 'threads_per_account': 200, 'attachment_size': 20000}"
+"""
+
+import json
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import frappe
+
+from frappe_gmail_thread.api.oauth import get_gmail_object
+from frappe_gmail_thread.benchmark.fake_gmail import FakeGmail
+from frappe_gmail_thread.benchmark.mailbox import USER_LABELS, generate_mailboxes
+from frappe_gmail_thread.utils.sync_engine import fetch_thread, sync
+
+SYNCED_LABELS = ["INBOX", "SENT"] + [label["id"] for label in USER_LABELS]
+
+
+def run(
+    accounts=2,
+    threads_per_account=50,
+    min_thread_length=1,
+    max_thread_length=8,
+    attachment_size=0,
+    attachment_probability=0.2,
+    html_complexity=3,
+    label_overlap=0.3,
+    cross_account_duplicates=0.2,
+    incremental_messages=20,
+    latency=0.0,
+    seed=42,
+    fetch_workers=None,
+    parse_workers=None,
+    parse_processes=None,
+    trace_memory=True,
+    cleanup=True,
+):
+    emails = [f"gmail-bench-{i}@example.com" for i in range(accounts)]
+    generator = generate_mailboxes(
+        emails,
+        threads_per_account=threads_per_account,
+        min_thread_length=min_thread_length,
+        max_thread_length=max_thread_length,
+        attachment_size=attachment_size,
+        attachment_probability=attachment_probability,
+        html_complexity=html_complexity,
+        label_overlap=label_overlap,
+        cross_account_duplicates=cross_account_duplicates,
+        seed=seed,
+    )
+    results = {}
+    try:
+        with (
+            FakeGmail(generator.accounts, latency=latency) as fake,
+            benchmark_site(fake, fetch_workers, parse_workers, parse_processes),
+        ):
+            users = [setup_account(email) for email in emails]
+            results["initial"] = measure(fake, users, trace_memory)
+            results["thread_listing"] = measure_thread_listing(fake, users)
+            for email in emails:
+                generator.new_messages(email, incremental_messages)
+            results["incremental"] = measure(fake, users, trace_memory)
+    finally:
+        if cleanup:
+            cleanup_accounts(emails)
+    print(json.dumps(results, indent=2, default=str))
+    return results
+
+
+@contextmanager
+def benchmark_site(fake, fetch_workers=None, parse_workers=None, parse_processes=None):
+    """
+    Point the app at `fake` for the duration of the block, without touching site_config.json.
+    `fetch_workers`, `parse_workers` and `parse_processes` override the sync pipeline pools.
+    """
+    conf = frappe.local.conf
+    previous = {
+        key: conf.get(key)
+        for key in (
+            "gmail_thread_api_endpoint",
+            "gmail_thread_oauth_url",
+            "gmail_thread_fetch_workers",
+            "gmail_thread_parse_workers",
+            "gmail_thread_parse_processes",
+        )
+    }
+    conf.gmail_thread_api_endpoint = fake.api_endpoint
+    conf.gmail_thread_oauth_url = fake.oauth_url
+    if fetch_workers:
+        conf.gmail_thread_fetch_workers = fetch_workers
+    if parse_workers:
+        conf.gmail_thread_parse_workers = parse_workers
+    if parse_processes:
+        conf.gmail_thread_parse_processes = parse_processes
+    google_settings = frappe.get_single("Google Settings")
+    if not google_settings.enable or not google_settings.client_id:
+        google_settings.enable = 1
+        google_settings.client_id = google_settings.client_id or "gmail-bench"
+        google_settings.client_secret = "gmail-bench"
+        google_settings.custom_gmail_sync_in_realtime = 0
+        google_settings.flags.ignore_mandatory = True
+        google_settings.save(ignore_permissions=True)
+    try:
+        yield
+    finally:
+        conf.update(previous)
+        frappe.set_user("Administrator")
+
+
+def setup_account(email, label_ids=None):
+    """
+    Create a system user and an authorized Gmail Account for a synthetic mailbox.
+
+    The fake OAuth endpoint accepts the mailbox address as refresh token.
+    """
+    if not frappe.db.exists("User", email):
+        frappe.get_doc(
+            {
+                "doctype": "User",
+                "email": email,
+                "first_name": email.split("@")[0],
+                "user_type": "System User",
+                "send_welcome_email": 0,
+            }
+        ).insert(ignore_permissions=True)
+    frappe.set_user(email)
+    if frappe.db.exists("Gmail Account", {"linked_user": email}):
+        gmail_account = frappe.get_doc("Gmail Account", {"linked_user": email})
+    else:
+        gmail_account = frappe.get_doc(
+            {"doctype": "Gmail Account", "gmail_enabled": 1}
+        ).insert(ignore_permissions=True)
+    gmail_account.refresh_token = email
+    gmail_account.save(ignore_permissions=True)
+    label_ids = label_ids or SYNCED_LABELS
+    for label in gmail_account.labels:
+        label.enabled = label.label_id in label_ids
+    gmail_account.save(ignore_permissions=True)
+    frappe.db.commit()  # nosemgrep
+    frappe.set_user("Administrator")
+    return email
+
+
+def cleanup_accounts(emails):
+    frappe.set_user("Administrator")
+    gmail_accounts = frappe.get_all(
+        "Gmail Account", filters={"linked_user": ["in", emails]}, pluck="name"
+    )
+    threads = frappe.get_all(
+        "Gmail Thread", filters={"gmail_account": ["in", gmail_accounts]}, pluck="name"
+    )
+    for thread in threads:
+        frappe.delete_doc("Gmail Thread", thread, ignore_permissions=True, force=True)
+    for gmail_account in gmail_accounts:
+        frappe.delete_doc(
+            "Gmail Account", gmail_account, ignore_permissions=True, force=True
+        )
+    frappe.db.commit()  # nosemgrep
+
+
+@contextmanager
+def count_queries():
+    counter = {"queries": 0}
+    sql = frappe.db.sql
+
+    def counting_sql(*args, **kwargs):
+        counter["queries"] += 1
+        return sql(*args, **kwargs)
+
+    frappe.db.sql = counting_sql
+    try:
+        yield counter
+    finally:
+        frappe.db.__dict__.pop("sql", None)
+
+
+def measure_thread_listing(fake, users):
+    """
+    Compare what listing the messages of a thread costs as sync does it, with the ids only,
+    to the default `full` format, which also returns every message body.
+    """
+    costs = {}
+    for fmt in ("sync", "full"):
+        threads = 0
+        fake.reset_stats()
+        for user in users:
+            gmail = get_gmail_object(
+                frappe.get_doc("Gmail Account", {"linked_user": user})
+            )
+            for thread_id in fake.accounts[user].threads:
+                if fmt == "sync":
+                    fetch_thread(gmail, thread_id)
+                else:
+                    gmail.users().threads().get(userId="me", id=thread_id).execute()
+                threads += 1
+        api = fake.stats()
+        costs[fmt] = {
+            "bytes_per_thread": round(api["bytes_sent"] / max(threads, 1)),
+            "quota_units_per_thread": round(api["quota_units"] / max(threads, 1), 2),
+        }
+    return dict(
+        costs,
+        saved={key: costs["full"][key] - costs["sync"][key] for key in costs["full"]},
+    )
+
+
+def compare_pipeline(**kwargs):
+    """
+    Measure syncs with a single fetch and parse worker, then with the configured pipeline,
+    on the same mailboxes. Takes the arguments of `run`.
+    """
+    kwargs.setdefault("latency", 0.05)
+    results = {
+        "sequential": run(fetch_workers=1, parse_workers=1, **kwargs),
+        "pipelined": run(**kwargs),
+    }
+    results["speedup"] = {
+        sync_type: round(
+            results["sequential"][sync_type]["wall_time"]
+            / max(results["pipelined"][sync_type]["wall_time"], 0.001),
+            2,
+        )
+        for sync_type in ("initial", "incremental")
+    }
+    print(json.dumps(results["speedup"], indent=2))
+    return results
+
+
+def measure(fake, users, trace_memory=True):
+    emails_before = frappe.db.count("Single Email CT")
+    fake.reset_stats()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with count_queries() as counter:
+        for user in users:
+            sync(user=user)
+            # the threads older than the most recent ones of an initial sync
+            sync(user=user, older=True)
+    wall_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    frappe.set_user("Administrator")
+
+    messages = frappe.db.count("Single Email CT") - emails_before
+    api = fake.stats()
+    per_message = max(messages, 1)
+    return {
+        "messages": messages,
+        "wall_time": round(wall_time, 3),
+        "messages_per_sec": round(messages / wall_time, 2) if wall_time else None,
+        "db_queries": counter["queries"],
+        "db_queries_per_message": round(counter["queries"] / per_message, 2),
+        "api_calls": api["api_calls"],
+        "api_calls_per_message": round(api["api_calls"] / per_message, 2),
+        "api_calls_by_method": api["calls"],
+        "api_errors": api["errors"],
+        "quota_units_per_message": round(api["quota_units"] / per_message, 2),
+        "connections_opened": api["connections"],
+        "http_requests_per_connection": round(
+            api["http_requests"] / max(api["connections"], 1), 2
+        ),
+        "bytes_downloaded": api["bytes_sent"],
+        "bytes_per_message": round(api["bytes_sent"] / per_message),
+        "peak_traced_memory_mb": (
+            round(peak_memory / 1024 / 1024, 2) if peak_memory is not None else None
+        ),
+        "max_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2
+        ),
+    }
@@ -34,7 +34,19 @@ frappe.ui.form.on("Gmail Account", {
       },
     });
   },
+  show_backfill_progress: function (frm, progress) {
+    if (!progress.backfill_threads_total || progress.backfill_progress >= 100) {
+      frm.dashboard.hide_progress(__("Backfill"));
+      return;
+    }
+    let message = __("{0} of {1} threads", [progress.backfilled_threads, progress.backfill_threads_total]);
+    if (progress.backfill_eta) {
+      message += ", " + __("done by {0}", [frappe.datetime.str_to_user(progress.backfill_eta)]);
+    }
+    frm.dashboard.show_progress(__("Backfill"), progress.backfill_progress, message);
+  },
   refresh: function (frm) {
+    frm.events.show_backfill_progress(frm, frm.doc);
     // if email_id is empty, set it as current user's email
     if (!frm.doc.email_id) {
       user_email = frappe.session.user_email;
@@ -63,10 +75,37 @@ frappe.ui.form.on("Gmail Account", {
           });
         });
       });
+      frm.add_custom_button(__("Estimate Backfill"), function () {
+        frappe.call({
+          method: "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_account.gmail_account.estimate_backfill_api",
+          type: "POST",
+          args: {
+            doc_name: frm.doc.name,
+          },
+          freeze: true,
+          freeze_message: __("Estimating backfill..."),
+          callback: function (r) {
+            frappe.msgprint(
+              __("About {0} messages, {1} MB, will be downloaded.", [
+                r.message.messages,
+                flt(r.message.size, 1),
+              ])
+            );
+            frm.reload_doc();
+          },
+          error: function (r) {
+            frappe.msgprint(__("Something went wrong. Please try again later, or report issue in GitHub issues."));
+          },
+        });
+      });
     }
     frm.fields_dict.labels.$wrapper.find(".grid-row-check").hide();
   },
   onload(frm) {
     frm.get_field("labels").grid.cannot_add_rows = true;
+    frappe.realtime.off("gmail_thread_backfill_progress");
+    frappe.realtime.on("gmail_thread_backfill_progress", function (progress) {
+      frm.events.show_backfill_progress(frm, progress);
+    });
   },
 });
@@ -7,12 +7,9 @@ import json
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils.background_jobs import is_job_enqueued
+from frappe.utils import now_datetime
 
-from frappe_gmail_thread.api.oauth import disable_pubsub, enable_pubsub
-from frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread import (
-    sync_labels,
-)
+from frappe_gmail_thread.utils.scheduler import enqueue_sync
 
 
 class GmailAccount(Document):
@@ -28,6 +25,8 @@ class GmailAccount(Document):
         google_settings = frappe.get_single("Google Settings")
         if not google_settings.custom_gmail_pubsub_topic:
             return
+        from frappe_gmail_thread.api.oauth import disable_pubsub
+
         disable_pubsub(self)
 
     def validate(self):
@@ -65,6 +64,11 @@ class GmailAccount(Document):
         return super().has_value_changed(fieldname)
 
     def before_save(self):
+        # the Google API client is only loaded when the account talks to Gmail, not by every
+        # web worker loading the controller
+        from frappe_gmail_thread.api.oauth import disable_pubsub, enable_pubsub
+        from frappe_gmail_thread.utils.sync_engine import sync_labels
+
         if self.has_value_changed("gmail_enabled") and self.gmail_enabled:
             google_settings = frappe.get_single("Google Settings")
             if not google_settings.enable:
@@ -97,7 +101,20 @@ class GmailAccount(Document):
                         _("Disabled Realtime Sync for {0}").format(self.linked_user)
                     )
         if self.has_value_changed("labels"):
-            self.last_historyid = 0  # reset history id if labels are changed
+            # only newly enabled labels start over, the others keep their history cursor
+            previous = self.get_doc_before_save()
+            was_enabled = (
+                {label.label_id for label in previous.labels if label.enabled}
+                if previous
+                else set()
+            )
+            self.reset_label_cursors(
+                [
+                    label
+                    for label in self.labels
+                    if not label.enabled or label.label_id not in was_enabled
+                ]
+            )
 
             if self.gmail_enabled and self.refresh_token:
                 has_labels = False
@@ -106,46 +123,80 @@ class GmailAccount(Document):
                         has_labels = True
                         break
                 if has_labels:
-                    frappe.msgprint(
-                        _(
-                            "The following labels will be synced in the background. Please confirm if you want to proceed:<br><br> - {0}"
-                        ).format(
-                            "<br> - ".join(
-                                [
-                                    label.label_name
-                                    for label in self.labels
-                                    if label.enabled
-                                ]
-                            )
-                        ),
-                        "Confirm Sync",
-                        primary_action={
-                            "label": _("Proceed"),
-                            "server_action": "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_account.gmail_account.sync_labels_api",
-                            "args": {"doc_name": self.name},
-                            "hide_on_success": True,
-                        },
-                    )
+                    new_labels = [
+                        label.label_name
+                        for label in self.labels
+                        if label.enabled and not label.last_historyid
+                    ]
+                    if new_labels:
+                        frappe.msgprint(
+                            _(
+                                "The following labels will be synced in the background. Please confirm if you want to proceed:<br><br> - {0}"
+                            ).format("<br> - ".join(new_labels)),
+                            "Confirm Sync",
+                            primary_action={
+                                "label": _("Proceed"),
+                                "server_action": "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_account.gmail_account.sync_labels_api",
+                                "args": {"doc_name": self.name},
+                                "hide_on_success": True,
+                            },
+                        )
                     enable_pubsub(self)
                 else:
                     frappe.msgprint(_("Please select at least one label."))
 
+    def reset_label_cursors(self, labels):
+        """
+        Make `labels` backfill again on the next sync.
+        """
+        for label in labels:
+            label.last_historyid = 0
+            label.backfill_history_id = 0
+            label.backfill_page_token = None
+            label.backfill_after = 0
+            label.backfill_before = 0
+            label.backfill_listed_until = 0
+            label.backfill_threads = 0
+            label.backfill_threads_total = 0
+            label.backfill_messages = 0
+            label.backfill_messages_total = 0
+        # the account is synced up to its least advanced label
+        self.last_historyid = min(
+            [label.last_historyid or 0 for label in self.labels if label.enabled],
+            default=0,
+        )
+
 
 @frappe.whitelist()  # nosemgrep
 def sync_labels_api(args):
     args = json.loads(args)
     doc = frappe.get_doc("Gmail Account", args.get("doc_name"))
     if args.get("reset_historyid", False):
-        doc.last_historyid = 0
+        doc.reset_label_cursors(doc.labels)
         doc.save()
         doc.reload()
-    frappe.msgprint(_("Sync started in the background."), alert=True)
-    job_name = f"gmail_thread_sync_{doc.linked_user}"
-    if not is_job_enqueued(job_name):
-        frappe.enqueue(
-            "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread.sync",
-            user=doc.linked_user,
-            queue="long",
-            job_name=job_name,
-            job_id=job_name,
+    if enqueue_sync(doc.linked_user, backfill=not doc.last_historyid):
+        frappe.msgprint(_("Sync started in the background."), alert=True)
+    else:
+        frappe.msgprint(
+            _("A sync is already running, follow it under Backfill Progress."),
+            alert=True,
         )
+
+
+@frappe.whitelist()  # nosemgrep
+def estimate_backfill_api(doc_name):
+    doc = frappe.get_doc("Gmail Account", doc_name)
+    doc.check_permission("write")
+    from frappe_gmail_thread.utils.sync_engine import estimate_backfill
+
+    messages, size = estimate_backfill(doc)
+    doc.db_set(
+        {
+            "estimated_messages": messages,
+            "estimated_size": size,
+            "estimated_on": now_datetime(),
+        },
+        update_modified=False,
+    )
+    return {"messages": messages, "size": size}
@@ -1,9 +1,22 @@
 # Copyright (c) 2024, rtCamp and Contributors
 # See license.txt
 
-# import frappe
+import subprocess
+import sys
+
 from frappe.tests.utils import FrappeTestCase
 
+CONTROLLER = (
+    "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_account.gmail_account"
+)
+
 
 class TestGmailAccount(FrappeTestCase):
-    pass
+    def test_controller_does_not_import_the_google_client(self):
+        # web workers load the controller with every Gmail Account they read
+        modules = subprocess.check_output(
+            [sys.executable, "-c", f"import sys, {CONTROLLER}; print(*sys.modules)"],
+            text=True,
+        ).split()
+        self.assertNotIn("googleapiclient", modules)
+        self.assertNotIn("bs4", modules)
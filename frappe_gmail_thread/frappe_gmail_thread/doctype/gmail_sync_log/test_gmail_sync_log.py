@@ -0,0 +1,61 @@
+# Copyright (c) 2026, rtCamp and Contributors
+# See license.txt
+
+import frappe
+from frappe.utils import add_days, now_datetime
+
+from frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_sync_log.gmail_sync_log import (
+    GmailSyncLog,
+)
+from frappe_gmail_thread.tests.utils import (
+    ACCOUNTS,
+    FakeGmailTestCase,
+    count_emails,
+)
+from frappe_gmail_thread.utils.sync_engine import sync
+
+
+class TestGmailSyncLog(FakeGmailTestCase):
+    def tearDown(self):
+        frappe.db.delete("Gmail Sync Log", {"gmail_account": ["in", ACCOUNTS]})
+        super().tearDown()
+
+    def get_logs(self, user):
+        return frappe.get_all(
+            "Gmail Sync Log",
+            filters={"gmail_account": user},
+            fields=["*"],
+            order_by="creation asc",
+        )
+
+    def test_sync_is_logged(self):
+        with self.fake_gmail(threads_per_account=4, min_thread_length=2) as gmail:
+            user = gmail.user
+            sync(user=user)
+            calls = sum(gmail.fake.stats()["calls"].values())
+        (log,) = self.get_logs(user)
+        self.assertEqual(log.status, "Success")
+        self.assertEqual(log.messages_created, count_emails(user))
+        self.assertEqual(log.messages_fetched, len(gmail.mailbox.messages))
+        self.assertEqual(log.error_count, 0)
+        # the OAuth token request is not a Gmail API call
+        self.assertTrue(0 < log.api_calls < calls)
+        self.assertTrue(log.bytes_downloaded)
+        self.assertTrue(log.end_history_id)
+        self.assertGreaterEqual(log.wall_time, log.db_time)
+
+    def test_old_logs_are_cleared(self):
+        with self.fake_gmail(threads_per_account=1) as gmail:
+            user = gmail.user
+            sync(user=user)
+            sync(user=user)
+        old, recent = self.get_logs(user)
+        frappe.db.set_value(
+            "Gmail Sync Log",
+            old.name,
+            "creation",
+            add_days(now_datetime(), -31),
+            update_modified=False,
+        )
+        GmailSyncLog.clear_old_logs(days=30)
+        self.assertEqual([x.name for x in self.get_logs(user)], [recent.name])
@@ -1,5 +1,51 @@
 frappe.ui.form.on("Gmail Thread", {
+  render_emails: function (frm, start) {
+    const $wrapper = frm.fields_dict.emails_html.$wrapper;
+    if (!start) {
+      $wrapper.empty();
+    }
+    $wrapper.find(".gthread-load-more").remove();
+    frappe.call({
+      method: "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread.get_thread_emails",
+      args: {
+        name: frm.doc.name,
+        start: start || 0,
+      },
+      callback: function (r) {
+        if (!r.message) return;
+        for (let email of r.message.emails) {
+          const attachments = (email.attachments || [])
+            .map((a) => `<a href="${encodeURI(a.file_url)}" target="_blank">${frappe.utils.escape_html(a.file_name)}</a>`)
+            .join(", ");
+          // the document timeline leaves these out, the thread keeps them marked as removed
+          const removed = email.removed_from_gmail
+            ? `<span class="indicator-pill gray ml-2">${__("Removed from Gmail")}</span>`
+            : "";
+          $wrapper.append(`
+            <div class="gthread-email frappe-card mb-3 p-3${email.removed_from_gmail ? " text-muted" : ""}">
+              <div class="d-flex justify-content-between text-muted small">
+                <span>${frappe.utils.escape_html(email.sender_full_name || email.sender || "")}${removed}</span>
+                <span>${frappe.datetime.str_to_user(email.date_and_time)}</span>
+              </div>
+              <div class="bold mt-1">${frappe.utils.escape_html(email.subject || "")}</div>
+              <div class="mt-2">${email.content || ""}</div>
+              ${attachments ? `<div class="text-muted small mt-2">${__("Attachments")}: ${attachments}</div>` : ""}
+            </div>
+          `);
+        }
+        const loaded = (start || 0) + r.message.emails.length;
+        if (loaded < r.message.total && r.message.emails.length) {
+          $(`<button class="btn btn-default btn-sm gthread-load-more">${__("Load More")}</button>`)
+            .appendTo($wrapper)
+            .on("click", () => frm.events.render_emails(frm, loaded));
+        }
+      },
+    });
+  },
   refresh: function (frm) {
+    if (!frm.is_new()) {
+      frm.events.render_emails(frm);
+    }
     const relink_title = frm.doc.reference_doctype && frm.doc.reference_name ? __("Relink") : __("Link");
     const relink_label = `${relink_title} Gmail Thread`;
     frm.add_custom_button(__(relink_title), function () {
@@ -1,9 +1,490 @@
 # Copyright (c) 2024, rtCamp and Contributors
 # See license.txt
 
-# import frappe
-from frappe.tests.utils import FrappeTestCase
+import json
+import subprocess
+import sys
+from unittest.mock import patch
 
+import frappe
 
-class TestGmailThread(FrappeTestCase):
-    pass
+from frappe_gmail_thread.api.activity import get_linked_gmail_threads
+from frappe_gmail_thread.api.participants import get_threads
+from frappe_gmail_thread.benchmark.mailbox import generate_mailboxes
+from frappe_gmail_thread.benchmark.sync_benchmark import cleanup_accounts, setup_account
+from frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread import (
+    get_thread_emails,
+)
+from frappe_gmail_thread.patches.v0_2 import backfill_thread_summary
+from frappe_gmail_thread.tests.utils import (
+    ACCOUNTS,
+    FakeGmailTestCase,
+    count_emails,
+    get_gmail_thread_ids,
+    override_google_settings,
+)
+from frappe_gmail_thread.utils.helpers import add_involved_user
+from frappe_gmail_thread.utils.sync_engine import skip_stored_messages, sync
+from frappe_gmail_thread.utils.sync_stats import SyncStats
+
+
+class TestGmailThread(FakeGmailTestCase):
+    def test_generator_is_deterministic(self):
+        first = generate_mailboxes(ACCOUNTS, threads_per_account=5, seed=7)
+        second = generate_mailboxes(ACCOUNTS, threads_per_account=5, seed=7)
+        for email in ACCOUNTS:
+            self.assertEqual(
+                [m.raw for m in first.accounts[email].messages.values()],
+                [m.raw for m in second.accounts[email].messages.values()],
+            )
+
+    def test_initial_and_incremental_sync(self):
+        with self.fake_gmail(threads_per_account=5, max_thread_length=3) as gmail:
+            user, mailbox = gmail.user, gmail.mailbox
+            sync(user=user)
+            self.assertEqual(count_emails(user), len(mailbox.messages))
+            self.assertEqual(
+                frappe.db.count("Gmail Thread", {"gmail_account": user}),
+                len(mailbox.threads),
+            )
+
+            gmail.generator.new_messages(user, 4)
+            gmail.fake.reset_stats()
+            sync(user=user)
+            self.assertEqual(count_emails(user), len(mailbox.messages))
+            self.assertNotIn("threads.list", gmail.fake.stats()["calls"])
+
+    def test_expired_history_catches_up_by_date(self):
+        with self.fake_gmail(threads_per_account=5) as gmail:
+            user, mailbox = gmail.user, gmail.mailbox
+            sync(user=user)
+            sync(user=user, older=True)
+
+            new_messages = gmail.generator.new_messages(user, 4)
+            mailbox.expire_history()
+            gmail.fake.reset_stats()
+            sync(user=user)
+            self.assertEqual(count_emails(user), len(mailbox.messages))
+            calls = gmail.fake.stats()["calls"]
+            self.assertNotIn("threads.list", calls)
+            self.assertEqual(calls.get("messages.get"), len(new_messages))
+            self.assertTrue(
+                frappe.db.get_value("Gmail Account", user, "last_historyid")
+            )
+
+    def test_parsing_in_processes_stores_the_same_emails(self):
+        def sync_emails(processes):
+            with self.fake_gmail(
+                threads_per_account=4,
+                attachment_size=64,
+                attachment_probability=0.5,
+                conf={"gmail_thread_parse_processes": processes},
+            ) as gmail:
+                sync(user=gmail.user)
+            emails = frappe.get_all(
+                "Single Email CT",
+                filters={"gmail_account": gmail.user},
+                fields=[
+                    "gmail_message_id",
+                    "subject",
+                    "sender",
+                    "plain_content",
+                    "attachments_data",
+                ],
+                order_by="gmail_message_id asc",
+            )
+            cleanup_accounts(ACCOUNTS)
+            for email in emails:
+                email.attachments_data = len(json.loads(email.attachments_data))
+            return emails
+
+        in_threads = sync_emails(0)
+        self.assertTrue(any(x.attachments_data for x in in_threads))
+        self.assertEqual(sync_emails(2), in_threads)
+
+    def test_stored_messages_are_not_downloaded_again(self):
+        with self.fake_gmail(accounts=2, threads_per_account=3) as gmail:
+            first, second = gmail.users
+            sync(user=first)
+            messages = [{"id": next(iter(gmail.mailbox.messages))}, {"id": "unknown"}]
+            stats = SyncStats(first)
+            self.assertEqual(
+                skip_stored_messages(
+                    frappe.get_doc("Gmail Account", first), messages, stats
+                ),
+                messages[1:],
+            )
+            self.assertEqual(stats.counters["duplicates_skipped"], 1)
+            # message ids are only unique within a mailbox
+            self.assertEqual(
+                skip_stored_messages(
+                    frappe.get_doc("Gmail Account", second), messages, stats
+                ),
+                messages,
+            )
+
+    def test_removed_messages_follow_the_removal_policy(self):
+        with self.fake_gmail(threads_per_account=4, label_ids=["SENT"]) as gmail:
+            user, mailbox = gmail.user, gmail.mailbox
+            sent = [m.id for m in mailbox.messages.values() if "SENT" in m.label_ids]
+            sync(user=user)
+            emails = count_emails(user)
+
+            mailbox.delete_message(sent[0])
+            mailbox.remove_label(sent[1], "SENT")
+            sync(user=user)
+            self.assertEqual(
+                set(
+                    frappe.get_all(
+                        "Single Email CT",
+                        filters={"gmail_account": user, "removed_from_gmail": 1},
+                        pluck="gmail_message_id",
+                    )
+                ),
+                set(sent[:2]),
+            )
+
+            with override_google_settings(
+                {"custom_gmail_removed_mail_policy": "Delete"}
+            ):
+                mailbox.delete_message(sent[2])
+                sync(user=user)
+            self.assertEqual(count_emails(user), emails - 1)
+            self.assertFalse(
+                frappe.db.exists("Single Email CT", {"gmail_message_id": sent[2]})
+            )
+
+    def test_removal_leaves_emails_another_account_holds(self):
+        with self.fake_gmail(
+            accounts=2,
+            threads_per_account=3,
+            max_thread_length=1,
+            cross_account_duplicates=1,
+            settings={"custom_gmail_removed_mail_policy": "Delete"},
+        ) as gmail:
+            first, second = gmail.users
+            for user in gmail.users:
+                sync(user=user)
+            message = next(iter(gmail.generator.accounts[first].messages.values()))
+            email = frappe.db.get_value(
+                "Single Email CT",
+                {"gmail_account": first, "gmail_message_id": message.id},
+                ["name", "parent"],
+                as_dict=True,
+            )
+            self.assertTrue(email)
+
+            gmail.generator.accounts[first].delete_message(message.id)
+            sync(user=first)
+            self.assertTrue(frappe.db.exists("Single Email CT", email.name))
+            self.assertTrue(frappe.db.exists("Gmail Thread", email.parent))
+            involved = frappe.get_all(
+                "Involved User", filters={"parent": email.parent}, pluck="account"
+            )
+            self.assertIn(second, involved)
+            self.assertNotIn(first, involved)
+
+    def test_shared_email_is_stored_once(self):
+        with self.fake_gmail(
+            accounts=2,
+            threads_per_account=3,
+            max_thread_length=2,
+            cross_account_duplicates=1,
+        ) as gmail:
+            for user in gmail.users:
+                sync(user=user)
+        message_ids = {
+            m.message_id
+            for account in gmail.generator.accounts.values()
+            for m in account.messages.values()
+        }
+        self.assertEqual(
+            frappe.db.count("Single Email CT", {"gmail_account": ["in", gmail.users]}),
+            len(message_ids),
+        )
+        for thread in frappe.get_all(
+            "Gmail Thread",
+            filters={"gmail_account": ["in", gmail.users]},
+            pluck="name",
+        ):
+            involved = frappe.get_all(
+                "Involved User", filters={"parent": thread}, pluck="account"
+            )
+            self.assertTrue(set(gmail.users).issubset(involved))
+
+    def test_shared_email_links_the_thread_without_saving_it(self):
+        with self.fake_gmail(
+            accounts=2,
+            threads_per_account=2,
+            max_thread_length=1,
+            cross_account_duplicates=1,
+            attachment_size=64,
+            attachment_probability=1,
+        ) as gmail:
+            first, second = gmail.users
+            sync(user=first)
+            # every thread has a message from one account to the other, all are stored
+            threads = frappe.get_all(
+                "Gmail Thread",
+                filters={"gmail_account": first},
+                fields=["name", "modified"],
+            )
+            emails = frappe.db.count("Single Email CT")
+
+            sync(user=second)
+        self.assertEqual(frappe.db.count("Single Email CT"), emails)
+        for thread in threads:
+            self.assertEqual(
+                frappe.db.get_value("Gmail Thread", thread.name, "modified"),
+                thread.modified,
+            )
+            involved = frappe.get_all(
+                "Involved User", filters={"parent": thread.name}, pluck="account"
+            )
+            self.assertEqual(sorted(involved), sorted(gmail.users))
+            self.assertFalse(add_involved_user(thread.name, second))
+            attachments = frappe.get_all(
+                "File",
+                filters={
+                    "attached_to_doctype": "Gmail Thread",
+                    "attached_to_name": thread.name,
+                },
+                pluck="name",
+            )
+            self.assertTrue(attachments)
+            for attachment in attachments:
+                self.assertTrue(
+                    frappe.db.exists(
+                        "DocShare",
+                        {
+                            "share_doctype": "File",
+                            "share_name": attachment,
+                            "user": second,
+                            "read": 1,
+                        },
+                    )
+                )
+
+    def test_enabling_a_label_only_backfills_that_label(self):
+        with self.fake_gmail(
+            threads_per_account=5, label_overlap=1, label_ids=["INBOX"]
+        ) as gmail:
+            user = gmail.user
+            sync(user=user)
+            inbox_cursor = frappe.db.get_value(
+                "Gmail Label", {"parent": user, "label_id": "INBOX"}, "last_historyid"
+            )
+            self.assertTrue(inbox_cursor)
+
+            setup_account(user, label_ids=["INBOX", "Label_1"])
+            self.assertEqual(
+                frappe.db.get_value(
+                    "Gmail Label",
+                    {"parent": user, "label_id": "INBOX"},
+                    "last_historyid",
+                ),
+                inbox_cursor,
+            )
+            gmail.fake.reset_stats()
+            sync(user=user)
+            calls = gmail.fake.stats()["calls"]
+            self.assertEqual(calls.get("threads.list"), 1)
+            self.assertEqual(calls.get("history.list"), 1)
+
+    def test_backfill_stores_the_most_recent_threads_first(self):
+        # every synthetic thread starts with a message sent by the mailbox owner
+        with self.fake_gmail(
+            threads_per_account=8,
+            label_ids=["SENT"],
+            conf={"gmail_thread_recent_backfill_threads": 3},
+        ) as gmail:
+            user, mailbox = gmail.user, gmail.mailbox
+            sync(user=user)
+            self.assertTrue(
+                frappe.db.get_value("Gmail Account", user, "last_historyid")
+            )
+            self.assertEqual(
+                set(get_gmail_thread_ids(user)), set(list(mailbox.threads)[-3:])
+            )
+
+            self.assertEqual(
+                frappe.db.get_value(
+                    "Gmail Account",
+                    user,
+                    ["backfilled_threads", "backfill_threads_total"],
+                ),
+                (3, 8),
+            )
+
+            self.assertFalse(sync(user=user, older=True))
+            self.assertEqual(count_emails(user), len(mailbox.messages))
+            self.assertEqual(
+                frappe.db.get_value("Gmail Account", user, "backfill_progress"),
+                100,
+            )
+
+    def test_backfill_restarts_by_date_when_its_page_token_is_rejected(self):
+        with self.fake_gmail(
+            threads_per_account=8,
+            label_ids=["SENT"],
+            conf={"gmail_thread_recent_backfill_threads": 3},
+        ) as gmail:
+            user, mailbox = gmail.user, gmail.mailbox
+            sync(user=user)
+            self.assertTrue(
+                frappe.db.get_value(
+                    "Gmail Label",
+                    {"parent": user, "label_id": "SENT"},
+                    "backfill_page_token",
+                )
+            )
+            stored = count_emails(user)
+
+            mailbox.expire_page_tokens()
+            gmail.fake.reset_stats()
+            self.assertFalse(sync(user=user, older=True))
+            self.assertEqual(count_emails(user), len(mailbox.messages))
+            # the most recent threads are listed again, not downloaded again
+            self.assertEqual(
+                gmail.fake.stats()["calls"].get("messages.get"),
+                len(mailbox.messages) - stored,
+            )
+            self.assertTrue(
+                frappe.db.get_value(
+                    "Gmail Label",
+                    {"parent": user, "label_id": "SENT"},
+                    "backfill_before",
+                )
+            )
+
+    def test_backfill_stops_at_the_thread_limit(self):
+        with self.fake_gmail(threads_per_account=8, label_ids=["SENT"]) as gmail:
+            user = gmail.user
+            frappe.db.set_value("Gmail Account", user, "max_backfill_threads", 5)
+            sync(user=user)
+            self.assertFalse(sync(user=user, older=True))
+            self.assertEqual(
+                set(get_gmail_thread_ids(user)),
+                set(list(gmail.mailbox.threads)[-5:]),
+            )
+
+    def test_summary_backfill_matches_the_sync_write_path(self):
+        fields = [
+            "name",
+            "email_count",
+            "attachment_count",
+            "last_email_at",
+            "last_sender",
+            "snippet",
+        ]
+        with self.fake_gmail(threads_per_account=4, min_thread_length=2) as gmail:
+            sync(user=gmail.user)
+        filters = {"gmail_account": gmail.user}
+        synced = frappe.get_all("Gmail Thread", filters=filters, fields=fields)
+        self.assertTrue(all(x.snippet for x in synced))
+        frappe.db.set_value(
+            "Gmail Thread",
+            {"name": ["in", [x.name for x in synced]]},
+            {"email_count": 0, "last_sender": "", "snippet": ""},
+            update_modified=False,
+        )
+
+        backfill_thread_summary.execute()
+        self.assertEqual(
+            frappe.get_all("Gmail Thread", filters=filters, fields=fields), synced
+        )
+
+    def test_threads_are_found_by_participant(self):
+        with self.fake_gmail(threads_per_account=5) as gmail:
+            user = gmail.user
+            sync(user=user)
+        threads = set(
+            frappe.get_all(
+                "Gmail Thread", filters={"gmail_account": user}, pluck="name"
+            )
+        )
+        self.assertEqual(len(threads), len(gmail.mailbox.threads))
+        for kwargs in (
+            {"address": ACCOUNTS[0].upper()},
+            {"domain": "@Example.com"},
+            {"address": ACCOUNTS[0], "role": "From"},
+        ):
+            self.assertEqual(
+                {
+                    x.name
+                    for x in get_threads(**kwargs, page_length=100)
+                    if x.name in threads
+                },
+                threads,
+                kwargs,
+            )
+
+    def test_timeline_shows_the_emails_of_linked_threads(self):
+        with self.fake_gmail(threads_per_account=3, min_thread_length=2) as gmail:
+            user = gmail.user
+            sync(user=user)
+        thread = frappe.get_all(
+            "Gmail Thread", filters={"gmail_account": user}, pluck="name", limit=1
+        )[0]
+        frappe.db.set_value(
+            "Gmail Thread",
+            thread,
+            {"reference_doctype": "User", "reference_name": user},
+        )
+        emails = frappe.get_all(
+            "Single Email CT",
+            filters={"parent": thread},
+            pluck="name",
+            order_by="date_and_time asc, idx asc",
+        )
+        frappe.db.set_value("Single Email CT", emails[0], "removed_from_gmail", 1)
+
+        timeline = get_linked_gmail_threads("User", user)
+        self.assertEqual(len(timeline), len(emails) - 1)
+        self.assertTrue(all(x["name"] == thread for x in timeline))
+        self.assertTrue(all(x["template_data"]["doc"]["content"] for x in timeline))
+        # the thread form shows it, marked as removed
+        self.assertEqual(
+            [
+                (x.name, x.removed_from_gmail)
+                for x in get_thread_emails(thread)["emails"]
+            ],
+            [(x, int(x == emails[0])) for x in emails],
+        )
+
+    def test_timeline_links_to_threads_with_older_emails(self):
+        with self.fake_gmail(threads_per_account=1, min_thread_length=3) as gmail:
+            user = gmail.user
+            sync(user=user)
+        (thread,) = frappe.get_all(
+            "Gmail Thread", filters={"gmail_account": user}, pluck="name"
+        )
+        frappe.db.set_value(
+            "Gmail Thread",
+            thread,
+            {"reference_doctype": "User", "reference_name": user},
+        )
+        emails = count_emails(user)
+
+        with patch("frappe_gmail_thread.api.activity.TIMELINE_EMAILS_LIMIT", 2):
+            timeline = get_linked_gmail_threads("User", user)
+        hidden, *shown = timeline
+        self.assertEqual(len(shown), 2)
+        self.assertIn(str(emails - 2), hidden["content"])
+        self.assertIn(
+            frappe.get_doc("Gmail Thread", thread).get_url(), hidden["content"]
+        )
+        self.assertLess(hidden["creation"], shown[0]["creation"])
+
+    def test_permission_hooks_do_not_import_the_sync_engine(self):
+        # hooks of every web request import the controller, keep the Google client out of it
+        controller = (
+            "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread"
+        )
+        script = f"import sys; import {controller}; print(' '.join(sys.modules))"
+        modules = subprocess.check_output(
+            [sys.executable, "-c", script],
+            text=True,
+        ).split()
+        self.assertNotIn("googleapiclient", modules)
+        self.assertNotIn("frappe_gmail_thread.utils.helpers", modules)
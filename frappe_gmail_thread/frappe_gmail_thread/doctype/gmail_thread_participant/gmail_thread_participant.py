@@ -0,0 +1,15 @@
+# Copyright (c) 2026, rtCamp and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class GmailThreadParticipant(Document):
+    pass
+
+
+def on_doctype_update():
+    # threads of an address or a domain are found without reading the rows
+    frappe.db.add_index("Gmail Thread Participant", ["address", "parent"])
+    frappe.db.add_index("Gmail Thread Participant", ["domain", "parent"])
@@ -1,9 +1,14 @@
 # Copyright (c) 2024, rtCamp and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class SingleEmailCT(Document):
     pass
+
+
+def on_doctype_update():
+    # listed messages are checked against those an account stored on every page of a sync
+    frappe.db.add_index("Single Email CT", ["gmail_account", "gmail_message_id"])
@@ -143,11 +143,12 @@ has_permission = {
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"Communication": {
-# 		"after_insert": "frappe_gmail_thread.doc_events.communication.after_insert",
-# 	},
-# }
+doc_events = {
+    "User": {
+        "on_update": "frappe_gmail_thread.api.pubsub.clear_user_by_email_cache",
+        "on_trash": "frappe_gmail_thread.api.pubsub.clear_user_by_email_cache",
+    },
+}
 
 # Fixtures
 # ----------
@@ -183,10 +184,8 @@ scheduler_events = {
     # 	"all": [
     # 		"frappe_gmail_thread.tasks.all"
     # 	],
-    "daily": ["frappe_gmail_thread.tasks.daily.enable_pubsub_everyday"],
-    # 	"hourly": [
-    # 		"frappe_gmail_thread.tasks.hourly"
-    # 	],
+    "daily_long": ["frappe_gmail_thread.tasks.daily.archive_old_email_bodies"],
+    "hourly": ["frappe_gmail_thread.tasks.watch.renew_expiring_watches"],
     # 	"weekly": [
     # 		"frappe_gmail_thread.tasks.weekly"
     # 	],
@@ -194,7 +193,11 @@ scheduler_events = {
     # 		"frappe_gmail_thread.tasks.monthly"
     # 	],
     "cron": {
-        "*/30 * * * *": ["frappe_gmail_thread.tasks.sync.sync_emails"],
+        "*/5 * * * *": ["frappe_gmail_thread.tasks.sync.sync_emails"],
+        "* * * * *": [
+            "frappe_gmail_thread.api.pubsub.drain_notifications",
+            "frappe_gmail_thread.utils.scheduler.dispatch_pending_syncs",
+        ],
     },
 }
 
@@ -270,6 +273,6 @@ scheduler_events = {
 # Automatically update python controller files with type annotations for this app.
 # export_python_type_annotations = True
 
-# default_log_clearing_doctypes = {
-# 	"Logging DocType Name": 30  # days to retain logs
-# }
+default_log_clearing_doctypes = {
+    "Gmail Sync Log": 30,  # days to retain logs
+}
@@ -0,0 +1,8 @@
+from frappe_gmail_thread.frappe_gmail_thread.doctype.single_email_ct.single_email_ct import (
+    on_doctype_update,
+)
+
+
+def execute():
+    # on_doctype_update only runs when the doctype changes, existing sites get the index here
+    on_doctype_update()
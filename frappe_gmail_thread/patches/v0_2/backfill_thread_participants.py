@@ -0,0 +1,25 @@
+import frappe
+
+from frappe_gmail_thread.utils.participants import add_participants
+
+BATCH_SIZE = 5000
+
+
+def execute():
+    # rebuilt from scratch, so the patch can run again
+    frappe.db.delete("Gmail Thread Participant")
+    last_name = ""
+    while True:
+        # paged by name rather than offset, so each batch is a range scan of the primary key
+        emails = frappe.get_all(
+            "Single Email CT",
+            filters={"parenttype": "Gmail Thread", "name": [">", last_name]},
+            fields=["name", "parent", "sender", "recipients", "cc", "bcc"],
+            order_by="name asc",
+            page_length=BATCH_SIZE,
+        )
+        if not emails:
+            break
+        add_participants(emails)
+        frappe.db.commit()  # nosemgrep
+        last_name = emails[-1].name
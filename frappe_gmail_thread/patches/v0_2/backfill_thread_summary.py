@@ -0,0 +1,90 @@
+import frappe
+
+from frappe_gmail_thread.utils.cold_storage import load_email_body
+from frappe_gmail_thread.utils.helpers import get_snippet
+
+BATCH_SIZE = 1000
+
+
+def execute():
+    backfill_thread_summary()
+    backfill_thread_snippets()
+
+
+def backfill_thread_summary():
+    frappe.db.sql(
+        """
+        update `tabGmail Thread` thread
+        set
+            thread.email_count = (
+                select count(*) from `tabSingle Email CT` email
+                where email.parent = thread.name and email.parenttype = 'Gmail Thread'
+            ),
+            thread.attachment_count = (
+                select coalesce(sum(json_length(email.attachments_data)), 0)
+                from `tabSingle Email CT` email
+                where email.parent = thread.name and email.parenttype = 'Gmail Thread'
+                and json_valid(email.attachments_data)
+            ),
+            thread.last_email_at = (
+                select max(email.date_and_time) from `tabSingle Email CT` email
+                where email.parent = thread.name and email.parenttype = 'Gmail Thread'
+            ),
+            thread.last_sender = (
+                select email.sender from `tabSingle Email CT` email
+                where email.parent = thread.name and email.parenttype = 'Gmail Thread'
+                order by email.date_and_time desc limit 1
+            )
+        """
+    )
+
+
+def backfill_thread_snippets():
+    """
+    Snippets go through `get_snippet`, like the sync write path, with the bodies of archived
+    emails read from cold storage.
+    """
+    last_thread = ""
+    while True:
+        threads = frappe.get_all(
+            "Gmail Thread",
+            filters={"name": [">", last_thread]},
+            order_by="name asc",
+            pluck="name",
+            page_length=BATCH_SIZE,
+        )
+        if not threads:
+            break
+        for email in get_last_emails(threads):
+            load_email_body(email)
+            frappe.db.set_value(
+                "Gmail Thread",
+                email.parent,
+                "snippet",
+                get_snippet(email.plain_content),
+                update_modified=False,
+            )
+        frappe.db.commit()  # nosemgrep
+        last_thread = threads[-1]
+
+
+def get_last_emails(threads):
+    return frappe.db.sql(
+        """
+        select name, parent, plain_content, body_archived, body_archive_path
+        from (
+            select
+                email.name, email.parent, email.plain_content, email.body_archived,
+                email.body_archive_path,
+                row_number() over (
+                    partition by email.parent
+                    order by email.date_and_time desc, email.idx desc
+                ) as position
+            from `tabSingle Email CT` email
+            where email.parenttype = 'Gmail Thread' and email.parent in %(threads)s
+        ) last_email
+        where position = 1
+        """,
+        {"threads": threads},
+        as_dict=True,
+    )
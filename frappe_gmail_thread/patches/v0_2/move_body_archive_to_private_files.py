@@ -0,0 +1,23 @@
+import os
+import shutil
+
+import frappe
+
+from frappe_gmail_thread.utils.cold_storage import ARCHIVE_FOLDER, get_archive_root
+
+
+def execute():
+    # archives were first written outside private/files, where backups do not look
+    old_root = frappe.get_site_path("private", ARCHIVE_FOLDER)
+    if not os.path.isdir(old_root):
+        return
+    new_root = get_archive_root()
+    for shard in os.listdir(old_root):
+        os.makedirs(os.path.join(new_root, shard), exist_ok=True)
+        for name in os.listdir(os.path.join(old_root, shard)):
+            # paths stored on Single Email CT are relative to the archive root
+            os.replace(
+                os.path.join(old_root, shard, name),
+                os.path.join(new_root, shard, name),
+            )
+    shutil.rmtree(old_root)
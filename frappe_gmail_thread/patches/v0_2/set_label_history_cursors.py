@@ -0,0 +1,13 @@
+import frappe
+
+
+def execute():
+    # labels used to share the history id of their account
+    frappe.db.sql(
+        """
+        update `tabGmail Label` label
+        join `tabGmail Account` account on account.name = label.parent
+        set label.last_historyid = account.last_historyid
+        where label.parenttype = 'Gmail Account' and label.enabled = 1
+        """
+    )
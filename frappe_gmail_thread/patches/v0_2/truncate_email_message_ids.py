@@ -0,0 +1,15 @@
+import frappe
+
+from frappe_gmail_thread.utils.helpers import MESSAGE_ID_LENGTH
+
+
+def execute():
+    # email_message_id becomes an indexed varchar, longer ids would fail the column change
+    frappe.db.sql(
+        """
+        update `tabSingle Email CT`
+        set email_message_id = left(email_message_id, %(length)s)
+        where char_length(email_message_id) > %(length)s
+        """,
+        {"length": MESSAGE_ID_LENGTH},
+    )
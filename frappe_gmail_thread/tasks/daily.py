@@ -1,25 +1,15 @@
 import frappe
+from frappe.utils import add_days, cint, now_datetime
 
-from frappe_gmail_thread.api.oauth import enable_pubsub
+from frappe_gmail_thread.utils.cold_storage import archive_email_bodies_before
 
 
-def enable_pubsub_everyday():
-    google_settings = frappe.get_single("Google Settings")
-    if not google_settings.enable:
-        return
-    if (
-        not google_settings.custom_gmail_sync_in_realtime
-        or not google_settings.custom_gmail_pubsub_topic
-    ):
-        return
-
-    gmail_accounts = frappe.get_all(
-        "Gmail Account", filters={"gmail_enabled": 1}, fields=["name"]
+def archive_old_email_bodies():
+    archive_after_days = cint(
+        frappe.db.get_single_value(
+            "Google Settings", "custom_gmail_archive_bodies_after_days"
+        )
     )
-    for gmail_account in gmail_accounts:
-        gaccount = frappe.get_doc("Gmail Account", gmail_account.name)
-        try:
-            enable_pubsub(gaccount)
-        except Exception as e:
-            frappe.log_error(title="PubSub Error", message=e)
-            continue
+    if archive_after_days <= 0:
+        return
+    archive_email_bodies_before(add_days(now_datetime(), -archive_after_days))
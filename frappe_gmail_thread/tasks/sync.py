@@ -1,23 +1,39 @@
 import frappe
-from frappe.utils.background_jobs import is_job_enqueued
+
+from frappe_gmail_thread.utils.polling import get_due_accounts
+from frappe_gmail_thread.utils.scheduler import (
+    enqueue_backfill,
+    enqueue_sync,
+    is_backfill,
+)
 
 
 def sync_emails():
     gmail_accounts = frappe.get_all(
         "Gmail Account",
-        filters={"gmail_enabled": 1},
-        fields=["name"],
+        filters={"gmail_enabled": 1, "refresh_token": ["is", "set"]},
+        fields=["linked_user", "last_historyid", "watch_expiration"],
     )
-    for gmail_account in gmail_accounts:
-        gaccount = frappe.get_doc("Gmail Account", gmail_account.name)
-        if gaccount.refresh_token:
-            user = gaccount.linked_user
-            job_name = f"gmail_thread_sync_{user}"
-            if not is_job_enqueued(job_name):
-                frappe.enqueue(
-                    "frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread.sync",
-                    user=user,
-                    queue="long",
-                    job_name=job_name,
-                    job_id=job_name,
-                )
+    due_accounts = get_due_accounts(gmail_accounts)
+    # incremental syncs first, the queue of backfills is drained last anyway
+    due_accounts.sort(key=lambda x: is_backfill(x.last_historyid))
+    for gmail_account in due_accounts:
+        enqueue_sync(
+            gmail_account.linked_user,
+            backfill=is_backfill(gmail_account.last_historyid),
+        )
+    # resume backfills of older threads whose next slice was lost
+    users = {x.linked_user for x in gmail_accounts}
+    for user in frappe.get_all(
+        "Gmail Label",
+        filters={
+            "parenttype": "Gmail Account",
+            "enabled": 1,
+            "last_historyid": [">", 0],
+            "backfill_page_token": ["is", "set"],
+        },
+        pluck="parent",
+        distinct=True,
+    ):
+        if user in users:
+            enqueue_backfill(user)
@@ -0,0 +1,111 @@
+import frappe
+from frappe.utils import add_to_date, get_datetime, now_datetime
+from frappe.utils.background_jobs import is_job_enqueued
+from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
+
+from frappe_gmail_thread.api.oauth import enable_pubsub, get_gmail_object
+from frappe_gmail_thread.utils.metrics import incr
+
+RENEW_METHOD = "frappe_gmail_thread.tasks.watch.renew_watch"
+# watches last 7 days, renewing the ones that expire within a day leaves room for retries
+RENEW_BEFORE = 24 * 60 * 60
+# accounts watched for the first time are spread over the following runs
+MAX_RENEWALS_PER_RUN = 50
+# an account whose renewal failed is retried after this long, revoked grants keep failing
+RENEW_RETRY_INTERVAL = 6 * 60 * 60
+
+
+def renew_expiring_watches():
+    """
+    Renew the Gmail watches that expire soon, each in its own background job.
+    Accounts whose watch lapsed are polled by `sync_emails` until it is renewed.
+
+    Watches still running go first, so accounts whose renewal keeps failing cannot crowd
+    them out. Lapsed and new watches fill the rest of the run, the ones that failed within
+    `RENEW_RETRY_INTERVAL` are skipped.
+    """
+    google_settings = frappe.get_single("Google Settings")
+    if (
+        not google_settings.enable
+        or not google_settings.custom_gmail_sync_in_realtime
+        or not google_settings.custom_gmail_pubsub_topic
+    ):
+        return
+    now = now_datetime()
+    for gmail_account in get_watches_to_renew(now):
+        if (
+            gmail_account.watch_expiration
+            and get_datetime(gmail_account.watch_expiration) < now
+        ):
+            incr("gmail_thread_watch_lapsed_total", account=gmail_account.linked_user)
+        job_id = f"gmail_thread_watch_{gmail_account.linked_user}"
+        if not is_job_enqueued(job_id):
+            frappe.enqueue(
+                RENEW_METHOD,
+                user=gmail_account.linked_user,
+                queue="short",
+                job_id=job_id,
+            )
+
+
+def get_watches_to_renew(now):
+    filters = {"gmail_enabled": 1, "refresh_token": ["is", "set"]}
+    fields = ["linked_user", "watch_expiration", "watch_renewal_failed_at"]
+    gmail_accounts = frappe.get_all(
+        "Gmail Account",
+        filters={
+            **filters,
+            "watch_expiration": [
+                "between",
+                [now, add_to_date(now, seconds=RENEW_BEFORE)],
+            ],
+        },
+        fields=fields,
+        order_by="watch_expiration asc",
+        limit=MAX_RENEWALS_PER_RUN,
+    )
+    if len(gmail_accounts) >= MAX_RENEWALS_PER_RUN:
+        return gmail_accounts
+    retry_before = add_to_date(now, seconds=-RENEW_RETRY_INTERVAL)
+    # the ones that never failed sort first, then the ones that failed the longest ago
+    for gmail_account in frappe.get_all(
+        "Gmail Account",
+        filters=filters,
+        or_filters=[
+            ["watch_expiration", "is", "not set"],
+            ["watch_expiration", "<", now],
+        ],
+        fields=fields,
+        order_by="watch_renewal_failed_at asc",
+        limit=MAX_RENEWALS_PER_RUN - len(gmail_accounts),
+    ):
+        if (
+            not gmail_account.watch_renewal_failed_at
+            or get_datetime(gmail_account.watch_renewal_failed_at) < retry_before
+        ):
+            gmail_accounts.append(gmail_account)
+    return gmail_accounts
+
+
+def renew_watch(user):
+    """
+    Renew the Gmail watch of `user`. Errors of the Gmail API and revoked or missing
+    authorizations are logged, the account is polled until a later run renews it.
+    """
+    gmail_account = frappe.get_doc("Gmail Account", {"linked_user": user})
+    try:
+        # the mailbox was verified when it was authorized
+        enable_pubsub(gmail_account, get_gmail_object(gmail_account, check=False))
+    except (HttpError, RefreshError, frappe.ValidationError):
+        frappe.log_error(frappe.get_traceback(), "PubSub Error")
+        failed_at = now_datetime()
+    else:
+        failed_at = None
+    frappe.db.set_value(
+        "Gmail Account",
+        gmail_account.name,
+        "watch_renewal_failed_at",
+        failed_at,
+        update_modified=False,
+    )
@@ -0,0 +1,83 @@
+import os
+
+import frappe
+
+from frappe_gmail_thread.frappe_gmail_thread.doctype.gmail_thread.gmail_thread import (
+    get_thread_emails,
+)
+from frappe_gmail_thread.tests.utils import FakeGmailTestCase
+from frappe_gmail_thread.utils.cold_storage import (
+    archive_email,
+    get_archive_root,
+    read_archive,
+    write_archive,
+)
+from frappe_gmail_thread.utils.helpers import get_snippet
+from frappe_gmail_thread.utils.removals import refresh_thread_summary
+from frappe_gmail_thread.utils.sync_engine import sync
+
+BODY_FIELDS = ["name", "parent", "content", "plain_content", "body_archive_path"]
+
+
+class TestColdStorage(FakeGmailTestCase):
+    def sync_emails(self):
+        with self.fake_gmail(threads_per_account=3, min_thread_length=2) as gmail:
+            sync(user=gmail.user)
+        return frappe.get_all(
+            "Single Email CT",
+            filters={"gmail_account": gmail.user},
+            fields=BODY_FIELDS,
+            order_by="date_and_time asc, idx asc",
+        )
+
+    def test_archive_round_trip(self):
+        relative_path = write_archive("test-email", "<p>Hello</p>", "Hello")
+        self.addCleanup(os.remove, os.path.join(get_archive_root(), relative_path))
+        self.assertFalse(os.path.isabs(relative_path))
+        self.assertEqual(
+            read_archive(relative_path),
+            {"content": "<p>Hello</p>", "plain_content": "Hello"},
+        )
+
+    def test_archived_bodies_are_restored_on_access(self):
+        emails = self.sync_emails()
+        for email in emails:
+            archive_email(email)
+        for email in emails:
+            stored = frappe.db.get_value(
+                "Single Email CT",
+                email.name,
+                ["body_archived", *BODY_FIELDS],
+                as_dict=1,
+            )
+            self.assertEqual(stored.body_archived, 1)
+            self.assertFalse(stored.content or stored.plain_content)
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(get_archive_root(), stored.body_archive_path)
+                )
+            )
+
+        thread = emails[0].parent
+        restored = get_thread_emails(thread, page_length=100)["emails"]
+        originals = {x.name: x for x in emails if x.parent == thread}
+        self.assertEqual(len(restored), len(originals))
+        for email in restored:
+            self.assertEqual(email.content, originals[email.name].content)
+            self.assertEqual(email.plain_content, originals[email.name].plain_content)
+
+    def test_summary_snippet_is_read_from_the_archive(self):
+        emails = self.sync_emails()
+        thread = emails[0].parent
+        last_email = [x for x in emails if x.parent == thread][-1]
+        self.assertTrue(last_email.plain_content)
+        archive_email(last_email)
+        frappe.db.set_value(
+            "Gmail Thread", thread, "snippet", "", update_modified=False
+        )
+
+        refresh_thread_summary(thread)
+        self.assertEqual(
+            frappe.db.get_value("Gmail Thread", thread, "snippet"),
+            get_snippet(last_email.plain_content),
+        )
@@ -0,0 +1,87 @@
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_gmail_thread.api.metrics import render_metrics
+from frappe_gmail_thread.utils.metrics import (
+    COUNTERS_KEY,
+    GAUGES_KEY,
+    format_series,
+    incr,
+    record_api_error,
+    set_gauge,
+)
+
+ACCOUNT = "metrics-test@example.com"
+
+
+class TestMetrics(FrappeTestCase):
+    def tearDown(self):
+        for key in (COUNTERS_KEY, GAUGES_KEY):
+            key = frappe.cache.make_key(key)
+            for series in frappe.cache.execute_command("HKEYS", key):
+                if ACCOUNT in frappe.safe_decode(series):
+                    frappe.cache.execute_command("HDEL", key, series)
+
+    def get_samples(self):
+        return dict(
+            line.rsplit(" ", 1)
+            for line in render_metrics().splitlines()
+            if not line.startswith("#")
+        )
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(
+            format_series("metric", {"reason": 'a"b\\c\nd', "account": "x"}),
+            'metric{account="x",reason="a\\"b\\\\c\\nd"}',
+        )
+        self.assertEqual(format_series("metric", {}), "metric")
+
+    def test_large_values_keep_every_digit(self):
+        incr("gmail_thread_messages_ingested_total", 1_234_567, account=ACCOUNT)
+        set_gauge(
+            "gmail_thread_last_sync_timestamp_seconds",
+            1_760_000_123.25,
+            account=ACCOUNT,
+        )
+        label = f'{{account="{ACCOUNT}"}}'
+        samples = self.get_samples()
+        self.assertEqual(
+            samples[f"gmail_thread_messages_ingested_total{label}"], "1234567"
+        )
+        self.assertEqual(
+            samples[f"gmail_thread_last_sync_timestamp_seconds{label}"],
+            "1760000123.25",
+        )
+
+    def test_counters_and_sync_lag(self):
+        incr("gmail_thread_messages_ingested_total", 3, account=ACCOUNT)
+        incr("gmail_thread_messages_ingested_total", 2, account=ACCOUNT)
+        # zero increments do not create a series
+        incr("gmail_thread_api_calls_total", 0, account=ACCOUNT)
+        record_api_error(ACCOUNT, "rateLimitExceeded")
+        set_gauge(
+            "gmail_thread_last_ingested_timestamp_seconds",
+            time.time() - 600,
+            account=ACCOUNT,
+        )
+
+        samples = self.get_samples()
+        label = f'{{account="{ACCOUNT}"}}'
+        self.assertEqual(samples[f"gmail_thread_messages_ingested_total{label}"], "5")
+        self.assertNotIn(f"gmail_thread_api_calls_total{label}", samples)
+        self.assertEqual(
+            samples[
+                f'gmail_thread_api_errors_total{{account="{ACCOUNT}",reason="rateLimitExceeded"}}'
+            ],
+            "1",
+        )
+        self.assertAlmostEqual(
+            float(samples[f"gmail_thread_sync_lag_seconds{label}"]), 600, delta=60
+        )
+        self.assertIn('gmail_thread_sync_jobs{state="queued"}', samples)
+
+        output = render_metrics()
+        self.assertIn("# TYPE gmail_thread_messages_ingested_total counter", output)
+        self.assertIn("# TYPE gmail_thread_sync_lag_seconds gauge", output)
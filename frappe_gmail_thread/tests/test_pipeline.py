@@ -0,0 +1,103 @@
+import threading
+import time
+
+import frappe
+
+from frappe_gmail_thread.api.oauth import get_gmail_object
+from frappe_gmail_thread.tests.utils import FakeGmailTestCase
+from frappe_gmail_thread.utils.pipeline import SyncPipeline
+
+
+def parse_id(raw_email, spool_dir=None):
+    if raw_email["id"] == "unparsable":
+        raise ValueError(raw_email["id"])
+    return raw_email["id"]
+
+
+class TestSyncPipeline(FakeGmailTestCase):
+    def get_pipeline(self, gmail, **kwargs):
+        return SyncPipeline(
+            get_gmail_object(frappe.get_doc("Gmail Account", gmail.user), check=False),
+            **kwargs,
+        )
+
+    def test_messages_are_yielded_in_order(self):
+        def fetch(gmail, message, http):
+            # later messages are downloaded first
+            time.sleep((20 - message["id"]) / 1000)
+            return message
+
+        with self.fake_gmail(threads_per_account=1) as gmail:
+            messages = [{"id": i} for i in range(20)]
+            with self.get_pipeline(gmail, fetch_workers=4, parse_workers=2) as pipeline:
+                self.assertEqual(
+                    list(pipeline.process(messages, fetch, parse_id)),
+                    [(x, x, x["id"]) for x in messages],
+                )
+
+    def test_messages_in_flight_are_bounded_by_the_window(self):
+        lock = threading.Lock()
+        fetched = []
+
+        def fetch(gmail, message, http):
+            with lock:
+                fetched.append(message["id"])
+            return message
+
+        with (
+            self.fake_gmail(threads_per_account=1) as gmail,
+            self.get_pipeline(gmail, fetch_workers=2, parse_workers=1) as pipeline,
+        ):
+            self.assertEqual(pipeline.window, 8)
+            ahead = []
+            for message, _, _ in pipeline.process(
+                [{"id": i} for i in range(30)], fetch, parse_id
+            ):
+                # a slow writer, the fetch workers catch up with the window
+                time.sleep(0.01)
+                with lock:
+                    ahead.append(len(fetched) - message["id"])
+            self.assertEqual(max(ahead), pipeline.window)
+
+    def test_errors_are_raised_for_their_message(self):
+        def fetch(gmail, message, http):
+            if message["id"] == "unfetchable":
+                raise ConnectionError(message["id"])
+            return message
+
+        with self.fake_gmail(threads_per_account=1) as gmail:
+            for failing, error in (
+                ("unfetchable", ConnectionError),
+                ("unparsable", ValueError),
+            ):
+                with self.get_pipeline(gmail) as pipeline:
+                    yielded = []
+                    with self.assertRaises(error):
+                        for message, _, _ in pipeline.process(
+                            [{"id": 1}, {"id": failing}, {"id": 2}], fetch, parse_id
+                        ):
+                            yielded.append(message["id"])
+                    self.assertEqual(yielded, [1])
+
+    def test_close_stops_every_worker(self):
+        with self.fake_gmail(threads_per_account=1) as gmail:
+            pipeline = self.get_pipeline(gmail, fetch_workers=3, parse_workers=2)
+            results = pipeline.process(
+                [{"id": i} for i in range(10)],
+                lambda gmail, message, http: message,
+                parse_id,
+            )
+            # the writer gives up half way
+            next(results)
+            pipeline.close()
+            self.assertFalse(
+                [
+                    thread
+                    for thread in threading.enumerate()
+                    if thread.name.startswith(("gmail-fetch", "gmail-parse"))
+                ]
+            )
+            # the context of the writer is left untouched
+            self.assertEqual(
+                frappe.db.get_value("User", "Administrator"), "Administrator"
+            )
@@ -0,0 +1,98 @@
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from frappe_gmail_thread.tests.utils import override_google_settings
+from frappe_gmail_thread.utils.polling import (
+    LAST_POLL_KEY,
+    LAST_PUSH_KEY,
+    MAX_POLL_INTERVAL,
+    MIN_POLL_INTERVAL,
+    PUSH_POLL_INTERVAL,
+    RATE_WINDOW,
+    get_due_accounts,
+    get_poll_interval,
+    record_push,
+)
+
+ACCOUNTS = [f"polling-test-{i}@example.com" for i in range(4)]
+
+
+class TestPolling(FrappeTestCase):
+    def tearDown(self):
+        frappe.db.delete("Gmail Sync Log", {"gmail_account": ["in", ACCOUNTS]})
+        frappe.cache.delete_value(LAST_PUSH_KEY)
+        frappe.cache.delete_value(LAST_POLL_KEY)
+
+    def add_sync_log(self, gmail_account, messages, ended_at):
+        frappe.get_doc(
+            {
+                "doctype": "Gmail Sync Log",
+                "gmail_account": gmail_account,
+                "status": "Success",
+                "started_at": ended_at,
+                "ended_at": ended_at,
+                "messages_fetched": messages,
+            }
+        ).insert(ignore_permissions=True, ignore_links=True)
+
+    def test_poll_interval_follows_the_message_rate(self):
+        now = time.time()
+        # a message every 10 minutes
+        self.assertEqual(get_poll_interval(RATE_WINDOW / 600, None, now), 600)
+        self.assertEqual(get_poll_interval(10_000, None, now), MIN_POLL_INTERVAL)
+        self.assertEqual(get_poll_interval(0, None, now), MAX_POLL_INTERVAL)
+
+    def test_working_push_slows_polling_down(self):
+        now = time.time()
+        messages = RATE_WINDOW / 600
+        self.assertEqual(get_poll_interval(messages, now - 60, now), PUSH_POLL_INTERVAL)
+        # silent for longer than three of the account's usual message gaps
+        self.assertEqual(get_poll_interval(messages, now - 3600, now), 600)
+
+    def test_due_accounts(self):
+        backfilling, unsynced, recent, stale = ACCOUNTS
+        now = now_datetime()
+        self.add_sync_log(backfilling, 10, now)
+        self.add_sync_log(recent, 0, now)
+        self.add_sync_log(stale, 0, add_to_date(now, seconds=-MAX_POLL_INTERVAL - 60))
+        gmail_accounts = [
+            frappe._dict(
+                linked_user=user,
+                last_historyid=0 if user == backfilling else 100,
+                watch_expiration=None,
+            )
+            for user in ACCOUNTS
+        ]
+        self.assertEqual(
+            [x.linked_user for x in get_due_accounts(gmail_accounts)],
+            [backfilling, unsynced, stale],
+        )
+        # no sync log came out of the last poll, e.g. the account has no enabled label
+        self.assertEqual(
+            [x.linked_user for x in get_due_accounts(gmail_accounts)],
+            [backfilling, stale],
+        )
+        frappe.cache.hset(LAST_POLL_KEY, unsynced, time.time() - MAX_POLL_INTERVAL)
+        self.assertEqual(
+            [x.linked_user for x in get_due_accounts(gmail_accounts)],
+            [backfilling, unsynced, stale],
+        )
+
+    def test_pushed_accounts_are_polled_rarely(self):
+        user = ACCOUNTS[0]
+        now = now_datetime()
+        self.add_sync_log(user, 0, add_to_date(now, seconds=-MAX_POLL_INTERVAL - 60))
+        gmail_account = frappe._dict(
+            linked_user=user,
+            last_historyid=100,
+            watch_expiration=add_to_date(now, days=1),
+        )
+        record_push([user])
+        with override_google_settings({"custom_gmail_sync_in_realtime": 1}):
+            self.assertEqual(get_due_accounts([gmail_account]), [])
+        # without realtime sync the pushes are ignored
+        with override_google_settings({"custom_gmail_sync_in_realtime": 0}):
+            self.assertEqual(get_due_accounts([gmail_account]), [gmail_account])
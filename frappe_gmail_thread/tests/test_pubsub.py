@@ -0,0 +1,29 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from werkzeug.test import EnvironBuilder
+
+from frappe_gmail_thread.api.pubsub import callback
+from frappe_gmail_thread.tests.utils import override_google_settings
+
+
+class TestPubSub(FrappeTestCase):
+    def setUp(self):
+        # a push without a notification is acknowledged before anything is queued
+        request = EnvironBuilder(method="POST", json={}).get_request()
+        self.addCleanup(
+            setattr, frappe.local, "request", getattr(frappe.local, "request", None)
+        )
+        frappe.local.request = request
+
+    def test_pushes_without_the_verification_token_are_rejected(self):
+        with override_google_settings(
+            {"custom_gmail_pubsub_verification_token": "push-secret"}
+        ):
+            for token in (None, "", "wrong-secret"):
+                with self.assertRaises(frappe.PermissionError):
+                    callback(token=token)
+            self.assertEqual(callback(token="push-secret"), "OK")
+
+    def test_pushes_are_accepted_until_a_token_is_set(self):
+        with override_google_settings({"custom_gmail_pubsub_verification_token": ""}):
+            self.assertEqual(callback(), "OK")
@@ -0,0 +1,102 @@
+import json
+import time
+from unittest.mock import patch
+
+import frappe
+import redis
+from frappe.tests.utils import FrappeTestCase
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+from frappe_gmail_thread.utils import rate_limiter
+from frappe_gmail_thread.utils.gmail_request import GmailRequest
+from frappe_gmail_thread.utils.rate_limiter import ACQUIRE_SCRIPT, RateLimiter
+
+MESSAGE_URI = "https://gmail.googleapis.com/gmail/v1/users/me/messages/1"
+
+
+def get_error(status, reason):
+    content = {"error": {"code": status, "message": reason, "errors": []}}
+    if reason:
+        content["error"]["errors"].append({"domain": "usageLimits", "reason": reason})
+    return {"status": str(status)}, json.dumps(content).encode()
+
+
+class TestRateLimiter(FrappeTestCase):
+    def setUp(self):
+        self.limiter = RateLimiter(
+            f"rate-limiter-test-{frappe.generate_hash(length=8)}", "rate-limiter-test"
+        )
+        rate_limiter.fail_open_logged_at.clear()
+
+    def tearDown(self):
+        for key in (
+            self.limiter.account_key,
+            self.limiter.project_key,
+            f"{self.limiter.account_key}|backoff",
+        ):
+            frappe.cache.delete(key)
+
+    def take(self, now, units, rate=10):
+        return float(
+            frappe.cache.eval(
+                ACQUIRE_SCRIPT,
+                2,
+                self.limiter.account_key,
+                self.limiter.project_key,
+                now,
+                units,
+                rate,
+                1000,
+                60,
+            )
+        )
+
+    def test_bucket_allows_a_burst_then_refills(self):
+        # a full bucket holds one second of quota
+        self.assertEqual(self.take(1000, 6), 0)
+        self.assertEqual(self.take(1000, 4), 0)
+        self.assertAlmostEqual(self.take(1000, 5), 0.5)
+        # nothing was taken by the refused request
+        self.assertAlmostEqual(self.take(1000.2, 5), 0.3)
+        self.assertEqual(self.take(1000.5, 5), 0)
+        # refills never go above the rate
+        self.assertEqual(self.take(2000, 10), 0)
+        self.assertAlmostEqual(self.take(2000, 1), 0.1)
+
+    def test_rate_limit_responses_back_off_and_retry(self):
+        for status, reason in ((429, None), (403, "rateLimitExceeded")):
+            with patch.object(rate_limiter, "BACKOFF_BASE", 0.05):
+                request = self.get_request(
+                    get_error(status, reason), ({"status": "200"}, b'{"id": "1"}')
+                )
+                start = time.monotonic()
+                self.assertEqual(request.execute(), {"id": "1"})
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+            # the next rate limit response starts from the shortest delay again
+            self.assertFalse(frappe.cache.get(f"{self.limiter.account_key}|backoff"))
+
+        request = self.get_request(get_error(403, "insufficientPermissions"))
+        with self.assertRaises(HttpError):
+            request.execute()
+        self.assertFalse(frappe.cache.get(f"{self.limiter.account_key}|backoff"))
+
+    def test_limits_fail_open_when_redis_fails(self):
+        logger = frappe.logger("frappe_gmail_thread")
+        with patch.object(
+            frappe.cache, "eval", side_effect=redis.exceptions.ConnectionError
+        ):
+            with self.assertLogs(logger, "WARNING"):
+                self.limiter.acquire(5)
+            # once per interval
+            with self.assertNoLogs(logger, "WARNING"):
+                self.limiter.acquire(5)
+
+    def get_request(self, *responses):
+        return GmailRequest(
+            HttpMockSequence(list(responses)),
+            lambda resp, content: json.loads(content),
+            MESSAGE_URI,
+            methodId="gmail.users.messages.get",
+            limiter=self.limiter,
+        )
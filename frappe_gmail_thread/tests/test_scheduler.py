@@ -0,0 +1,126 @@
+import time
+from unittest.mock import patch
+
+import frappe
+import redis
+
+from frappe_gmail_thread.tests.utils import FakeGmailTestCase, override_conf
+from frappe_gmail_thread.utils import rate_limiter
+from frappe_gmail_thread.utils.scheduler import (
+    PENDING_HISTORY_KEY,
+    PENDING_KEY,
+    dispatch_pending_history,
+    dispatch_pending_syncs,
+    get_synced_history_id,
+    mark_pending,
+    record_pending_history_id,
+    sync_slot,
+)
+from frappe_gmail_thread.utils.sync_engine import sync
+
+SLOT_USERS = ["slot-test-0@example.com", "slot-test-1@example.com"]
+
+
+class TestScheduler(FakeGmailTestCase):
+    def tearDown(self):
+        frappe.cache.delete(frappe.cache.make_key(PENDING_HISTORY_KEY))
+        frappe.cache.delete(frappe.cache.make_key(PENDING_KEY))
+        frappe.cache.delete(frappe.cache.make_key("gmail_thread_sync_slots"))
+        for user in SLOT_USERS:
+            frappe.cache.delete(
+                frappe.cache.make_key(f"gmail_thread_sync_slots|{user}")
+            )
+        super().tearDown()
+
+    def test_notifications_missed_by_a_running_sync_are_dispatched(self):
+        with self.fake_gmail(threads_per_account=2) as gmail:
+            user = gmail.user
+            sync(user=user)
+            synced_history_id = get_synced_history_id(user)
+            self.assertTrue(synced_history_id)
+            key = frappe.cache.make_key(PENDING_HISTORY_KEY)
+
+            # received once the job had looked for notifications for the last time
+            record_pending_history_id(user, synced_history_id + 1)
+            with patch(
+                "frappe_gmail_thread.utils.scheduler.enqueue_sync"
+            ) as enqueue_sync:
+                dispatch_pending_history()
+            enqueue_sync.assert_called_once_with(user)
+            self.assertIsNotNone(frappe.cache.zscore(key, user))
+
+            frappe.cache.zrem(key, user)
+            record_pending_history_id(user, synced_history_id)
+            with patch(
+                "frappe_gmail_thread.utils.scheduler.enqueue_sync"
+            ) as enqueue_sync:
+                dispatch_pending_history()
+            enqueue_sync.assert_not_called()
+            self.assertIsNone(frappe.cache.zscore(key, user))
+
+    def test_pending_syncs_wait_for_the_running_job(self):
+        with self.fake_gmail(threads_per_account=1) as gmail:
+            user = gmail.user
+            key = frappe.cache.make_key(PENDING_KEY)
+            mark_pending(user)
+            # disabled or deleted accounts are dropped
+            mark_pending(SLOT_USERS[0])
+
+            # a job of the account is still queued or running
+            with patch(
+                "frappe_gmail_thread.utils.scheduler.enqueue_sync", return_value=False
+            ):
+                dispatch_pending_syncs()
+            self.assertIsNotNone(frappe.cache.zscore(key, user))
+            self.assertIsNone(frappe.cache.zscore(key, SLOT_USERS[0]))
+
+            with patch(
+                "frappe_gmail_thread.utils.scheduler.enqueue_sync", return_value=True
+            ) as enqueue_sync:
+                dispatch_pending_syncs()
+            enqueue_sync.assert_called_once_with(user, backfill=True)
+            self.assertIsNone(frappe.cache.zscore(key, user))
+
+    def test_sync_slots_are_limited_and_released(self):
+        first, second = SLOT_USERS
+        site_key = frappe.cache.make_key("gmail_thread_sync_slots")
+        with override_conf({"gmail_thread_max_concurrent_syncs": 1}):
+            with sync_slot(first) as acquired:
+                self.assertTrue(acquired)
+                with sync_slot(second) as acquired:
+                    self.assertFalse(acquired)
+                # a mailbox is synced by one job at a time
+                with (
+                    override_conf({"gmail_thread_max_concurrent_syncs": 2}),
+                    sync_slot(first, older=True) as acquired,
+                ):
+                    self.assertFalse(acquired)
+            self.assertFalse(frappe.cache.zrange(site_key, 0, -1))
+            with sync_slot(second) as acquired:
+                self.assertTrue(acquired)
+
+    def test_stale_sync_slots_expire(self):
+        first, second = SLOT_USERS
+        site_key = frappe.cache.make_key("gmail_thread_sync_slots")
+        # left behind by a job killed before it released its slot
+        frappe.cache.zadd(site_key, {f"{frappe.local.site}::{first}": time.time() - 1})
+        with (
+            override_conf({"gmail_thread_max_concurrent_syncs": 1}),
+            sync_slot(second) as acquired,
+        ):
+            self.assertTrue(acquired)
+            self.assertEqual(
+                [frappe.safe_decode(x) for x in frappe.cache.zrange(site_key, 0, -1)],
+                [f"{frappe.local.site}::{second}"],
+            )
+
+    def test_sync_slots_fail_open_when_redis_fails(self):
+        rate_limiter.fail_open_logged_at.clear()
+        with (
+            patch.object(
+                frappe.cache, "eval", side_effect=redis.exceptions.ConnectionError
+            ),
+            self.assertLogs(frappe.logger("frappe_gmail_thread"), "WARNING"),
+            sync_slot(SLOT_USERS[0]) as acquired,
+        ):
+            self.assertTrue(acquired)
@@ -0,0 +1,59 @@
+import threading
+
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_gmail_thread.benchmark.fake_gmail import API_PREFIX, FakeGmail
+from frappe_gmail_thread.benchmark.mailbox import generate_mailboxes
+from frappe_gmail_thread.tests.utils import override_conf
+from frappe_gmail_thread.utils import transport
+
+ACCOUNT = "transport-test@example.com"
+
+
+class TestTransport(FrappeTestCase):
+    def fake_gmail(self):
+        return FakeGmail(generate_mailboxes([ACCOUNT], threads_per_account=1).accounts)
+
+    def test_token_requests_reuse_their_connection(self):
+        with self.fake_gmail() as fake:
+            fake.reset_stats()
+            for _ in range(3):
+                response = transport.post(
+                    fake.oauth_url, data={"refresh_token": ACCOUNT}
+                )
+                self.assertEqual(response.json()["access_token"], ACCOUNT)
+            stats = fake.stats()
+        self.assertEqual(stats["calls"]["token"], 3)
+        self.assertEqual(stats["connections"], 1)
+
+    def test_gmail_requests_reuse_the_connection_of_their_thread(self):
+        with self.fake_gmail() as fake:
+            fake.reset_stats()
+            http = transport.get_http()
+            self.assertIs(transport.get_http(), http)
+            for _ in range(3):
+                response, _content = http.request(
+                    f"{fake.url.rstrip('/')}{API_PREFIX}profile",
+                    headers={"Authorization": f"Bearer {ACCOUNT}"},
+                )
+                self.assertEqual(response.status, 200)
+            self.assertEqual(fake.stats()["connections"], 1)
+
+        # httplib2 is not thread safe, other threads get their own
+        others = []
+        thread = threading.Thread(target=lambda: others.append(transport.get_http()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], http)
+
+    def test_clients_are_not_shared_with_forked_processes(self):
+        session = transport.get_session()
+        self.assertIs(transport.get_session(), session)
+        # the clients built with the overridden timeout are dropped after the test
+        self.addCleanup(setattr, transport._local, "pid", None)
+        with override_conf({"gmail_thread_http_timeout": 5}):
+            # as seen from a forked job process
+            transport._session_pid = -1
+            transport._local.pid = -1
+            self.assertIsNot(transport.get_session(), session)
+            self.assertEqual(transport.get_http().timeout, 5)
@@ -0,0 +1,117 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from frappe_gmail_thread.tasks.watch import (
+    MAX_RENEWALS_PER_RUN,
+    renew_expiring_watches,
+    renew_watch,
+)
+from frappe_gmail_thread.tests.utils import FakeGmailTestCase, override_google_settings
+
+REALTIME_SETTINGS = {
+    "custom_gmail_sync_in_realtime": 1,
+    "custom_gmail_pubsub_topic": "projects/test/topics/gmail",
+}
+
+
+class TestWatch(FakeGmailTestCase):
+    def add_gmail_account(self, user, watch_expiration=None):
+        frappe.get_doc(
+            {
+                "doctype": "Gmail Account",
+                "name": user,
+                "linked_user": user,
+                "gmail_enabled": 1,
+                "refresh_token": "revoked",
+                "watch_expiration": watch_expiration,
+            }
+        ).db_insert()
+        self.addCleanup(frappe.db.delete, "Gmail Account", {"name": user})
+
+    def get_renewed_users(self):
+        with (
+            override_google_settings({"enable": 1, **REALTIME_SETTINGS}),
+            patch(
+                "frappe_gmail_thread.tasks.watch.is_job_enqueued", return_value=False
+            ),
+            patch("frappe.enqueue") as enqueue,
+        ):
+            renew_expiring_watches()
+        return [x.kwargs["user"] for x in enqueue.call_args_list]
+
+    def test_failing_renewals_do_not_crowd_out_expiring_watches(self):
+        failing = [
+            f"watch-test-{i:02d}@example.com" for i in range(MAX_RENEWALS_PER_RUN + 1)
+        ]
+        for user in failing:
+            self.add_gmail_account(user)
+        expiring = "watch-test-expiring@example.com"
+        self.add_gmail_account(expiring, add_to_date(now_datetime(), hours=2))
+
+        renewed = self.get_renewed_users()
+        self.assertEqual(renewed[0], expiring)
+        self.assertEqual(len(renewed), MAX_RENEWALS_PER_RUN)
+
+        # their renewal failed, the next runs leave them out until the retry interval is over
+        frappe.db.set_value(
+            "Gmail Account",
+            {"name": ["in", renewed[1:]]},
+            "watch_renewal_failed_at",
+            now_datetime(),
+        )
+        retried = self.get_renewed_users()
+        self.assertEqual(retried[0], expiring)
+        self.assertEqual(set(retried[1:]), set(failing) - set(renewed))
+        frappe.db.set_value(
+            "Gmail Account",
+            {"name": ["in", failing]},
+            "watch_renewal_failed_at",
+            now_datetime(),
+        )
+        self.assertEqual(self.get_renewed_users(), [expiring])
+
+    def test_renew_watch(self):
+        with self.fake_gmail(
+            threads_per_account=1, settings=REALTIME_SETTINGS
+        ) as gmail:
+            user = gmail.user
+            frappe.db.set_value("Gmail Account", user, "watch_expiration", None)
+            gmail.fake.reset_stats()
+            renew_watch(user)
+            self.assertTrue(
+                frappe.db.get_value("Gmail Account", user, "watch_expiration")
+            )
+            self.assertEqual(gmail.fake.stats()["calls"].get("watch"), 1)
+
+    def test_revoked_authorization_is_logged(self):
+        with self.fake_gmail(
+            threads_per_account=1, settings=REALTIME_SETTINGS
+        ) as gmail:
+            user = gmail.user
+            frappe.db.set_value("Gmail Account", user, "watch_expiration", None)
+            errors = frappe.db.count("Error Log", {"method": "PubSub Error"})
+            # the fake OAuth endpoint answers invalid_grant for unknown refresh tokens
+            gmail.fake.accounts = {}
+            renew_watch(user)
+            self.assertFalse(
+                frappe.db.get_value("Gmail Account", user, "watch_expiration")
+            )
+            self.assertTrue(
+                frappe.db.get_value("Gmail Account", user, "watch_renewal_failed_at")
+            )
+            self.assertEqual(
+                frappe.db.count("Error Log", {"method": "PubSub Error"}), errors + 1
+            )
+
+    def test_unexpected_errors_propagate(self):
+        with (
+            self.fake_gmail(threads_per_account=1, settings=REALTIME_SETTINGS) as gmail,
+            patch(
+                "frappe_gmail_thread.tasks.watch.enable_pubsub",
+                side_effect=KeyError("expiration"),
+            ),
+            self.assertRaises(KeyError),
+        ):
+            renew_watch(gmail.user)
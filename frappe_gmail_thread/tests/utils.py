@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_gmail_thread.benchmark.fake_gmail import FakeGmail
+from frappe_gmail_thread.benchmark.mailbox import MailboxGenerator, generate_mailboxes
+from frappe_gmail_thread.benchmark.sync_benchmark import (
+    benchmark_site,
+    cleanup_accounts,
+    setup_account,
+)
+
+ACCOUNTS = ["gmail-test-0@example.com", "gmail-test-1@example.com"]
+
+
+@dataclass
+class FakeMailboxes:
+    generator: MailboxGenerator
+    fake: FakeGmail
+    users: list
+
+    @property
+    def user(self):
+        return self.users[0]
+
+    @property
+    def mailbox(self):
+        return self.generator.accounts[self.users[0]]
+
+
+class FakeGmailTestCase(FrappeTestCase):
+    """
+    Syncs synthetic mailboxes served by the fake Gmail API of the benchmark, the test
+    accounts and their threads are deleted after each test.
+    """
+
+    def tearDown(self):
+        cleanup_accounts(ACCOUNTS)
+
+    @contextmanager
+    def fake_gmail(
+        self, accounts=1, label_ids=None, conf=None, settings=None, **kwargs
+    ):
+        """
+        Serve mailboxes generated with `kwargs` for the first `accounts` test accounts and
+        authorize a Gmail Account syncing `label_ids` for each. `conf` overrides the site
+        config and `settings` Google Settings for the duration of the block.
+        """
+        kwargs.setdefault("cross_account_duplicates", 0)
+        generator = generate_mailboxes(ACCOUNTS[:accounts], **kwargs)
+        with (
+            override_conf(conf or {}),
+            override_google_settings(settings or {}),
+            FakeGmail(generator.accounts) as fake,
+            benchmark_site(fake),
+        ):
+            users = [setup_account(email, label_ids) for email in ACCOUNTS[:accounts]]
+            yield FakeMailboxes(generator, fake, users)
+
+
+@contextmanager
+def override_conf(values):
+    conf = frappe.local.conf
+    previous = {key: conf.get(key) for key in values}
+    conf.update(values)
+    try:
+        yield
+    finally:
+        conf.update(previous)
+
+
+@contextmanager
+def override_google_settings(values):
+    previous = {
+        key: frappe.db.get_single_value("Google Settings", key) for key in values
+    }
+    for key, value in values.items():
+        frappe.db.set_single_value("Google Settings", key, value)
+    frappe.clear_document_cache("Google Settings", "Google Settings")
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            frappe.db.set_single_value("Google Settings", key, value)
+        frappe.clear_document_cache("Google Settings", "Google Settings")
+
+
+def count_emails(gmail_account):
+    return frappe.db.count("Single Email CT", {"gmail_account": gmail_account})
+
+
+def get_gmail_thread_ids(gmail_account):
+    return frappe.get_all(
+        "Gmail Thread",
+        filters={"gmail_account": gmail_account},
+        pluck="gmail_thread_id",
+    )
@@ -0,0 +1,92 @@
+import time
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+PROGRESS_EVENT = "gmail_thread_backfill_progress"
+# seconds between two realtime updates of the Gmail Account form
+PUBLISH_INTERVAL = 2
+# seconds between two writes of the progress to the Gmail Account
+PERSIST_INTERVAL = 30
+
+
+class BackfillProgress:
+    """
+    Progress of the backfills of a mailbox during a `sync()` run, counted in threads listed
+    against the totals Gmail reported when each label started its backfill.
+
+    Updates are published to the Gmail Account form every `PUBLISH_INTERVAL` seconds and
+    stored on the account every `PERSIST_INTERVAL` seconds, so a stuck backfill can be told
+    from a slow one after the job is gone.
+    """
+
+    def __init__(self, gmail_account, labels):
+        self.gmail_account = gmail_account
+        self.labels = labels
+        self.start = time.monotonic()
+        self.start_threads = self.get_counts()["backfilled_threads"]
+        self.published_at = 0
+        self.persisted_at = 0
+
+    def get_counts(self):
+        counts = {
+            "backfilled_threads": 0,
+            "backfill_threads_total": 0,
+            "backfilled_messages": 0,
+            "backfill_messages_total": 0,
+        }
+        for label in self.labels:
+            threads = label.backfill_threads or 0
+            messages = label.backfill_messages or 0
+            if label.last_historyid and not label.backfill_page_token:
+                # finished, Gmail's totals are estimates and ignore the backfill limits
+                threads_total, messages_total = threads, messages
+            else:
+                threads_total = max(label.backfill_threads_total or 0, threads)
+                messages_total = max(label.backfill_messages_total or 0, messages)
+            counts["backfilled_threads"] += threads
+            counts["backfill_threads_total"] += threads_total
+            counts["backfilled_messages"] += messages
+            counts["backfill_messages_total"] += messages_total
+        return counts
+
+    def get_progress(self):
+        progress = self.get_counts()
+        threads, total = (
+            progress["backfilled_threads"],
+            progress["backfill_threads_total"],
+        )
+        progress["backfill_progress"] = threads * 100 / total if total else 100
+        elapsed = time.monotonic() - self.start
+        # threads per minute of this run, earlier slices may have run on another worker
+        rate = (threads - self.start_threads) * 60 / elapsed if elapsed else 0
+        progress["backfill_rate"] = rate
+        progress["backfill_eta"] = (
+            add_to_date(now_datetime(), minutes=(total - threads) / rate)
+            if rate
+            else None
+        )
+        progress["backfill_updated_on"] = now_datetime()
+        return progress
+
+    def update(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.published_at < PUBLISH_INTERVAL:
+            return
+        self.published_at = now
+        progress = self.get_progress()
+        frappe.publish_realtime(
+            PROGRESS_EVENT,
+            progress,
+            doctype="Gmail Account",
+            docname=self.gmail_account.name,
+        )
+        if force or now - self.persisted_at >= PERSIST_INTERVAL:
+            self.persisted_at = now
+            frappe.db.set_value(
+                "Gmail Account",
+                self.gmail_account.name,
+                progress,
+                update_modified=False,
+            )
+            frappe.db.commit()  # nosemgrep
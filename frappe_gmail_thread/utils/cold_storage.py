@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+
+import frappe
+
+ARCHIVE_FOLDER = "gmail_thread_archive"
+ARCHIVE_BATCH_SIZE = 500
+
+
+def get_archive_root():
+    # under private/files, so `bench backup --with-files` keeps the archived bodies, the files
+    # have no File document and cannot be downloaded
+    return frappe.get_site_path("private", "files", ARCHIVE_FOLDER)
+
+
+def get_archive_relative_path(email_name):
+    # shard by the first characters of the email's name to keep directories small
+    return os.path.join(email_name[:2] or "_", f"{email_name}.json.gz")
+
+
+def write_archive(email_name, content, plain_content):
+    relative_path = get_archive_relative_path(email_name)
+    path = os.path.join(get_archive_root(), relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = json.dumps(
+        {"content": content or "", "plain_content": plain_content or ""}
+    ).encode("utf-8")
+    # write to a temporary file first, so a crash never leaves a truncated archive behind
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return relative_path
+
+
+def read_archive(relative_path):
+    path = os.path.join(get_archive_root(), relative_path)
+    with gzip.open(path, "rb") as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def delete_archive(relative_path):
+    if not relative_path:
+        return
+    path = os.path.join(get_archive_root(), relative_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def load_email_body(email):
+    """
+    Restore `content` and `plain_content` of an archived `Single Email CT` row in place.
+    """
+    if not email.get("body_archived") or not email.get("body_archive_path"):
+        return email
+    try:
+        body = read_archive(email.body_archive_path)
+    except (OSError, ValueError):
+        frappe.log_error(
+            frappe.get_traceback(), "Gmail Thread Archive Read Error: " + email.name
+        )
+        return email
+    email.content = body.get("content")
+    email.plain_content = body.get("plain_content")
+    return email
+
+
+def archive_email(email):
+    relative_path = write_archive(email.name, email.content, email.plain_content)
+    frappe.db.set_value(
+        "Single Email CT",
+        email.name,
+        {
+            "content": "",
+            "plain_content": "",
+            "body_archived": 1,
+            "body_archive_path": relative_path,
+        },
+        update_modified=False,
+    )
+
+
+def archive_email_bodies_before(cutoff):
+    """
+    Move bodies of emails older than `cutoff` to compressed files, in batches.
+    """
+    archived = 0
+    while True:
+        emails = frappe.get_all(
+            "Single Email CT",
+            filters={"body_archived": 0, "date_and_time": ["<", cutoff]},
+            fields=["name", "content", "plain_content"],
+            order_by="date_and_time asc",
+            limit=ARCHIVE_BATCH_SIZE,
+        )
+        if not emails:
+            break
+        for email in emails:
+            archive_email(email)
+        frappe.db.commit()  # nosemgrep
+        archived += len(emails)
+        if len(emails) < ARCHIVE_BATCH_SIZE:
+            break
+    return archived
@@ -0,0 +1,62 @@
+from contextlib import nullcontext
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from frappe_gmail_thread.utils.rate_limiter import get_quota_units, is_rate_limit_error
+
+MAX_RATE_LIMIT_RETRIES = 6
+
+
+def get_error_reasons(error):
+    if not isinstance(error.error_details, list):
+        return []
+    return [x.get("reason") for x in error.error_details if isinstance(x, dict)]
+
+
+class GmailRequest(HttpRequest):
+    """
+    HttpRequest that reports API calls, bytes and HTTP time of a sync to its `SyncStats`,
+    and takes the quota units of every call from its `RateLimiter`.
+    """
+
+    def __init__(self, *args, stats=None, limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.limiter = limiter
+        if stats:
+            postproc = self.postproc
+
+            def record_postproc(resp, content):
+                stats.record_api_call(len(content or b""))
+                return postproc(resp, content)
+
+            # postproc is also called for every response of a batch request
+            self.postproc = record_postproc
+
+    def execute(self, http=None, num_retries=0):
+        retries = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire(get_quota_units(self.methodId))
+            try:
+                with self.stats.timer("http") if self.stats else nullcontext():
+                    response = super().execute(http=http, num_retries=num_retries)
+            except HttpError as e:
+                reasons = get_error_reasons(e)
+                if self.stats:
+                    self.stats.record_api_call(len(e.content or b""))
+                    self.stats.record_api_error(reasons or [str(e.status_code)])
+                if (
+                    self.limiter
+                    and retries < MAX_RATE_LIMIT_RETRIES
+                    and is_rate_limit_error(e, reasons)
+                ):
+                    # the next acquire() waits until the backoff is over
+                    self.limiter.backoff()
+                    retries += 1
+                    continue
+                raise
+            if retries:
+                self.limiter.reset_backoff()
+            return response
@@ -1,12 +1,26 @@
 import base64
 import json
+import os
 import re
+import time
+from dataclasses import dataclass, field
 from uuid import uuid4
 
 import frappe
+import frappe.share
 from bs4 import BeautifulSoup
 from frappe.email.receive import Email, MaxFileSizeReachedError
-from frappe.utils import extract_email_id, sanitize_html
+from frappe.utils import (
+    cint,
+    extract_email_id,
+    get_datetime,
+    get_string_between,
+    sanitize_html,
+)
+
+SNIPPET_LENGTH = 200
+# length of the indexed `email_message_id` column of Single Email CT
+MESSAGE_ID_LENGTH = 255
 
 
 class GmailInboundMail(Email):
@@ -18,17 +32,6 @@ class GmailInboundMail(Email):
         self.set_content_and_type()
         self.set_to_and_cc()
 
-    def replace_inline_images(self, attachments):
-        # replace inline images
-        content = self.content
-        for file in json.loads(attachments):
-            file = frappe.get_doc("File", file["file_doc_name"])
-            if self.cid_map.get(file.name):
-                content = content.replace(
-                    f"cid:{self.cid_map[file.name]}", file.unique_url
-                )
-        return content
-
     def remove_quoted_replies(self, content, type):
         if type == "text":
             regex = r"(\n|^)(On(.|\n)*?wrote:)((.|\n)*)"
@@ -57,11 +60,99 @@ class GmailInboundMail(Email):
         return []
 
 
+@dataclass
+class ParsedMessage:
+    """
+    What storing a message needs from its MIME source, small and picklable so that it can be
+    parsed in another process. Attachments hold either their content (`fcontent`) or the path
+    of a spool file (`fpath`).
+    """
+
+    message_id: str
+    subject: str
+    from_email: str
+    from_real_name: str
+    to: list
+    cc: list
+    bcc: list
+    references: list
+    date: str
+    content: str
+    plain_content: str
+    attachments: list = field(default_factory=list)
+    cid_map: dict = field(default_factory=dict)
+    parse_time: float = 0.0
+
+    @classmethod
+    def from_mail(cls, mail, spool_dir=None):
+        references = mail.mail.get("References")
+        attachments = []
+        for attachment in mail.attachments:
+            attachment = dict(attachment)
+            if spool_dir:
+                # keep large payloads out of the pickle sent back to the parent process
+                attachment["fpath"] = os.path.join(spool_dir, uuid4().hex)
+                with open(attachment["fpath"], "wb") as f:
+                    f.write(attachment.pop("fcontent") or b"")
+            attachments.append(attachment)
+        return cls(
+            message_id=(mail.message_id or "")[:MESSAGE_ID_LENGTH],
+            subject=mail.subject,
+            from_email=mail.from_email,
+            from_real_name=mail.from_real_name,
+            to=mail.to,
+            cc=mail.cc,
+            bcc=mail.bcc,
+            references=[
+                get_string_between("<", x, ">")[:MESSAGE_ID_LENGTH]
+                for x in references.split()
+            ]
+            if references
+            else [],
+            date=mail.date,
+            content=mail.content,
+            plain_content=mail.text_content.strip() or html_to_text(mail.html_content),
+            attachments=attachments,
+            cid_map=mail.cid_map,
+        )
+
+    def replace_inline_images(self, attachments):
+        # replace inline images
+        content = self.content
+        for file in json.loads(attachments):
+            file = frappe.get_doc("File", file["file_doc_name"])
+            if self.cid_map.get(file.name):
+                content = content.replace(
+                    f"cid:{self.cid_map[file.name]}", file.unique_url
+                )
+        return content
+
+
 def html_to_text(html):
     soup = BeautifulSoup(html, "html.parser")
     return soup.get_text(separator=" ", strip=True)
 
 
+def get_snippet(text):
+    return " ".join((text or "").split())[:SNIPPET_LENGTH]
+
+
+def update_thread_summary(gmail_thread, new_email):
+    """
+    Incrementally update the denormalized summary columns of a thread with a newly added email.
+    """
+    if not gmail_thread.last_email_at or get_datetime(
+        new_email.date_and_time
+    ) >= get_datetime(gmail_thread.last_email_at):
+        gmail_thread.last_email_at = new_email.date_and_time
+        gmail_thread.last_sender = new_email.sender
+        gmail_thread.snippet = get_snippet(new_email.plain_content)
+    gmail_thread.email_count = cint(gmail_thread.email_count) + 1
+    gmail_thread.attachment_count = cint(gmail_thread.attachment_count) + len(
+        json.loads(new_email.attachments_data or "[]")
+    )
+
+
 def find_gmail_thread(thread_id, message_ids: list = None):
     try:
         gmail_thread = frappe.get_doc("Gmail Thread", {"gmail_thread_id": thread_id})
@@ -69,17 +160,12 @@ def find_gmail_thread(thread_id, message_ids: list = None):
         gmail_thread = None
         if message_ids:
             for message_id in message_ids:
-                try:
-                    single_email_ct = frappe.get_doc(
-                        "Single Email CT", {"email_message_id": message_id}
-                    )
-                    if single_email_ct:
-                        gmail_thread = frappe.get_doc(
-                            "Gmail Thread", single_email_ct.parent
-                        )
-                        break
-                except frappe.DoesNotExistError:
-                    pass
+                parent = frappe.db.get_value(
+                    "Single Email CT", {"email_message_id": message_id}, "parent"
+                )
+                if parent:
+                    gmail_thread = frappe.get_doc("Gmail Thread", parent)
+                    break
     return gmail_thread
 
 
@@ -87,12 +173,43 @@ class AlreadyExistsError(Exception):
     pass
 
 
-def create_new_email(email, gmail_account):
+def parse_email(email, spool_dir=None):
+    """
+    Parse a message in Gmail's raw format into a `ParsedMessage`. CPU bound and free of DB
+    writes, so it can run outside of the thread, or process, that stores the email.
+    """
+    start = time.perf_counter()
     # decode raw email with errors='replace' to avoid UnicodeDecodeError
     email_content = base64.urlsafe_b64decode(email["raw"].encode("ASCII")).decode(
         "utf-8", errors="replace"
     )
-    email_object = GmailInboundMail(content=email_content)
+    email_object = ParsedMessage.from_mail(
+        GmailInboundMail(content=email_content), spool_dir
+    )
+    email_object.parse_time = time.perf_counter() - start
+    return email_object
+
+
+def parse_message(email, spool_dir=None):
+    """
+    Parse stage of the sync pipeline, drafts are never stored.
+    """
+    if "DRAFT" in email.get("labelIds", []):
+        return None
+    return parse_email(email, spool_dir)
+
+
+def create_new_email(email, gmail_account, email_object=None):
+    if not email_object:
+        email_object = parse_email(email)
+    if email_object.message_id:
+        gmail_thread = frappe.db.get_value(
+            "Single Email CT", {"email_message_id": email_object.message_id}, "parent"
+        )
+        if gmail_thread:
+            # stored through another account already, only link this one to its thread
+            add_involved_user(gmail_thread, gmail_account.linked_user)
+            raise AlreadyExistsError
     # check if email is sent or received
     is_sent = False
     # check if there is a user (not website user) with the same email as the sender in frappe, if yes, then it is a sent email
@@ -105,27 +222,6 @@ def create_new_email(email, gmail_account):
         or False
     )
 
-    try:
-        email_ct = frappe.get_doc(
-            "Single Email CT", {"email_message_id": email_object.message_id}
-        )
-        if email_ct:
-            gmail_thread = frappe.get_doc("Gmail Thread", email_ct.parent)
-            involved_users_linked = [
-                user.account for user in gmail_thread.involved_users
-            ]
-
-            if gmail_account.linked_user not in involved_users_linked:
-                involved_user = frappe.get_doc(
-                    doctype="Involved User", account=gmail_account.linked_user
-                )
-                gmail_thread.append("involved_users", involved_user)
-                gmail_thread.save(ignore_permissions=True)
-
-            raise AlreadyExistsError
-    except frappe.DoesNotExistError:
-        pass
-
     def safe_str(val):
         if val is None:
             return ""
@@ -143,9 +239,7 @@ def create_new_email(email, gmail_account):
     new_email.cc = safe_str(", ".join(email_object.cc).strip())
     new_email.bcc = safe_str(", ".join(email_object.bcc).strip())
     new_email.content = safe_str(email_object.content)
-    new_email.plain_content = safe_str(
-        email_object.text_content.strip() or html_to_text(email_object.html_content)
-    )
+    new_email.plain_content = safe_str(email_object.plain_content)
     new_email.date_and_time = email_object.date
     new_email.sender_full_name = safe_str(email_object.from_real_name)
     new_email.read_receipt = False
@@ -176,6 +270,40 @@ def create_new_email(email, gmail_account):
     return new_email, email_object
 
 
+def add_involved_user(gmail_thread, user):
+    """
+    Link `user` to a Gmail Thread with a single insert, without loading or saving the thread.
+    Returns False if the user was already involved.
+    """
+    accounts = frappe.get_all(
+        "Involved User",
+        filters={"parent": gmail_thread, "parenttype": "Gmail Thread"},
+        pluck="account",
+    )
+    if user in accounts:
+        return False
+    involved_user = frappe.new_doc("Involved User")
+    involved_user.parent = gmail_thread
+    involved_user.parenttype = "Gmail Thread"
+    involved_user.parentfield = "involved_users"
+    involved_user.idx = len(accounts) + 1
+    involved_user.account = user
+    involved_user.db_insert()
+    # the users involved before already have access to the attachments
+    for attachment in frappe.get_all(
+        "File",
+        filters={
+            "attached_to_doctype": "Gmail Thread",
+            "attached_to_name": gmail_thread,
+        },
+        pluck="name",
+    ):
+        frappe.share.add_docshare(
+            "File", attachment, user, flags={"ignore_share_permission": True}
+        )
+    return True
+
+
 def replace_inline_images(new_email, email_object):
     if new_email.attachments_data:
         new_email.content = sanitize_html(
@@ -183,10 +311,18 @@ def replace_inline_images(new_email, email_object):
         )
 
 
-def process_attachments(new_email, gmail_thread, email_object):
+def process_attachments(new_email, gmail_thread, email_object, max_size=None):
+    """
+    Store the attachments of a message as private files of its thread, skipping the ones
+    larger than `max_size` bytes.
+    """
     attachments = []
     for attachment in email_object.attachments:
         try:
+            if max_size and get_attachment_size(attachment) > max_size:
+                discard_attachment(attachment)
+                continue
+            attachment["fcontent"] = get_attachment_content(attachment)
             attachment["mapped_name"] = attachment["fname"]
             if len(attachment["fname"]) >= 140:
                 attachment["mapped_name"] = (
@@ -225,4 +361,27 @@ def process_attachments(new_email, gmail_thread, email_object):
         except frappe.DuplicateEntryError:
             # same file attached twice??
             pass
+        finally:
+            # drop the payload as soon as it is stored
+            attachment.pop("fcontent", None)
     new_email.attachments_data = json.dumps(attachments)
+
+
+def get_attachment_content(attachment):
+    if "fpath" not in attachment:
+        return attachment.get("fcontent")
+    with open(attachment["fpath"], "rb") as f:
+        content = f.read()
+    os.remove(attachment["fpath"])
+    return content
+
+
+def get_attachment_size(attachment):
+    if "fpath" not in attachment:
+        return len(attachment.get("fcontent") or b"")
+    return os.path.getsize(attachment["fpath"])
+
+
+def discard_attachment(attachment):
+    if "fpath" in attachment:
+        os.remove(attachment.pop("fpath"))
@@ -0,0 +1,65 @@
+from zoneinfo import ZoneInfo
+
+import frappe
+import redis
+from frappe.utils import get_datetime, get_system_timezone
+
+COUNTERS_KEY = "gmail_thread_metrics_counters"
+GAUGES_KEY = "gmail_thread_metrics_gauges"
+
+
+def format_series(metric, labels):
+    if not labels:
+        return metric
+    rendered = ",".join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for key, value in sorted(labels.items())
+    )
+    return f"{metric}{{{rendered}}}"
+
+
+def incr(metric, value=1, **labels):
+    """
+    Increment a Prometheus counter shared by all workers. Metrics never break the caller.
+    """
+    if not value:
+        return
+    try:
+        frappe.cache.hincrby(
+            frappe.cache.make_key(COUNTERS_KEY), format_series(metric, labels), value
+        )
+    except redis.exceptions.RedisError:
+        pass
+
+
+def set_gauge(metric, value, **labels):
+    try:
+        frappe.cache.execute_command(
+            "HSET",
+            frappe.cache.make_key(GAUGES_KEY),
+            format_series(metric, labels),
+            value,
+        )
+    except redis.exceptions.RedisError:
+        pass
+
+
+def get_series(key):
+    return {
+        frappe.safe_decode(series): float(value)
+        for series, value in frappe.cache.hscan_iter(frappe.cache.make_key(key))
+    }
+
+
+def to_timestamp(value):
+    # datetimes are stored in the system timezone
+    return (
+        get_datetime(value).replace(tzinfo=ZoneInfo(get_system_timezone())).timestamp()
+    )
+
+
+def record_api_error(account, reason, count=1):
+    incr("gmail_thread_api_errors_total", count, account=account, reason=reason)
@@ -0,0 +1,79 @@
+import frappe
+from frappe.utils import now_datetime, parse_addr
+
+# role of the addresses of each column of Single Email CT
+PARTICIPANT_ROLES = (
+    ("From", "sender"),
+    ("To", "recipients"),
+    ("Cc", "cc"),
+    ("Bcc", "bcc"),
+)
+PARTICIPANT_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "parent",
+    "parenttype",
+    "parentfield",
+    "idx",
+    "email",
+    "address",
+    "domain",
+    "role",
+)
+
+
+def normalize_address(address):
+    address = parse_addr((address or "").strip())[1] or ""
+    return address.strip().lower()
+
+
+def normalize_domain(domain):
+    return (domain or "").strip().lower().lstrip("@")
+
+
+def get_participants(email):
+    """
+    `(address, role)` of every address of a `Single Email CT` row, each role of an address
+    once.
+    """
+    participants = []
+    for role, fieldname in PARTICIPANT_ROLES:
+        for address in (email.get(fieldname) or "").split(","):
+            address = normalize_address(address)
+            if "@" in address and (address, role) not in participants:
+                participants.append((address, role))
+    return participants
+
+
+def add_participants(emails):
+    """
+    Index the addresses of `Single Email CT` rows of threads in `Gmail Thread Participant`,
+    with a single insert for all of them.
+    """
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for email in emails:
+        for idx, (address, role) in enumerate(get_participants(email), 1):
+            values.append(
+                (
+                    frappe.generate_hash(length=10),
+                    now,
+                    now,
+                    user,
+                    user,
+                    email.parent,
+                    "Gmail Thread",
+                    "participants",
+                    idx,
+                    email.name,
+                    address,
+                    address.rpartition("@")[2],
+                    role,
+                )
+            )
+    if values:
+        frappe.db.bulk_insert("Gmail Thread Participant", PARTICIPANT_FIELDS, values)
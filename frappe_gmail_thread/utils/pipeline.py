@@ -0,0 +1,183 @@
+import multiprocessing
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import frappe
+from google_auth_httplib2 import AuthorizedHttp
+
+from frappe_gmail_thread.utils.transport import get_http
+
+FETCH_WORKERS = 8
+PARSE_WORKERS = 4
+# every parse worker may hold a DB connection, whatever the site config asks for
+MAX_PARSE_WORKERS = 8
+BARRIER_TIMEOUT = 60
+
+
+class SyncPipeline:
+    """
+    Overlap Gmail downloads and MIME/HTML parsing of a sync, while the caller writes to the DB.
+
+    Messages are downloaded by a pool of fetch threads, handed to a pool of parse threads and
+    yielded back by `process()` in the order they were given, so messages of a thread are
+    always written oldest first. At most `window` messages are in flight, which bounds memory
+    when the writer is slower than the network. Worker threads get their own Frappe context;
+    only parse workers open a DB connection, when they parse their first message, as Frappe's
+    email parser reads System Settings, e.g. for the time zone of dates. They never write
+    through it. A sync job holds at most `1 + MAX_PARSE_WORKERS` connections, and a site
+    `gmail_thread_max_concurrent_syncs` times that.
+
+    With `processes`, parsing runs in that many worker processes instead of threads, so it is
+    not bound by the GIL. Attachments are then spooled to a temporary directory rather than
+    pickled back to the writer.
+    """
+
+    def __init__(self, gmail, fetch_workers=None, parse_workers=None, processes=0):
+        self.gmail = gmail
+        self.spool_dir = None
+        self.fetch_workers = fetch_workers or frappe.conf.get(
+            "gmail_thread_fetch_workers", FETCH_WORKERS
+        )
+        self.parse_workers = min(
+            parse_workers
+            or frappe.conf.get("gmail_thread_parse_workers", PARSE_WORKERS),
+            MAX_PARSE_WORKERS,
+        )
+        self.processes = min(processes or 0, MAX_PARSE_WORKERS)
+        self.window = 4 * self.fetch_workers
+        self.local = threading.local()
+        self.closed = False
+        site, sites_path = frappe.local.site, frappe.local.sites_path
+        self.fetch_pool = ThreadPoolExecutor(
+            self.fetch_workers,
+            thread_name_prefix="gmail-fetch",
+            initializer=init_worker,
+            initargs=(site, sites_path),
+        )
+        if self.processes:
+            self.spool_dir = tempfile.mkdtemp(prefix="gmail-thread-sync-")
+            # the RQ work-horse has open connections and threads, never fork it
+            self.parse_pool = ProcessPoolExecutor(
+                self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(site, sites_path),
+            )
+        else:
+            self.parse_pool = ThreadPoolExecutor(
+                self.parse_workers,
+                thread_name_prefix="gmail-parse",
+                initializer=init_worker,
+                initargs=(site, sites_path),
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_http(self):
+        # httplib2 is not thread safe, every fetch thread needs its own connections
+        if not hasattr(self.local, "http"):
+            self.local.http = AuthorizedHttp(
+                self.gmail._http.credentials, http=get_http()
+            )
+        return self.local.http
+
+    def map(self, fn, items):
+        """
+        Run `fn(gmail, item, http)` on the fetch pool, results in the order of `items`.
+        """
+        return self.fetch_pool.map(
+            lambda item: fn(self.gmail, item, self.get_http()), items
+        )
+
+    def process(self, messages, fetch, parse):
+        """
+        Yield `(message, raw_email, parsed)` for every message, in order.
+
+        `fetch(gmail, message, http)` runs on the fetch pool and `parse(raw_email, spool_dir)` on
+        the parse pool, parse is skipped when fetch returns None. `parse` must be picklable, i.e. a
+        module level function.
+        """
+        in_flight = deque()
+        for message in messages:
+            if len(in_flight) >= self.window:
+                yield in_flight.popleft().result()
+            in_flight.append(self.submit(message, fetch, parse))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def submit(self, message, fetch, parse):
+        result = Future()
+
+        def on_fetched(future):
+            if future.exception():
+                result.set_exception(future.exception())
+                return
+            raw_email = future.result()
+            if raw_email is None or self.closed:
+                result.set_result((message, raw_email, None))
+                return
+
+            def on_parsed(future):
+                if future.exception():
+                    result.set_exception(future.exception())
+                else:
+                    result.set_result((message, raw_email, future.result()))
+
+            self.parse_pool.submit(
+                run_parse, parse, raw_email, self.spool_dir
+            ).add_done_callback(on_parsed)
+
+        self.fetch_pool.submit(
+            lambda: fetch(self.gmail, message, self.get_http())
+        ).add_done_callback(on_fetched)
+        return result
+
+    def close(self):
+        self.closed = True
+        # fetch workers hand messages over to parse workers, so they stop first
+        close_thread_pool(self.fetch_pool, self.fetch_workers)
+        if self.processes:
+            # worker processes release their Frappe context when they exit
+            self.parse_pool.shutdown(cancel_futures=True)
+        else:
+            close_thread_pool(self.parse_pool, self.parse_workers)
+        if self.spool_dir:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+def close_thread_pool(pool, workers):
+    # one destroy per worker thread, the barrier keeps a thread from taking two
+    barrier = threading.Barrier(workers)
+    wait([pool.submit(destroy_worker, barrier) for _ in range(workers)])
+    pool.shutdown()
+
+
+def init_worker(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+
+
+def run_parse(parse, raw_email, spool_dir):
+    # workers that never parse, e.g. those only started to be torn down, stay unconnected
+    if not getattr(frappe.local, "db", None):
+        frappe.connect()
+    return parse(raw_email, spool_dir)
+
+
+def destroy_worker(barrier):
+    try:
+        barrier.wait(timeout=BARRIER_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+    frappe.destroy()
@@ -0,0 +1,124 @@
+import time
+
+import frappe
+import redis
+from frappe.utils import add_to_date, now_datetime
+
+from frappe_gmail_thread.utils import metrics
+from frappe_gmail_thread.utils.scheduler import is_backfill
+
+LAST_PUSH_KEY = "gmail_thread_last_push"
+LAST_POLL_KEY = "gmail_thread_last_poll"
+# the message rate of an account is measured over this window
+RATE_WINDOW = 24 * 60 * 60
+MIN_POLL_INTERVAL = 5 * 60
+MAX_POLL_INTERVAL = 2 * 60 * 60
+# accounts with working push are only polled as a safety net for lost notifications
+PUSH_POLL_INTERVAL = 12 * 60 * 60
+# push is assumed broken once an account stays silent for this many of its usual message gaps
+PUSH_MISSED_MESSAGES = 3
+MIN_PUSH_SILENCE = 15 * 60
+MAX_PUSH_SILENCE = 24 * 60 * 60
+
+
+def record_push(users):
+    """
+    Remember when Pub/Sub last notified about the mailboxes of `users`.
+    """
+    now = time.time()
+    try:
+        for user in users:
+            frappe.cache.hset(LAST_PUSH_KEY, user, now)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def record_poll(users, now):
+    try:
+        for user in users:
+            frappe.cache.hset(LAST_POLL_KEY, user, now)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def get_last_poll():
+    try:
+        return frappe.cache.hgetall(LAST_POLL_KEY)
+    except redis.exceptions.RedisError:
+        return {}
+
+
+def get_due_accounts(gmail_accounts):
+    """
+    Filter `gmail_accounts` (with `linked_user`, `last_historyid` and `watch_expiration`) down
+    to the ones to poll now.
+
+    Each account is polled about once per message it usually receives, between
+    `MIN_POLL_INTERVAL` and `MAX_POLL_INTERVAL`. Accounts with a live watch whose push
+    notifications are arriving are polled every `PUSH_POLL_INTERVAL` only, accounts still
+    backfilling always. Accounts whose syncs log nothing, as they have no enabled label or
+    keep failing, are polled every `MAX_POLL_INTERVAL`.
+    """
+    now = time.time()
+    activity = {
+        log.gmail_account: log
+        for log in frappe.get_all(
+            "Gmail Sync Log",
+            filters={
+                "creation": [">", add_to_date(now_datetime(), seconds=-RATE_WINDOW)]
+            },
+            fields=[
+                "gmail_account",
+                "sum(messages_fetched) as messages",
+                "max(ended_at) as last_synced_at",
+            ],
+            group_by="gmail_account",
+        )
+    }
+    last_push = get_last_push()
+    last_poll = get_last_poll()
+    due = []
+    for gmail_account in gmail_accounts:
+        user = gmail_account.linked_user
+        log = activity.get(user)
+        if not log:
+            # the last poll of the account did not get as far as a sync log
+            last_poll_at = last_poll.get(user)
+            if not last_poll_at or now - last_poll_at >= MAX_POLL_INTERVAL:
+                due.append(gmail_account)
+            continue
+        if is_backfill(gmail_account.last_historyid):
+            due.append(gmail_account)
+            continue
+        last_push_at = None
+        if gmail_account.watch_expiration and (
+            metrics.to_timestamp(gmail_account.watch_expiration) > now
+        ):
+            last_push_at = last_push.get(user)
+        interval = get_poll_interval(log.messages, last_push_at, now)
+        metrics.set_gauge("gmail_thread_poll_interval_seconds", interval, account=user)
+        if now - metrics.to_timestamp(log.last_synced_at) >= interval:
+            due.append(gmail_account)
+    record_poll([x.linked_user for x in due], now)
+    return due
+
+
+def get_poll_interval(messages, last_push_at, now):
+    message_gap = RATE_WINDOW / messages if messages else MAX_PUSH_SILENCE
+    push_silence = min(
+        max(PUSH_MISSED_MESSAGES * message_gap, MIN_PUSH_SILENCE), MAX_PUSH_SILENCE
+    )
+    if last_push_at and now - last_push_at < push_silence:
+        return PUSH_POLL_INTERVAL
+    return min(max(message_gap, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+
+def get_last_push():
+    if not frappe.db.get_single_value(
+        "Google Settings", "custom_gmail_sync_in_realtime"
+    ):
+        return {}
+    try:
+        return frappe.cache.hgetall(LAST_PUSH_KEY)
+    except redis.exceptions.RedisError:
+        return {}
@@ -0,0 +1,164 @@
+import random
+import time
+
+import frappe
+import redis
+
+# Gmail API quota units per method, see https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "labels.list": 1,
+    "labels.get": 1,
+    "threads.list": 10,
+    "threads.get": 10,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.attachments.get": 5,
+    "history.list": 2,
+    "watch": 100,
+    "stop": 50,
+}
+DEFAULT_QUOTA_UNITS = 5
+# Google allows 250 units/s per user and 1,200,000 units/min per project, keep some headroom.
+# Both are overridable from site config for projects with a raised quota.
+USER_QUOTA_PER_SECOND = 225
+PROJECT_QUOTA_PER_SECOND = 18000
+BACKOFF_BASE = 1
+BACKOFF_MAX = 64
+BUCKET_TTL = 3600
+# seconds between two warnings of a limit that is not enforced, per process
+FAIL_OPEN_LOG_INTERVAL = 300
+
+# Refills every bucket, then takes `cost` units from all of them or from none.
+# Returns the number of seconds to wait before retrying, "0" once the units are taken.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 + i])
+    local bucket = redis.call("HMGET", key, "tokens", "ts", "blocked_until")
+    local available = tonumber(bucket[1]) or rate
+    local ts = tonumber(bucket[2]) or now
+    local blocked_until = tonumber(bucket[3]) or 0
+    available = math.min(rate, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if blocked_until > now then
+        wait = math.max(wait, blocked_until - now)
+    end
+    if available < cost then
+        wait = math.max(wait, (cost - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call("HSET", key, "tokens", tostring(tokens[i] - cost), "ts", tostring(now))
+    redis.call("EXPIRE", key, ARGV[#ARGV])
+end
+return "0"
+"""
+
+
+fail_open_logged_at = {}
+
+
+def log_fail_open(limit, error):
+    """
+    Warn that `limit` let a request through because Redis failed, at most once every
+    `FAIL_OPEN_LOG_INTERVAL` seconds. Logged to a file, fetch workers have no DB connection.
+    """
+    now = time.monotonic()
+    logged_at = fail_open_logged_at.get(limit)
+    if logged_at is not None and now - logged_at < FAIL_OPEN_LOG_INTERVAL:
+        return
+    fail_open_logged_at[limit] = now
+    frappe.logger("frappe_gmail_thread").warning(
+        f"{limit} is not enforced, Redis failed: {error!r}"
+    )
+
+
+def get_quota_units(method_id):
+    return QUOTA_UNITS.get(
+        (method_id or "").removeprefix("gmail.users."), DEFAULT_QUOTA_UNITS
+    )
+
+
+def is_rate_limit_error(error, reasons):
+    if error.status_code == 429:
+        return True
+    return error.status_code == 403 and bool(
+        {"rateLimitExceeded", "userRateLimitExceeded"} & set(reasons)
+    )
+
+
+class RateLimiter:
+    """
+    Token buckets in Redis, counting Gmail quota units of an account and of the Google project.
+
+    Buckets are shared by every worker, so concurrent syncs stay under the quota together. Rate
+    limit responses block the account for an exponentially growing delay.
+    """
+
+    def __init__(self, gmail_account, project):
+        self.account_key = frappe.cache.make_key(f"gmail_thread_quota|{gmail_account}")
+        # not site specific, sites of a bench may share the same Google project
+        self.project_key = f"gmail_thread_quota|project|{project}"
+        self.user_rate = frappe.conf.get(
+            "gmail_thread_user_quota_per_second", USER_QUOTA_PER_SECOND
+        )
+        self.project_rate = frappe.conf.get(
+            "gmail_thread_project_quota_per_second", PROJECT_QUOTA_PER_SECOND
+        )
+
+    def acquire(self, units):
+        """
+        Block until `units` quota units are available to the account and the project.
+        """
+        units = min(units, self.user_rate)
+        while True:
+            try:
+                wait = float(
+                    frappe.cache.eval(
+                        ACQUIRE_SCRIPT,
+                        2,
+                        self.account_key,
+                        self.project_key,
+                        time.time(),
+                        units,
+                        self.user_rate,
+                        self.project_rate,
+                        BUCKET_TTL,
+                    )
+                )
+            except redis.exceptions.RedisError as e:
+                # never stop syncing because the limiter is unavailable
+                log_fail_open("Gmail quota limit", e)
+                return
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def backoff(self):
+        """
+        Block the account after a rate limit response, for longer on every consecutive one.
+        """
+        try:
+            level = frappe.cache.incr(f"{self.account_key}|backoff")
+            frappe.cache.expire(f"{self.account_key}|backoff", BUCKET_TTL)
+            delay = min(BACKOFF_BASE * 2 ** (level - 1), BACKOFF_MAX)
+            delay += random.uniform(0, delay / 2)
+            frappe.cache.execute_command(
+                "HSET", self.account_key, "blocked_until", time.time() + delay
+            )
+        except redis.exceptions.RedisError as e:
+            log_fail_open("Gmail rate limit backoff", e)
+            time.sleep(BACKOFF_BASE)
+
+    def reset_backoff(self):
+        try:
+            frappe.cache.delete(f"{self.account_key}|backoff")
+        except redis.exceptions.RedisError:
+            pass
@@ -0,0 +1,236 @@
+import json
+
+import frappe
+import frappe.share
+
+from frappe_gmail_thread.utils.cold_storage import (
+    archive_email,
+    delete_archive,
+    load_email_body,
+)
+from frappe_gmail_thread.utils.helpers import get_snippet
+
+REMOVAL_BATCH_SIZE = 500
+DEFAULT_POLICY = "Flag"
+
+
+def get_removal_policy():
+    return (
+        frappe.db.get_single_value(
+            "Google Settings", "custom_gmail_removed_mail_policy"
+        )
+        or DEFAULT_POLICY
+    )
+
+
+def remove_emails(gmail_account, gmail_message_ids, policy=None):
+    """
+    Apply the policy of Google Settings to the emails `gmail_account` stored for messages
+    deleted in its Gmail, or removed from every synced label, in batches of
+    `REMOVAL_BATCH_SIZE`:
+
+    - Flag marks them as removed from Gmail.
+    - Archive also moves their body to cold storage and deletes their attachments.
+    - Delete deletes them, and their threads once empty.
+
+    Threads another Gmail Account also synced are left as they are, Delete only drops the
+    account from their involved users once it holds no other email of the thread.
+
+    Returns the number of emails removed.
+    """
+    policy = policy or get_removal_policy()
+    gmail_message_ids = list(gmail_message_ids)
+    removed = 0
+    for start in range(0, len(gmail_message_ids), REMOVAL_BATCH_SIZE):
+        emails = frappe.get_all(
+            "Single Email CT",
+            filters={
+                "gmail_account": gmail_account.name,
+                "gmail_message_id": [
+                    "in",
+                    gmail_message_ids[start : start + REMOVAL_BATCH_SIZE],
+                ],
+                "removed_from_gmail": 0,
+            },
+            fields=[
+                "name",
+                "parent",
+                "content",
+                "plain_content",
+                "attachments_data",
+                "body_archived",
+                "body_archive_path",
+            ],
+        )
+        shared_threads = get_shared_threads(gmail_account, {x.parent for x in emails})
+        if shared_threads:
+            if policy == "Delete":
+                leave_threads(
+                    gmail_account,
+                    shared_threads,
+                    [x.name for x in emails if x.parent in shared_threads],
+                )
+            emails = [x for x in emails if x.parent not in shared_threads]
+        if not emails:
+            frappe.db.commit()  # nosemgrep
+            continue
+        if policy == "Delete":
+            delete_emails(emails)
+        else:
+            if policy == "Archive":
+                for email in emails:
+                    delete_attachments(email)
+                    if not email.body_archived:
+                        archive_email(email)
+                for thread in {x.parent for x in emails}:
+                    refresh_attachment_count(thread)
+            frappe.db.set_value(
+                "Single Email CT",
+                {"name": ["in", [x.name for x in emails]]},
+                "removed_from_gmail",
+                1,
+                update_modified=False,
+            )
+        frappe.db.commit()  # nosemgrep
+        removed += len(emails)
+    return removed
+
+
+def get_shared_threads(gmail_account, threads):
+    """
+    Threads among `threads` the user of another Gmail Account is involved in, their emails
+    can still be in that account's mailbox.
+    """
+    if not threads:
+        return set()
+    return set(
+        frappe.db.sql_list(
+            """
+            select distinct involved_user.parent
+            from `tabInvolved User` involved_user
+            join `tabGmail Account` gmail_account
+                on gmail_account.linked_user = involved_user.account
+            where involved_user.parenttype = 'Gmail Thread'
+                and involved_user.parent in %(threads)s
+                and gmail_account.name != %(gmail_account)s
+            """,
+            {"threads": list(threads), "gmail_account": gmail_account.name},
+        )
+    )
+
+
+def leave_threads(gmail_account, threads, removed_emails):
+    """
+    Drop the user of `gmail_account` from the involved users of shared `threads` where it
+    has no email left besides `removed_emails`, with its access to their attachments.
+    """
+    user = gmail_account.linked_user
+    for thread in threads:
+        if frappe.db.exists(
+            "Single Email CT",
+            {
+                "parent": thread,
+                "parenttype": "Gmail Thread",
+                "gmail_account": gmail_account.name,
+                "removed_from_gmail": 0,
+                "name": ["not in", removed_emails],
+            },
+        ):
+            continue
+        frappe.db.delete(
+            "Involved User",
+            {"parent": thread, "parenttype": "Gmail Thread", "account": user},
+        )
+        for attachment in frappe.get_all(
+            "File",
+            filters={
+                "attached_to_doctype": "Gmail Thread",
+                "attached_to_name": thread,
+            },
+            pluck="name",
+        ):
+            frappe.share.remove(
+                "File", attachment, user, flags={"ignore_share_permission": True}
+            )
+
+
+def delete_emails(emails):
+    for email in emails:
+        delete_attachments(email)
+        delete_archive(email.body_archive_path)
+    names = [x.name for x in emails]
+    frappe.db.delete("Single Email CT", {"name": ["in", names]})
+    frappe.db.delete("Gmail Thread Participant", {"email": ["in", names]})
+    for thread in {x.parent for x in emails}:
+        refresh_thread_summary(thread)
+
+
+def delete_attachments(email):
+    for attachment in json.loads(email.attachments_data or "[]"):
+        if frappe.db.exists("File", attachment.get("file_doc_name")):
+            frappe.delete_doc(
+                "File", attachment["file_doc_name"], ignore_permissions=True
+            )
+    if email.attachments_data and email.attachments_data != "[]":
+        frappe.db.set_value(
+            "Single Email CT",
+            email.name,
+            "attachments_data",
+            "[]",
+            update_modified=False,
+        )
+
+
+def refresh_attachment_count(thread):
+    attachments = frappe.get_all(
+        "Single Email CT",
+        filters={"parent": thread, "parenttype": "Gmail Thread"},
+        pluck="attachments_data",
+    )
+    frappe.db.set_value(
+        "Gmail Thread",
+        thread,
+        "attachment_count",
+        sum(len(json.loads(x or "[]")) for x in attachments),
+        update_modified=False,
+    )
+
+
+def refresh_thread_summary(thread):
+    """
+    Recompute the summary columns of a thread after emails were deleted from it, deleting
+    the thread once it has no emails left.
+    """
+    emails = frappe.get_all(
+        "Single Email CT",
+        filters={"parent": thread, "parenttype": "Gmail Thread"},
+        fields=[
+            "name",
+            "date_and_time",
+            "sender",
+            "plain_content",
+            "attachments_data",
+            "body_archived",
+            "body_archive_path",
+        ],
+        order_by="date_and_time asc, idx asc",
+    )
+    if not emails:
+        frappe.delete_doc("Gmail Thread", thread, ignore_permissions=True, force=True)
+        return
+    # the body of an archived email is only in cold storage
+    last_email = load_email_body(emails[-1])
+    frappe.db.set_value(
+        "Gmail Thread",
+        thread,
+        {
+            "email_count": len(emails),
+            "attachment_count": sum(
+                len(json.loads(x.attachments_data or "[]")) for x in emails
+            ),
+            "last_email_at": last_email.date_and_time,
+            "last_sender": last_email.sender,
+            "snippet": get_snippet(last_email.plain_content),
+        },
+        update_modified=False,
+    )
@@ -0,0 +1,377 @@
+import time
+from contextlib import contextmanager
+
+import frappe
+import redis
+from frappe.utils.background_jobs import is_job_enqueued
+
+from frappe_gmail_thread.utils.rate_limiter import log_fail_open
+
+SYNC_METHOD = "frappe_gmail_thread.utils.scheduler.run_sync"
+BACKFILL_METHOD = "frappe_gmail_thread.utils.scheduler.run_backfill"
+PENDING_KEY = "gmail_thread_sync_pending"
+PENDING_BACKFILL_KEY = "gmail_thread_backfill_pending"
+PENDING_HISTORY_KEY = "gmail_thread_pending_history"
+# syncs started again by a job when notifications arrived while it ran
+MAX_FOLLOW_UP_SYNCS = 3
+# incremental syncs are picked up by workers before anything in the long queue
+INCREMENTAL_QUEUE = "default"
+BACKFILL_QUEUE = "long"
+SYNC_TIMEOUT = 1500
+BACKFILL_SLICE = 300
+# slots of jobs killed without releasing them expire after the job timeout
+SLOT_LEASE = SYNC_TIMEOUT + 60
+MAX_CONCURRENT_SYNCS = 4
+MAX_CONCURRENT_BACKFILLS = 1
+MAX_CONCURRENT_SYNCS_PER_PROJECT = 10
+
+# Takes a slot in every sorted set of KEYS, or in none of them.
+ACQUIRE_SLOTS_SCRIPT = """
+local now = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+    if not redis.call("ZSCORE", key, ARGV[2]) and redis.call("ZCARD", key) >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call("ZADD", key, ARGV[3], ARGV[2])
+    redis.call("EXPIRE", key, math.ceil(tonumber(ARGV[3]) - now))
+end
+return 1
+"""
+
+# Forgets the pending history id of an account if a sync has reached it.
+CLEAR_PENDING_HISTORY_SCRIPT = """
+local pending = redis.call("ZSCORE", KEYS[1], ARGV[1])
+if pending and tonumber(pending) <= tonumber(ARGV[2]) then
+    redis.call("ZREM", KEYS[1], ARGV[1])
+end
+return pending
+"""
+
+
+def get_sync_job_name(user):
+    return f"gmail_thread_sync_{user}"
+
+
+def get_backfill_job_name(user):
+    return f"gmail_thread_backfill_{user}"
+
+
+def is_backfill(last_historyid):
+    return not int(last_historyid or 0)
+
+
+def enqueue_sync(user, backfill=None):
+    """
+    Enqueue a sync of `user`'s mailbox, unless one is already queued or running.
+
+    Incremental syncs go to a queue that workers drain before the one of backfills, so a large
+    import never delays new mail of other users.
+    """
+    job_name = get_sync_job_name(user)
+    if is_job_enqueued(job_name):
+        return False
+    if backfill is None:
+        backfill = is_backfill(
+            frappe.db.get_value(
+                "Gmail Account", {"linked_user": user}, "last_historyid"
+            )
+        )
+    frappe.enqueue(
+        SYNC_METHOD,
+        user=user,
+        queue=BACKFILL_QUEUE if backfill else INCREMENTAL_QUEUE,
+        timeout=SYNC_TIMEOUT,
+        job_name=job_name,
+        job_id=job_name,
+    )
+    return True
+
+
+def enqueue_backfill(user):
+    """
+    Enqueue a slice of the backfill of older threads of `user`'s mailbox, which already
+    receives new mail.
+    """
+    job_name = get_backfill_job_name(user)
+    if is_job_enqueued(job_name):
+        return False
+    frappe.enqueue(
+        BACKFILL_METHOD,
+        user=user,
+        queue=BACKFILL_QUEUE,
+        timeout=SYNC_TIMEOUT,
+        job_name=job_name,
+        job_id=job_name,
+    )
+    return True
+
+
+def run_sync(user):
+    """
+    Background job syncing a mailbox once a slot is free, one time-boxed slice for backfills.
+    Jobs that could not start, or backfills with work left, are picked up again by
+    `dispatch_pending_syncs`.
+    """
+    from frappe_gmail_thread.utils.sync_engine import sync
+
+    backfill = is_backfill(
+        frappe.db.get_value("Gmail Account", {"linked_user": user}, "last_historyid")
+    )
+    with sync_slot(user, backfill) as acquired:
+        if not acquired:
+            mark_pending(user)
+            return
+        for _ in range(MAX_FOLLOW_UP_SYNCS + 1):
+            has_more = sync(user=user, time_limit=BACKFILL_SLICE if backfill else None)
+            # notifications received while syncing were coalesced into this job
+            if has_more or not clear_pending_history_id(
+                user, get_synced_history_id(user)
+            ):
+                break
+        else:
+            has_more = True
+    if has_more:
+        mark_pending(user)
+    elif backfill and has_older_backfill(user):
+        # the most recent threads are in, the older ones follow at a lower priority
+        mark_pending(user, PENDING_BACKFILL_KEY)
+
+
+def run_backfill(user):
+    """
+    Background job storing a time-boxed slice of the older threads of a live mailbox.
+    It gives way to syncs of new mail of the same mailbox.
+    """
+    from frappe_gmail_thread.utils.sync_engine import sync
+
+    with sync_slot(user, backfill=True, older=True) as acquired:
+        has_more = not acquired or sync(
+            user=user, time_limit=BACKFILL_SLICE, older=True
+        )
+    if has_more:
+        mark_pending(user, PENDING_BACKFILL_KEY)
+
+
+def dispatch_pending_syncs():
+    """
+    Enqueue deferred syncs, incremental ones first, then backfills in the order they waited,
+    then backfills of older threads.
+    """
+    dispatch_pending_history()
+
+    key = frappe.cache.make_key(PENDING_KEY)
+    waiting_since = get_pending(key)
+    if waiting_since:
+        accounts = frappe.get_all(
+            "Gmail Account",
+            filters={"linked_user": ["in", list(waiting_since)], "gmail_enabled": 1},
+            fields=["linked_user", "last_historyid"],
+        )
+        accounts.sort(
+            key=lambda x: (is_backfill(x.last_historyid), waiting_since[x.linked_user])
+        )
+        # a job already queued or running may have looked for pending work for the last
+        # time, the account stays pending until a job of its own is enqueued
+        done = set(waiting_since) - {x.linked_user for x in accounts}
+        for account in accounts:
+            if enqueue_sync(
+                account.linked_user, backfill=is_backfill(account.last_historyid)
+            ):
+                done.add(account.linked_user)
+        if done:
+            frappe.cache.zrem(key, *done)
+
+    key = frappe.cache.make_key(PENDING_BACKFILL_KEY)
+    waiting_since = get_pending(key)
+    if waiting_since:
+        users = frappe.get_all(
+            "Gmail Account",
+            filters={"linked_user": ["in", list(waiting_since)], "gmail_enabled": 1},
+            pluck="linked_user",
+        )
+        done = set(waiting_since) - set(users)
+        for user in users:
+            if enqueue_backfill(user):
+                done.add(user)
+        if done:
+            frappe.cache.zrem(key, *done)
+
+
+def dispatch_pending_history():
+    """
+    Enqueue syncs of mailboxes notified of a history id their cursors have not reached, e.g.
+    by a notification received after the running sync last looked for new ones.
+    """
+    key = frappe.cache.make_key(PENDING_HISTORY_KEY)
+    pending = get_pending(key)
+    if not pending:
+        return
+    synced = dict(
+        frappe.get_all(
+            "Gmail Label",
+            filters={
+                "parent": ["in", list(pending)],
+                "parenttype": "Gmail Account",
+                "enabled": 1,
+            },
+            fields=["parent", "max(last_historyid)"],
+            group_by="parent",
+            as_list=True,
+        )
+    )
+    enabled = set(
+        frappe.get_all(
+            "Gmail Account",
+            filters={"linked_user": ["in", list(pending)], "gmail_enabled": 1},
+            pluck="linked_user",
+        )
+    )
+    for user, history_id in pending.items():
+        if user not in enabled:
+            frappe.cache.zrem(key, user)
+        elif history_id > (synced.get(user) or 0):
+            # stays pending until a sync reaches it, a running one dedups this
+            enqueue_sync(user)
+        else:
+            clear_pending_history_id(user, synced.get(user) or 0)
+
+
+def get_pending(key):
+    return {
+        frappe.safe_decode(user): since
+        for user, since in frappe.cache.zrange(key, 0, -1, withscores=True)
+    }
+
+
+def has_pending_sync(user):
+    """
+    Returns True if a sync of `user`'s mailbox is queued, or waiting to be.
+    """
+    return (
+        is_job_enqueued(get_sync_job_name(user))
+        or frappe.cache.zscore(frappe.cache.make_key(PENDING_KEY), user) is not None
+    )
+
+
+def has_older_backfill(user):
+    return frappe.db.exists(
+        "Gmail Label",
+        {
+            "parent": user,
+            "parenttype": "Gmail Account",
+            "enabled": 1,
+            "last_historyid": [">", 0],
+            "backfill_page_token": ["is", "set"],
+        },
+    )
+
+
+def record_pending_history_id(user, history_id):
+    """
+    Remember the highest history id a Pub/Sub notification announced for `user`'s mailbox.
+    """
+    frappe.cache.zadd(
+        frappe.cache.make_key(PENDING_HISTORY_KEY), {user: int(history_id)}, gt=True
+    )
+
+
+def clear_pending_history_id(user, synced_history_id):
+    """
+    Returns True if notifications newer than `synced_history_id` are still pending.
+    """
+    pending = frappe.cache.eval(
+        CLEAR_PENDING_HISTORY_SCRIPT,
+        1,
+        frappe.cache.make_key(PENDING_HISTORY_KEY),
+        user,
+        synced_history_id,
+    )
+    return bool(pending) and int(float(pending)) > synced_history_id
+
+
+def get_synced_history_id(user):
+    return max(
+        frappe.get_all(
+            "Gmail Label",
+            filters={"parent": user, "parenttype": "Gmail Account", "enabled": 1},
+            pluck="last_historyid",
+        ),
+        default=0,
+    )
+
+
+def mark_pending(user, key=PENDING_KEY):
+    frappe.cache.zadd(frappe.cache.make_key(key), {user: time.time()}, nx=True)
+
+
+@contextmanager
+def sync_slot(user, backfill=False, older=False):
+    """
+    Hold a slot of the site and of the Google project for the duration of a sync, yields False
+    if the concurrency limits are reached.
+
+    Backfills are capped below the site limit, so incremental syncs always find a free slot.
+    A mailbox is synced by one job at a time, `older` marks the job backfilling older threads.
+    """
+    conf = frappe.conf
+    member = f"{frappe.local.site}::{user}"
+    if older:
+        member += "::older"
+    slots = [
+        (frappe.cache.make_key(f"gmail_thread_sync_slots|{user}"), 1),
+        (
+            frappe.cache.make_key("gmail_thread_sync_slots"),
+            conf.get("gmail_thread_max_concurrent_syncs", MAX_CONCURRENT_SYNCS),
+        ),
+        (
+            # not site specific, sites of a bench may share the same Google project
+            "gmail_thread_sync_slots|project|{}".format(
+                frappe.db.get_single_value("Google Settings", "client_id")
+            ),
+            conf.get(
+                "gmail_thread_max_concurrent_syncs_per_project",
+                MAX_CONCURRENT_SYNCS_PER_PROJECT,
+            ),
+        ),
+    ]
+    if backfill:
+        slots.append(
+            (
+                frappe.cache.make_key("gmail_thread_backfill_slots"),
+                conf.get(
+                    "gmail_thread_max_concurrent_backfills", MAX_CONCURRENT_BACKFILLS
+                ),
+            )
+        )
+    keys = [key for key, _ in slots]
+    now = time.time()
+    try:
+        acquired = frappe.cache.eval(
+            ACQUIRE_SLOTS_SCRIPT,
+            len(keys),
+            *keys,
+            now,
+            member,
+            now + SLOT_LEASE,
+            *[limit for _, limit in slots],
+        )
+    except redis.exceptions.RedisError as e:
+        # never stop syncing because the limits cannot be checked
+        log_fail_open("Gmail sync concurrency limit", e)
+        acquired = True
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            release_slots(keys, member)
+
+
+def release_slots(keys, member):
+    try:
+        for key in keys:
+            frappe.cache.zrem(key, member)
+    except redis.exceptions.RedisError:
+        pass
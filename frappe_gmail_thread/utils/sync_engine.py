@@ -0,0 +1,825 @@
+"""
+Syncing Gmail mailboxes into Gmail Threads.
+
+Kept apart from the Gmail Thread controller, whose permission hooks run on every web request,
+so the Google API client and the MIME/HTML parsing stack are only imported by sync jobs.
+"""
+
+import time
+
+import frappe
+import googleapiclient.errors
+from frappe import _
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from frappe_gmail_thread.api.oauth import get_gmail_object
+from frappe_gmail_thread.utils import metrics
+from frappe_gmail_thread.utils.backfill_progress import BackfillProgress
+from frappe_gmail_thread.utils.gmail_request import get_error_reasons
+from frappe_gmail_thread.utils.helpers import (
+    AlreadyExistsError,
+    create_new_email,
+    find_gmail_thread,
+    parse_email,
+    parse_message,
+    process_attachments,
+    replace_inline_images,
+    update_thread_summary,
+)
+from frappe_gmail_thread.utils.participants import add_participants
+from frappe_gmail_thread.utils.pipeline import SyncPipeline
+from frappe_gmail_thread.utils.removals import remove_emails
+from frappe_gmail_thread.utils.scheduler import has_pending_sync
+from frappe_gmail_thread.utils.sync_stats import SyncStats
+
+# threads a label stores before it goes live, the older ones are backfilled in the background
+RECENT_BACKFILL_THREADS = 200
+# page size of threads.list when not set, the default of the Gmail API
+THREADS_PAGE_SIZE = 100
+# messages whose size is looked up to estimate the size of a backfill
+ESTIMATE_SAMPLE_MESSAGES = 20
+# threads are only listed for the ids of their messages, the content is downloaded in raw
+THREAD_FORMAT = "minimal"
+THREAD_FIELDS = "messages(id,threadId,historyId,internalDate)"
+# a catch-up also lists messages dated this much before the last one stored, Date headers and
+# the time Gmail received a message can disagree
+CATCH_UP_MARGIN = 24 * 60 * 60
+
+
+def sync_labels(account_name, should_save=True):
+    if isinstance(account_name, str):
+        gmail_account = frappe.get_doc("Gmail Account", account_name)
+    else:
+        gmail_account = account_name
+
+    gmail = get_gmail_object(gmail_account)
+    labels = gmail.users().labels().list(userId="me").execute()
+
+    available_labels = [x.label_id for x in gmail_account.labels]
+
+    for label in labels["labels"]:
+        if label["name"] in ["DRAFT", "CHAT"]:
+            continue
+        if label["id"] in available_labels:
+            continue
+        gmail_account.append(
+            "labels", {"label_id": label["id"], "label_name": label["name"]}
+        )
+    if should_save:
+        gmail_account.save(ignore_permissions=True)
+
+
+def sync(user=None, time_limit=None, older=False):
+    """
+    Sync enabled labels of `user`'s mailbox, each from its own history cursor.
+
+    Labels without a cursor are backfilled newest first: their most recent threads are stored,
+    then they switch to incremental syncs. Their older threads are stored by `older` syncs, a
+    low priority job paging through them from where the last slice stopped, until
+    `time_limit` seconds have passed. Returns True if a backfill has work left.
+    """
+    if user:
+        frappe.set_user(user)
+    user = frappe.session.user
+    gmail_account = frappe.get_doc("Gmail Account", {"linked_user": user})
+    if not gmail_account.gmail_enabled:
+        frappe.throw(_("Please configure Gmail in Email Account."))
+    if not gmail_account.refresh_token:
+        frappe.throw(
+            _("Please authorize Gmail by clicking on 'Authorize Gmail' button.")
+        )
+    labels = [x for x in gmail_account.labels if x.enabled]
+    if older:
+        incremental_labels = []
+        backfill_labels = [x for x in labels if has_older_threads(x)]
+    else:
+        incremental_labels = [x for x in labels if x.last_historyid]
+        backfill_labels = [x for x in labels if not x.last_historyid]
+    if not incremental_labels and not backfill_labels:
+        return False
+
+    deadline = time.monotonic() + time_limit if time_limit else None
+    has_more = False
+
+    stats = SyncStats(
+        gmail_account.name, start_history_id=int(gmail_account.last_historyid or 0)
+    )
+    progress = None
+    pipeline = None
+    try:
+        gmail = get_gmail_object(gmail_account, stats=stats)
+        # parsing in other processes only pays off for the volume of a backfill
+        pipeline = SyncPipeline(
+            gmail,
+            processes=frappe.conf.get("gmail_thread_parse_processes", 0)
+            if backfill_labels
+            else 0,
+        )
+        # cheap incremental syncs go first
+        if incremental_labels:
+            try:
+                sync_history(pipeline, gmail_account, incremental_labels, stats)
+            except Exception:
+                stats.record_error(frappe.get_traceback())
+                frappe.log_error(frappe.get_traceback(), "Gmail Thread Sync Error")
+        start_backfills(gmail, backfill_labels, gmail_account)
+        if backfill_labels:
+            progress = BackfillProgress(gmail_account, backfill_labels)
+        for label in backfill_labels:
+            try:
+                if not backfill_label(
+                    pipeline, gmail_account, label, stats, deadline, progress
+                ):
+                    has_more = True
+                    break
+            except Exception:
+                stats.record_error(frappe.get_traceback())
+                frappe.log_error(frappe.get_traceback(), "Gmail Thread Sync Error")
+                continue
+    except Exception:
+        stats.record_error(frappe.get_traceback())
+        raise
+    finally:
+        if pipeline:
+            pipeline.close()
+        if progress:
+            progress.update(force=True)
+        stats.save(end_history_id=update_account_history_id(gmail_account, labels))
+    return has_more
+
+
+def has_older_threads(label):
+    # live labels keep the page token of their backfill until it reaches the oldest thread
+    return bool(label.last_historyid and label.backfill_page_token)
+
+
+def get_recent_backfill_threads():
+    return frappe.conf.get(
+        "gmail_thread_recent_backfill_threads", RECENT_BACKFILL_THREADS
+    )
+
+
+def get_account_limit(gmail_account, fieldname):
+    """
+    Backfill limit `fieldname` of `gmail_account`, or its default in Google Settings.
+    0 means no limit.
+    """
+    return gmail_account.get(fieldname) or (
+        frappe.db.get_single_value("Google Settings", f"custom_gmail_{fieldname}") or 0
+    )
+
+
+def get_backfill_after(gmail_account):
+    """
+    Unix time of the oldest mail a backfill of `gmail_account` stores, 0 for all mail.
+    """
+    days = get_account_limit(gmail_account, "backfill_days")
+    if not days:
+        return 0
+    return int(add_to_date(now_datetime(), days=-days).timestamp())
+
+
+def get_backfill_query(after, before=0):
+    terms = []
+    if after:
+        terms.append(f"after:{after}")
+    if before:
+        terms.append(f"before:{before}")
+    return " ".join(terms) or None
+
+
+def start_backfills(gmail, labels, gmail_account):
+    """
+    Remember the mailbox history id when a label starts its backfill, the label switches to
+    incremental syncs from there once its most recent threads are stored. The date window of
+    the backfill is fixed here too, so that all of its slices page through the same threads.
+    """
+    labels = [x for x in labels if not x.last_historyid and not x.backfill_history_id]
+    if not labels:
+        return
+    history_id = int(gmail.users().getProfile(userId="me").execute()["historyId"])
+    after = get_backfill_after(gmail_account)
+    max_threads = get_account_limit(gmail_account, "max_backfill_threads")
+    for label in labels:
+        threads, messages = get_label_totals(gmail, label.label_id, after)
+        if max_threads and threads > max_threads:
+            messages = messages * max_threads // threads
+            threads = max_threads
+        values = {
+            "backfill_history_id": history_id,
+            "backfill_after": after,
+            "backfill_before": 0,
+            "backfill_listed_until": 0,
+            "backfill_threads": 0,
+            "backfill_threads_total": threads,
+            "backfill_messages": 0,
+            "backfill_messages_total": messages,
+        }
+        label.update(values)
+        frappe.db.set_value("Gmail Label", label.name, values, update_modified=False)
+    frappe.db.commit()  # nosemgrep
+
+
+def get_label_totals(gmail, label_id, after=0):
+    """
+    Number of threads and messages of a label, the ones after `after` only if set, as
+    estimated by Gmail.
+    """
+    if not after:
+        label = gmail.users().labels().get(userId="me", id=label_id).execute()
+        return label.get("threadsTotal", 0), label.get("messagesTotal", 0)
+    totals = []
+    for resource in (gmail.users().threads(), gmail.users().messages()):
+        totals.append(
+            resource.list(
+                userId="me",
+                labelIds=label_id,
+                q=get_backfill_query(after),
+                maxResults=1,
+            )
+            .execute()
+            .get("resultSizeEstimate", 0)
+        )
+    return tuple(totals)
+
+
+def sync_history(pipeline, gmail_account, labels, stats):
+    """
+    Store messages added to any of `labels` since their cursors, and remove the ones deleted
+    or taken out of every synced label, with a single history scan of the mailbox instead of
+    one per label. Falls back to per label scans if the oldest cursor has expired.
+    """
+    cursors = {label.label_id: int(label.last_historyid) for label in labels}
+    try:
+        history_id, messages, removed = list_history(
+            pipeline.gmail, min(cursors.values())
+        )
+    except googleapiclient.errors.HttpError as e:
+        if "notFound" not in get_error_reasons(e):
+            raise
+        for label in labels:
+            sync_label_history(pipeline, gmail_account, label, stats)
+        return
+    # a label only needs the changes made after its own cursor
+    messages = [
+        message
+        for message, label_records in messages
+        if any(
+            label_id in cursors and cursors[label_id] < record_id
+            for label_id, record_id in label_records.items()
+        )
+    ]
+    ingest_history_messages(pipeline, gmail_account, messages, stats)
+    remove_history_messages(gmail_account, removed, stats)
+    for label in labels:
+        set_label_cursor(label, max(history_id, cursors[label.label_id]))
+
+
+def sync_label_history(pipeline, gmail_account, label, stats):
+    """
+    Store messages added to a label since its cursor, and remove the ones deleted or taken
+    out of every synced label, then move the cursor forward.
+    """
+    history_id = int(label.last_historyid)
+    try:
+        max_history_id, messages, removed = list_history(
+            pipeline.gmail, history_id, label.label_id
+        )
+    except googleapiclient.errors.HttpError as e:
+        # the cursor is too old, Gmail only keeps about a week of history
+        if "notFound" in get_error_reasons(e):
+            catch_up_label(pipeline, gmail_account, label, stats)
+            return
+        raise
+    ingest_history_messages(
+        pipeline, gmail_account, [message for message, _ in messages], stats
+    )
+    remove_history_messages(gmail_account, removed, stats)
+    set_label_cursor(label, max(max_history_id, history_id))
+
+
+def catch_up_label(pipeline, gmail_account, label, stats):
+    """
+    Store the messages of a label whose history cursor has expired, listing only those
+    received since the last message stored for the account, then restart its cursor from the
+    current history id. Backfills the label again if nothing was stored yet.
+
+    Labels added to older messages while the cursor was expired are not picked up, nor
+    messages deleted in the meantime.
+    """
+    metrics.incr("gmail_thread_history_expired_total", account=gmail_account.name)
+    last_message_at = frappe.db.get_value(
+        "Single Email CT", {"gmail_account": gmail_account.name}, "max(date_and_time)"
+    )
+    if not last_message_at:
+        set_label_cursor(label, 0)
+        return
+    # changes made while listing are picked up by the next incremental sync
+    history_id = int(
+        pipeline.gmail.users().getProfile(userId="me").execute()["historyId"]
+    )
+    after = int(get_datetime(last_message_at).timestamp()) - CATCH_UP_MARGIN
+    messages = []
+    page_token = None
+    while True:
+        listed = (
+            pipeline.gmail.users()
+            .messages()
+            .list(
+                userId="me",
+                labelIds=label.label_id,
+                q=get_backfill_query(after),
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        messages += listed.get("messages", [])
+        page_token = listed.get("nextPageToken")
+        if not page_token:
+            break
+    # Gmail lists newest first, threads are written oldest first
+    messages.reverse()
+    ingest_history_messages(pipeline, gmail_account, messages, stats)
+    set_label_cursor(label, history_id)
+
+
+def list_history(gmail, start_history_id, label_id=None):
+    """
+    Page through messages added and removed since `start_history_id`, optionally to a single
+    label. Returns the current history id, once per added message `(message, label_records)`
+    where `label_records` maps each label of the message to the last history record adding it,
+    and a dict of removed messages to the labels they kept, None if they were deleted.
+    """
+    history_id = start_history_id
+    messages = {}
+    removed = {}
+    page_token = None
+    while True:
+        history = (
+            gmail.users()
+            .history()
+            .list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=[
+                    "messageAdded",
+                    "labelAdded",
+                    "messageDeleted",
+                    "labelRemoved",
+                ],
+                labelId=label_id,
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        history_id = max(history_id, int(history.get("historyId", history_id)))
+        for record in history.get("history", []):
+            record_id = int(record["id"])
+            for change in record.get("messagesAdded", []) + record.get(
+                "labelsAdded", []
+            ):
+                message = change["message"]
+                _, label_records = messages.setdefault(message["id"], (message, {}))
+                for label in message.get("labelIds", []) + change.get("labelIds", []):
+                    label_records[label] = max(label_records.get(label, 0), record_id)
+                if removed.get(message["id"]) is not None:
+                    removed[message["id"]] = message.get("labelIds", [])
+            for change in record.get("labelsRemoved", []):
+                message = change["message"]
+                if message["id"] in messages:
+                    label_records = messages[message["id"]][1]
+                    for label in change.get("labelIds", []):
+                        label_records.pop(label, None)
+                if removed.get(message["id"], []) is not None:
+                    removed[message["id"]] = message.get("labelIds", [])
+            for change in record.get("messagesDeleted", []):
+                messages.pop(change["message"]["id"], None)
+                removed[change["message"]["id"]] = None
+        page_token = history.get("nextPageToken")
+        if not page_token:
+            return history_id, list(messages.values()), removed
+
+
+def ingest_history_messages(pipeline, gmail_account, messages, stats):
+    updated_docs = set()
+    messages = skip_stored_messages(gmail_account, messages, stats)
+    for message, raw_email, email_object in pipeline.process(
+        messages, *get_pipeline_stages(stats)
+    ):
+        if not raw_email:
+            continue
+        gmail_thread = ingest_email(
+            raw_email, message["threadId"], gmail_account, stats, email_object
+        )
+        if not gmail_thread:
+            continue
+        if gmail_thread.reference_doctype and gmail_thread.reference_name:
+            updated_docs.add(
+                (gmail_thread.reference_doctype, gmail_thread.reference_name)
+            )
+    for doctype, docname in updated_docs:
+        frappe.publish_realtime(
+            "gthread_new_email",
+            doctype=doctype,
+            docname=docname,
+        )
+
+
+def remove_history_messages(gmail_account, removed, stats):
+    """
+    Apply the removal policy to the stored messages deleted in Gmail, or left without any
+    enabled label of the account.
+    """
+    synced_labels = {x.label_id for x in gmail_account.labels if x.enabled}
+    message_ids = [
+        message_id
+        for message_id, label_ids in removed.items()
+        if label_ids is None or not synced_labels.intersection(label_ids)
+    ]
+    if message_ids:
+        stats.incr("messages_removed", remove_emails(gmail_account, message_ids))
+
+
+def set_label_cursor(label, history_id, **values):
+    label.last_historyid = history_id
+    label.update(values)
+    frappe.db.set_value(
+        "Gmail Label",
+        label.name,
+        dict(values, last_historyid=history_id),
+        update_modified=False,
+    )
+    frappe.db.commit()  # nosemgrep
+
+
+def update_account_history_id(gmail_account, labels):
+    """
+    The account is synced up to its least advanced label, 0 while any label is backfilling.
+    """
+    history_ids = [int(x.last_historyid or 0) for x in labels]
+    history_id = min(history_ids) if history_ids else 0
+    if history_id != int(gmail_account.last_historyid or 0):
+        gmail_account.db_set("last_historyid", history_id, update_modified=False)
+        frappe.db.commit()  # nosemgrep
+    return max(history_ids, default=0)
+
+
+def backfill_label(pipeline, gmail_account, label, stats, deadline=None, progress=None):
+    """
+    Page through the threads of a label, newest first, from where the last slice stopped.
+
+    A label without a cursor only stores its most recent threads, then goes live from the
+    history id seen when its backfill started. Older threads are paged through once it is
+    live. Only threads within the date window fixed when the backfill started are stored, up
+    to the thread limit of the account. Returns True once the current phase is complete, False
+    if `deadline` was reached first.
+    """
+    recent = not label.last_historyid
+    max_threads = get_account_limit(gmail_account, "max_backfill_threads")
+    while True:
+        page_size = get_recent_backfill_threads() if recent else None
+        if max_threads:
+            page_size = max(
+                min(
+                    page_size or THREADS_PAGE_SIZE,
+                    max_threads - (label.backfill_threads or 0),
+                ),
+                0,
+            )
+        thread_ids = []
+        page_token = None
+        if page_size != 0:
+            threads = list_backfill_threads(
+                pipeline.gmail, gmail_account, label, page_size
+            )
+            thread_ids = [thread["id"] for thread in threads.get("threads", [])]
+            page_token = threads.get("nextPageToken")
+        threads_data = list(pipeline.map(fetch_thread, thread_ids))
+        messages = [
+            message
+            for thread_data in threads_data
+            for message in thread_data["messages"]
+        ]
+        listed_until = get_listed_until(label, threads_data)
+        backfill_messages = (label.backfill_messages or 0) + len(messages)
+        messages = skip_stored_messages(gmail_account, messages, stats)
+        for message, raw_email, email_object in pipeline.process(
+            messages, *get_pipeline_stages(stats)
+        ):
+            if not raw_email:
+                continue
+            gmail_thread = ingest_email(
+                raw_email, message["threadId"], gmail_account, stats, email_object
+            )
+            if not gmail_thread:
+                continue
+            frappe.db.commit()  # nosemgrep
+            frappe.db.set_value(
+                "Gmail Thread",
+                gmail_thread.name,
+                "owner",
+                gmail_account.linked_user,
+                modified_by=gmail_account.linked_user,
+                update_modified=False,
+            )
+        backfill_threads = (label.backfill_threads or 0) + len(thread_ids)
+        if max_threads and backfill_threads >= max_threads:
+            # older threads are left out
+            page_token = None
+        if recent:
+            # later changes are picked up from the history id seen at the start
+            set_label_cursor(
+                label,
+                label.backfill_history_id,
+                backfill_history_id=0,
+                backfill_page_token=page_token,
+                backfill_listed_until=listed_until,
+                backfill_threads=backfill_threads,
+                backfill_messages=backfill_messages,
+            )
+            if progress:
+                progress.update()
+            return True
+        values = {
+            "backfill_page_token": page_token,
+            "backfill_listed_until": listed_until,
+            "backfill_threads": backfill_threads,
+            "backfill_messages": backfill_messages,
+        }
+        label.update(values)
+        frappe.db.set_value("Gmail Label", label.name, values, update_modified=False)
+        frappe.db.commit()  # nosemgrep
+        if progress:
+            progress.update()
+        if not page_token:
+            return True
+        if deadline and time.monotonic() > deadline:
+            return False
+        # new mail of the mailbox waits for this job to end
+        if has_pending_sync(gmail_account.linked_user):
+            return False
+
+
+def list_backfill_threads(gmail, gmail_account, label, page_size):
+    """
+    A page of the threads of a label backfill. Gmail rejects page tokens kept for too long,
+    the backfill then lists its threads again from before the oldest one it stored.
+    """
+
+    def list_threads():
+        return (
+            gmail.users()
+            .threads()
+            .list(
+                userId="me",
+                labelIds=label.label_id,
+                q=get_backfill_query(label.backfill_after, label.backfill_before),
+                pageToken=label.backfill_page_token or None,
+                maxResults=page_size,
+            )
+            .execute()
+        )
+
+    try:
+        return list_threads()
+    except googleapiclient.errors.HttpError as e:
+        if not label.backfill_page_token or e.resp.status != 400:
+            raise
+    metrics.incr("gmail_thread_backfill_restarted_total", account=gmail_account.name)
+    # threads are listed by their last message, newest first, the margin covers the day
+    # granularity of Gmail's date operators. Threads listed again are not downloaded again.
+    values = {
+        "backfill_page_token": None,
+        "backfill_before": (
+            label.backfill_listed_until + CATCH_UP_MARGIN
+            if label.backfill_listed_until
+            else 0
+        ),
+    }
+    label.update(values)
+    frappe.db.set_value("Gmail Label", label.name, values, update_modified=False)
+    frappe.db.commit()  # nosemgrep
+    return list_threads()
+
+
+def get_listed_until(label, threads_data):
+    """
+    Unix time of the last message of the oldest thread the backfill of `label` listed.
+    """
+    listed_until = [
+        max(int(message["internalDate"]) for message in thread_data["messages"]) // 1000
+        for thread_data in threads_data
+        if thread_data.get("messages")
+    ]
+    if label.backfill_listed_until:
+        listed_until.append(label.backfill_listed_until)
+    return min(listed_until, default=0)
+
+
+def estimate_backfill(gmail_account):
+    """
+    Estimate the number of messages, and their size in MB, a backfill of the enabled labels
+    of `gmail_account` downloads within its date window and thread limit.
+
+    Gmail only estimates list sizes, and labels are counted separately, so a message with
+    several labels counts once per label. The size is extrapolated from a sample of messages
+    and includes attachments over the size limit.
+    """
+    gmail = get_gmail_object(gmail_account)
+    query = get_backfill_query(get_backfill_after(gmail_account))
+    max_threads = get_account_limit(gmail_account, "max_backfill_threads")
+    messages = 0
+    sample = []
+    for label in gmail_account.labels:
+        if not label.enabled:
+            continue
+        listed = (
+            gmail.users()
+            .messages()
+            .list(
+                userId="me",
+                labelIds=label.label_id,
+                q=query,
+                maxResults=ESTIMATE_SAMPLE_MESSAGES,
+            )
+            .execute()
+        )
+        label_messages = listed.get("resultSizeEstimate", 0)
+        if max_threads and label_messages > max_threads:
+            threads = (
+                gmail.users()
+                .threads()
+                .list(userId="me", labelIds=label.label_id, q=query, maxResults=1)
+                .execute()
+                .get("resultSizeEstimate", 0)
+            )
+            if threads > max_threads:
+                label_messages = label_messages * max_threads // threads
+        messages += label_messages
+        sample += [
+            x["id"]
+            for x in listed.get("messages", [])[
+                : ESTIMATE_SAMPLE_MESSAGES - len(sample)
+            ]
+        ]
+    sizes = [
+        gmail.users()
+        .messages()
+        .get(userId="me", id=message_id, format="minimal")
+        .execute()
+        .get("sizeEstimate", 0)
+        for message_id in sample
+    ]
+    size = messages * sum(sizes) / len(sizes) / (1024 * 1024) if sizes else 0
+    return messages, size
+
+
+def fetch_thread(gmail, thread_id, http=None):
+    return (
+        gmail.users()
+        .threads()
+        .get(userId="me", id=thread_id, format=THREAD_FORMAT, fields=THREAD_FIELDS)
+        .execute(http=http)
+    )
+
+
+def skip_stored_messages(gmail_account, messages, stats):
+    """
+    Drop the messages the account stored already, e.g. by the backfill of another of their
+    labels, before they are downloaded again.
+    """
+    if not messages:
+        return messages
+    stored = set(
+        frappe.get_all(
+            "Single Email CT",
+            filters={
+                "gmail_account": gmail_account.name,
+                "gmail_message_id": ["in", [x["id"] for x in messages]],
+            },
+            pluck="gmail_message_id",
+        )
+    )
+    if stored:
+        stats.incr("duplicates_skipped", len(stored))
+    return [x for x in messages if x["id"] not in stored]
+
+
+def get_pipeline_stages(stats):
+    """
+    Fetch and parse stages of a `SyncPipeline` for messages listed by the Gmail API.
+    """
+
+    def fetch(gmail, message, http):
+        return fetch_raw_email(gmail, message["id"], stats, http=http)
+
+    return fetch, parse_message
+
+
+def fetch_raw_email(gmail, message_id, stats, http=None):
+    """
+    Download a message in raw format, returns None if it was deleted in the meantime.
+    """
+    try:
+        raw_email = (
+            gmail.users()
+            .messages()
+            .get(userId="me", id=message_id, format="raw")
+            .execute(http=http)
+        )
+    except googleapiclient.errors.HttpError as e:
+        if "notFound" in get_error_reasons(e):
+            return None
+        raise
+    stats.incr("messages_fetched")
+    return raw_email
+
+
+def ingest_email(raw_email, thread_id, gmail_account, stats, email_object=None):
+    """
+    Store a raw Gmail message in its Gmail Thread, creating the thread if needed.
+    `email_object` is the `ParsedMessage` of a sync pipeline, if the message is already parsed.
+    Returns the thread, or None if the message was skipped.
+    """
+    if "DRAFT" in raw_email.get("labelIds", []):
+        return None
+    if not email_object:
+        email_object = parse_email(raw_email)
+    stats.add_timing("parse", email_object.parse_time)
+    try:
+        with stats.timer("db"):
+            email, email_object = create_new_email(
+                raw_email, gmail_account, email_object
+            )
+    except AlreadyExistsError:
+        stats.incr("duplicates_skipped")
+        return None
+
+    gmail_thread = find_gmail_thread(
+        thread_id, [email_object.message_id] + email_object.references
+    )
+    is_new_thread = False
+    if not gmail_thread:
+        gmail_thread = frappe.new_doc("Gmail Thread")
+        gmail_thread.gmail_thread_id = thread_id
+        gmail_thread.gmail_account = gmail_account.name
+        is_new_thread = True
+    if not gmail_thread.subject_of_first_mail:
+        gmail_thread.subject_of_first_mail = email.subject
+        gmail_thread.creation = email.date_and_time
+    involved_users = set()
+    involved_users.add(email_object.from_email)
+    for recipient in email_object.to:
+        involved_users.add(recipient)
+    for recipient in email_object.cc:
+        involved_users.add(recipient)
+    for recipient in email_object.bcc:
+        involved_users.add(recipient)
+    involved_users.add(gmail_account.linked_user)
+    update_involved_users(gmail_thread, involved_users)
+    with stats.timer("attachment"):
+        process_attachments(
+            email,
+            gmail_thread,
+            email_object,
+            max_size=get_account_limit(gmail_account, "max_attachment_size")
+            * 1024
+            * 1024,
+        )
+        replace_inline_images(email, email_object)
+    update_thread_summary(gmail_thread, email)
+    with stats.timer("db"):
+        gmail_thread.save(ignore_permissions=True)
+        gmail_thread.add_email(email)
+        add_participants([email])
+        frappe.db.set_value(
+            "Gmail Thread",
+            gmail_thread.name,
+            "modified",
+            email.date_and_time,
+            update_modified=False,
+        )
+        if is_new_thread:  # update creation date
+            frappe.db.set_value(
+                "Gmail Thread",
+                gmail_thread.name,
+                "creation",
+                email.date_and_time,
+                update_modified=False,
+            )
+    stats.record_ingested(email.date_and_time)
+    return gmail_thread
+
+
+def update_involved_users(doc, involved_users):
+    involved_users = list(involved_users)
+    involved_users_linked = [x.account for x in doc.involved_users]
+    all_users = frappe.get_all(
+        "User",
+        filters={"email": ["in", involved_users], "user_type": ["!=", "Website User"]},
+        fields=["name"],
+    )
+    for user in all_users:
+        if user.name not in involved_users_linked:
+            involved_user = frappe.get_doc(doctype="Involved User", account=user.name)
+            doc.append("involved_users", involved_user)
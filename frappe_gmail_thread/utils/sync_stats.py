@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+
+from frappe_gmail_thread.utils import metrics
+
+STAGES = ("http", "parse", "db", "attachment")
+COUNTERS = (
+    "messages_fetched",
+    "messages_created",
+    "duplicates_skipped",
+    "messages_removed",
+    "api_calls",
+    "bytes_downloaded",
+)
+
+
+class SyncStats:
+    """
+    Metrics of a single `sync()` run, stored as a `Gmail Sync Log` when the run finishes.
+    Safe to update from the worker threads of a `SyncPipeline`.
+    """
+
+    def __init__(self, gmail_account, start_history_id=0):
+        self.gmail_account = gmail_account
+        self.start_history_id = start_history_id
+        self.started_at = now_datetime()
+        self.start = time.perf_counter()
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(float)
+        self.errors = []
+        self.api_errors = Counter()
+        self.last_message_at = None
+        self.lock = threading.Lock()
+
+    def incr(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.timings[stage] += time.perf_counter() - start
+
+    def add_timing(self, stage, seconds):
+        with self.lock:
+            self.timings[stage] += seconds
+
+    def record_api_call(self, nbytes):
+        with self.lock:
+            self.counters["api_calls"] += 1
+            self.counters["bytes_downloaded"] += nbytes
+
+    def record_api_error(self, reasons):
+        with self.lock:
+            self.api_errors.update(reasons)
+
+    def record_ingested(self, date_and_time):
+        date_and_time = get_datetime(date_and_time)
+        with self.lock:
+            self.counters["messages_created"] += 1
+            if not self.last_message_at or date_and_time > self.last_message_at:
+                self.last_message_at = date_and_time
+
+    def record_error(self, error):
+        with self.lock:
+            self.errors.append(error)
+
+    def get_status(self):
+        if not self.errors:
+            return "Success"
+        if self.counters["messages_created"]:
+            return "Partial"
+        return "Failed"
+
+    def save(self, end_history_id=0):
+        log = frappe.new_doc("Gmail Sync Log")
+        log.gmail_account = self.gmail_account
+        log.status = self.get_status()
+        log.started_at = self.started_at
+        log.ended_at = now_datetime()
+        log.wall_time = time.perf_counter() - self.start
+        log.start_history_id = self.start_history_id
+        log.end_history_id = end_history_id
+        for counter in COUNTERS:
+            log.set(counter, self.counters[counter])
+        for stage in STAGES:
+            log.set(f"{stage}_time", self.timings[stage])
+        log.error_count = len(self.errors)
+        log.error = "\n\n".join(self.errors)
+        log.insert(ignore_permissions=True)
+        frappe.db.commit()  # nosemgrep
+        self.publish_metrics()
+        return log
+
+    def publish_metrics(self):
+        account = self.gmail_account
+        metrics.incr(
+            "gmail_thread_messages_ingested_total",
+            self.counters["messages_created"],
+            account=account,
+        )
+        metrics.incr(
+            "gmail_thread_duplicates_skipped_total",
+            self.counters["duplicates_skipped"],
+            account=account,
+        )
+        metrics.incr(
+            "gmail_thread_api_calls_total", self.counters["api_calls"], account=account
+        )
+        for reason, count in self.api_errors.items():
+            metrics.record_api_error(account, reason, count)
+        if self.last_message_at:
+            metrics.set_gauge(
+                "gmail_thread_last_ingested_timestamp_seconds",
+                metrics.to_timestamp(self.last_message_at),
+                account=account,
+            )
+        if self.get_status() == "Success":
+            metrics.set_gauge(
+                "gmail_thread_last_sync_timestamp_seconds",
+                time.time(),
+                account=account,
+            )
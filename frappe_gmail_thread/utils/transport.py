@@ -0,0 +1,70 @@
+import os
+import threading
+
+import frappe
+import requests
+from googleapiclient.http import build_http
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# seconds to wait for a connection or a response from Google
+HTTP_TIMEOUT = 60
+# connections kept open per host, one per thread of a sync pipeline is enough
+POOL_SIZE = 16
+TOKEN_RETRIES = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    # a token refresh can be repeated safely
+    allowed_methods=None,
+)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_timeout():
+    return frappe.conf.get("gmail_thread_http_timeout") or HTTP_TIMEOUT
+
+
+def get_session():
+    """
+    `requests.Session` of the process, keeping connections to the OAuth endpoint alive between
+    token refreshes of all accounts.
+    """
+    global _session, _session_pid
+    # connections are never shared with a forked job process
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE,
+                    pool_maxsize=POOL_SIZE,
+                    max_retries=TOKEN_RETRIES,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def post(url, **kwargs):
+    kwargs.setdefault("timeout", get_timeout())
+    return get_session().post(url, **kwargs)
+
+
+def get_http():
+    """
+    `httplib2.Http` of the current thread, reused by every Gmail client it builds.
+
+    httplib2 is not thread safe, so each thread keeps its own. It holds no credentials, those
+    are added per request by the `AuthorizedHttp` wrapping it.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.http = build_http()
+        _local.http.timeout = get_timeout()
+        _local.pid = os.getpid()
+    return _local.http